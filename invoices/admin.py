@@ -1,15 +1,77 @@
-from django.contrib import admin
-from .models import Company, Customer, Invoice, InvoiceItem, ZATCALog
+from django.conf import settings
+from django.contrib import admin, messages
+from django.contrib.admin.views.main import ChangeList
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from . import batch, search
+from .models import (
+    BatchJob, ChangeEvent, Company, Customer, Invoice, InvoiceItem, InvoiceSequence, SequenceGap, VATSummary, ZATCALog,
+)
+
+
+# Invalid invoices listed one by one when a bulk submit skips them
+MAX_REPORTED_INVOICES = 10
+
+
+class IndexedSearchMixin:
+    """Answer the changelist search box from the search index instead of LIKE scans"""
+    search_kind = None
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return queryset, False
+        ids = search.matching_ids(self.search_kind, search_term, limit=settings.SEARCH_ADMIN_LIMIT)
+        return queryset.filter(pk__in=ids), False
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    On PostgreSQL, count an unfiltered changelist from the planner's row
+    estimate (pg_class.reltuples) once the table has ADMIN_ESTIMATED_COUNT_MIN
+    rows, instead of running COUNT(*) over the whole table
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql' and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                               [queryset.model._meta.db_table])
+                row = cursor.fetchone()
+            if row and row[0] >= settings.ADMIN_ESTIMATED_COUNT_MIN:
+                return row[0]
+        return super().count
+
+
+class DeferringChangeList(ChangeList):
+    def get_queryset(self, request, exclude_parameters=None):
+        queryset = super().get_queryset(request, exclude_parameters)
+        return queryset.defer(*self.model_admin.list_defer) if self.model_admin.list_defer else queryset
+
+
+class LargeTableMixin:
+    """Changelist for big tables: no full-table COUNT(*), and `list_defer` fields left unloaded"""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_defer = []
+
+    def get_changelist(self, request, **kwargs):
+        return DeferringChangeList
 
 
 @admin.register(Company)
-class CompanyAdmin(admin.ModelAdmin):
+class CompanyAdmin(IndexedSearchMixin, admin.ModelAdmin):
+    search_kind = 'company'
     list_display = ['name', 'vat_number', 'cr_number', 'city', 'created_at']
     search_fields = ['name', 'vat_number', 'cr_number']
 
 
 @admin.register(Customer)
-class CustomerAdmin(admin.ModelAdmin):
+class CustomerAdmin(IndexedSearchMixin, admin.ModelAdmin):
+    search_kind = 'customer'
     list_display = ['name', 'vat_number', 'city', 'email', 'phone', 'created_at']
     search_fields = ['name', 'vat_number', 'email']
 
@@ -20,17 +82,116 @@ class InvoiceItemInline(admin.TabularInline):
 
 
 @admin.register(Invoice)
-class InvoiceAdmin(admin.ModelAdmin):
+class InvoiceAdmin(LargeTableMixin, IndexedSearchMixin, admin.ModelAdmin):
+    search_kind = 'invoice'
     list_display = ['invoice_number', 'customer', 'invoice_type', 'issue_date', 'total', 'status', 'created_at']
     list_filter = ['status', 'invoice_type', 'issue_date']
+    list_select_related = ['customer']
+    list_defer = ['zatca_response', 'qr_code', 'parties', 'vat_share', 'notes']
     search_fields = ['invoice_number', 'customer__name']
     inlines = [InvoiceItemInline]
-    readonly_fields = ['uuid', 'qr_code', 'zatca_response', 'created_at', 'updated_at']
+    readonly_fields = ['uuid', 'qr_code', 'zatca_response', 'parties', 'created_at', 'updated_at']
+    actions = ['queue_submit', 'queue_refresh_status', 'queue_cancel', 'queue_recalculate']
+
+    def _queue(self, request, queryset, action, **params):
+        # Work goes to the batch queue (process_batch_jobs); nothing is sent to ZATCA here
+        rejected = []
+        queued = batch.enqueue(action, queryset, user=request.user, rejected=rejected, **params)
+        self.message_user(request, (
+            f"Queued {queued} '{dict(BatchJob.ACTION_CHOICES)[action]}' job(s). Invoices that do not "
+            f"qualify or already have one queued were skipped."))
+        for invoice, issues in rejected[:MAX_REPORTED_INVOICES]:
+            self.message_user(request, f"{invoice.invoice_number} was not queued: "
+                                       f"{'; '.join(str(issue) for issue in issues)}", messages.WARNING)
+        if len(rejected) > MAX_REPORTED_INVOICES:
+            self.message_user(request, f"{len(rejected) - MAX_REPORTED_INVOICES} more invoice(s) failed "
+                                       f"validation and were not queued.", messages.WARNING)
+
+    @admin.action(description="Submit selected drafts to ZATCA (queued)")
+    def queue_submit(self, request, queryset):
+        self._queue(request, queryset, 'submit')
+
+    @admin.action(description="Refresh ZATCA status of selected invoices (queued)")
+    def queue_refresh_status(self, request, queryset):
+        self._queue(request, queryset, 'refresh_status')
+
+    @admin.action(description="Cancel selected invoices in ZATCA (queued)")
+    def queue_cancel(self, request, queryset):
+        self._queue(request, queryset, 'cancel', reason=f"Cancelled from admin by {request.user}")
+
+    @admin.action(description="Recalculate amounts of selected drafts (queued)")
+    def queue_recalculate(self, request, queryset):
+        self._queue(request, queryset, 'recalculate')
 
 
 @admin.register(ZATCALog)
-class ZATCALogAdmin(admin.ModelAdmin):
+class ZATCALogAdmin(LargeTableMixin, admin.ModelAdmin):
     list_display = ['invoice', 'action', 'success', 'status_code', 'timestamp']
     list_filter = ['success', 'action', 'timestamp']
+    # The invoice column prints the buyer name, from the snapshot or the customer
+    list_select_related = ['invoice__customer']
+    list_defer = ['request_data', 'response_data', 'timings', 'invoice__zatca_response', 'invoice__qr_code', 'invoice__vat_share', 'invoice__notes']
     search_fields = ['invoice__invoice_number']
-    readonly_fields = ['invoice', 'action', 'request_data', 'response_data', 'status_code', 'success', 'error_message', 'timestamp']
+    readonly_fields = ['invoice', 'action', 'request_data', 'request_sha256', 'response_data', 'status_code', 'success', 'error_message', 'timings', 'timestamp']
+
+
+@admin.register(BatchJob)
+class BatchJobAdmin(LargeTableMixin, admin.ModelAdmin):
+    list_display = ['id', 'action', 'invoice', 'company', 'status', 'attempts', 'worker', 'created_at', 'finished_at']
+    list_filter = ['status', 'action']
+    list_select_related = ['invoice__customer', 'company']
+    list_defer = ['params', 'invoice__zatca_response', 'invoice__qr_code', 'invoice__vat_share', 'invoice__notes']
+    search_fields = ['invoice__invoice_number']
+    readonly_fields = [field.name for field in BatchJob._meta.fields]
+    actions = ['retry_failed']
+
+    def has_add_permission(self, request):
+        return False
+
+    @admin.action(description="Retry selected failed or stalled jobs")
+    def retry_failed(self, request, queryset):
+        # Stalled: still marked running although their lease has expired
+        count = batch.retry(queryset) + batch.requeue_expired(queryset)
+        self.message_user(request, f"Re-queued {count} job(s).")
+
+
+class SequenceGapInline(admin.TabularInline):
+    model = SequenceGap
+    extra = 0
+    readonly_fields = ['start', 'end', 'created_at']
+
+
+@admin.register(InvoiceSequence)
+class InvoiceSequenceAdmin(admin.ModelAdmin):
+    list_display = ['company', 'series', 'format', 'next_number', 'fill_gaps']
+    list_filter = ['company']
+    inlines = [SequenceGapInline]
+    # next_number is advanced only by invoices.sequences
+    readonly_fields = ['next_number']
+
+
+@admin.register(VATSummary)
+class VATSummaryAdmin(admin.ModelAdmin):
+    list_display = ['company', 'day', 'vat_rate', 'invoice_type', 'status', 'invoice_count', 'taxable_amount', 'vat_amount']
+    list_filter = ['status', 'invoice_type', 'vat_rate', 'company']
+    date_hierarchy = 'day'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(ChangeEvent)
+class ChangeEventAdmin(LargeTableMixin, admin.ModelAdmin):
+    list_display = ['id', 'kind', 'invoice_number', 'previous_status', 'status', 'created_at']
+    list_filter = ['kind', 'status']
+    list_defer = ['data']
+    search_fields = ['invoice_number']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
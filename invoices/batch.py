@@ -0,0 +1,311 @@
+"""
+Queued invoice operations.
+
+enqueue() records one BatchJob per eligible invoice; nothing is sent to
+ZATCA until a worker (the process_batch_jobs command) claims the jobs with
+claim() and runs them. Claiming is a conditional UPDATE of rows that are
+still pending, so several workers can drain the queue at once without taking
+the same job twice and without row locks. Failed jobs stay in the table
+with their error message and can be put back with retry().
+
+A claimed job holds a lease of BATCH_LEASE_SECONDS, renewed when it starts
+running and then every third of the lease while its handler runs, so a slow
+ZATCA call is not handed to a second worker. If its worker is killed the job stays 'running' until the lease
+passes; claim() then hands it out again like a pending job.
+
+Jobs without an invoice cover many invoices of their company; enqueue_reindex()
+queues them when a seller or buyer is renamed.
+
+Jobs for one company run in order. A job that fails for a reason that may
+pass (a network error, throttling, a ZATCA outage) is marked retryable and
+holds back the company's later jobs until it is retried (or deleted); other
+failures, such as an invoice that does not validate, fail again on retry and
+hold nothing.
+"""
+import os
+import socket
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Exists, F, OuterRef, Q
+from django.utils import timezone
+
+from . import search, serializers, validation
+from .metrics import REGISTRY
+from .models import BatchJob, Invoice, InvoiceItem
+
+
+JOBS = REGISTRY.counter('zatca_batch_jobs_total', 'Batch jobs run, by action and result (done/failed)')
+
+# Invoices each action applies to; others are not queued
+ELIGIBLE = {
+    'submit': Q(status='draft'),
+    'refresh_status': Q(status__in=['submitted', 'approved'], uuid__isnull=False),
+    'cancel': Q(status__in=['submitted', 'approved'], uuid__isnull=False),
+    'recalculate': Q(status='draft'),
+}
+
+ENQUEUE_BATCH_SIZE = 1000
+
+# ZATCA responses worth sending again
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+def enqueue(action, invoices, user=None, rejected=None, **params):
+    """
+    Queue `action` for every eligible invoice in the `invoices` queryset that
+    has no pending or running job for the same action. Returns the number of
+    jobs created.
+
+    Drafts are validated before 'submit' is queued; those that fail are
+    skipped and, if `rejected` is a list, added to it as (invoice, issues).
+    """
+    queued = BatchJob.objects.filter(action=action, status__in=['pending', 'running']).values('invoice_id')
+    rows = (invoices.filter(ELIGIBLE[action]).exclude(pk__in=queued)
+            .order_by('pk').values_list('pk', 'company_id').iterator(chunk_size=ENQUEUE_BATCH_SIZE))
+    count, chunk = 0, []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == ENQUEUE_BATCH_SIZE:
+            count += _create_jobs(action, chunk, user, rejected, params)
+            chunk = []
+    return count + _create_jobs(action, chunk, user, rejected, params)
+
+
+def _create_jobs(action, rows, user, rejected, params):
+    if action == 'submit' and rows:
+        valid, invalid = validation.validate_many(
+            serializers.payload_queryset(Invoice.objects.filter(pk__in=[invoice_id for invoice_id, _ in rows])))
+        if rejected is not None:
+            rejected.extend(invalid)
+        valid_ids = {invoice.pk for invoice, _ in valid}
+        rows = [row for row in rows if row[0] in valid_ids]
+    jobs = [BatchJob(action=action, invoice_id=invoice_id, company_id=company_id, params=params, created_by=user)
+            for invoice_id, company_id in rows]
+    return len(BatchJob.objects.bulk_create(jobs))
+
+
+def enqueue_reindex(company=None, customer=None):
+    """
+    Queue a rewrite of the search documents of every invoice of `company`, or
+    of `customer` (one job per seller it has invoices from), unless the same
+    rewrite is already pending. Returns the number of jobs created.
+    """
+    if company is not None:
+        targets = [(company.pk, {})]
+    else:
+        sellers = Invoice.objects.filter(customer=customer).values_list('company_id', flat=True).distinct()
+        targets = [(company_id, {'customer_id': customer.pk}) for company_id in sellers.order_by()]
+    jobs = [
+        BatchJob(action='reindex_search', company_id=company_id, params=params)
+        for company_id, params in targets
+        if not BatchJob.objects.filter(action='reindex_search', status='pending', company_id=company_id, params=params).exists()
+    ]
+    return len(BatchJob.objects.bulk_create(jobs))
+
+
+def worker_name(pid=None):
+    return f'{socket.gethostname()}:{pid or os.getpid()}'
+
+
+def lease_expiry(now=None):
+    return (now or timezone.now()) + timedelta(seconds=settings.BATCH_LEASE_SECONDS)
+
+
+def claimable(now=None):
+    """Pending jobs, and running jobs whose lease has passed (their worker is gone)"""
+    expired = Q(lease_expires_at__lt=now or timezone.now()) | Q(lease_expires_at__isnull=True)
+    return Q(status='pending') | (Q(status='running') & expired)
+
+
+def runnable(now=None):
+    """Claimable jobs that no earlier retryable failure of the same company is holding back"""
+    failed_before = BatchJob.objects.filter(
+        company_id=OuterRef('company_id'), status='failed', retryable=True, pk__lt=OuterRef('pk'))
+    return BatchJob.objects.filter(claimable(now)).exclude(Exists(failed_before))
+
+
+def claim(limit, worker=None, company_ids=None):
+    """
+    Mark up to `limit` claimable jobs, oldest first, as running for `worker`
+    and return them with their invoices loaded. Restricted to `company_ids`
+    when given.
+    """
+    worker = worker or worker_name()
+    now = timezone.now()
+    jobs = runnable(now)
+    if company_ids is not None:
+        jobs = jobs.filter(company_id__in=company_ids)
+    ids = list(jobs.order_by('pk').values_list('pk', flat=True)[:limit])
+    if not ids:
+        return []
+    BatchJob.objects.filter(claimable(now), pk__in=ids).update(
+        status='running', worker=worker, started_at=now, lease_expires_at=lease_expiry(now),
+        attempts=F('attempts') + 1)
+    return list(
+        BatchJob.objects.filter(pk__in=ids, status='running', worker=worker)
+        .select_related('invoice__company', 'invoice__customer').prefetch_related('invoice__items'))
+
+
+def _retryable(invoice, job, action):
+    """
+    Whether the failed `action` call of `job` may pass when sent again: it
+    got no response or a throttling/server error. A call refused before
+    sending (validation) leaves no log and is not retryable.
+    """
+    log = invoice.zatca_logs.filter(action=action, timestamp__gte=job.started_at).only('status_code').first()
+    return log is not None and (log.status_code is None or log.status_code in RETRYABLE_STATUS)
+
+
+def _submit(service, invoice, job):
+    if invoice.status != 'draft':
+        return True, f"Skipped: invoice is {invoice.status}"
+    success, message, _ = service.submit_invoice(invoice)
+    job.retryable = not success and _retryable(invoice, job, 'submit_invoice')
+    return success, message
+
+
+def _refresh_status(service, invoice, job):
+    success, message, data = service.check_invoice_status(invoice)
+    status = data.get('status')
+    if success and status in dict(Invoice.STATUS_CHOICES) and status != invoice.status:
+        invoice.status = status
+        invoice.save(update_fields=['status', 'updated_at'])
+        message = f"Status is now {status}"
+    return success, message
+
+
+def _cancel(service, invoice, job):
+    if invoice.status not in ('submitted', 'approved'):
+        return True, f"Skipped: invoice is {invoice.status}"
+    success, message, _ = service.cancel_invoice(invoice, job.params.get('reason', 'Cancelled in bulk'))
+    job.retryable = not success and _retryable(invoice, job, 'cancel_invoice')
+    return success, message
+
+
+def _recalculate(service, invoice, job):
+    if invoice.status != 'draft':
+        return True, f"Skipped: invoice is {invoice.status}"
+    items = list(invoice.items.all())
+    changed = []
+    for item in items:
+        stored = (item.total, item.vat_amount)
+        item.compute_amounts()
+        if (item.total, item.vat_amount) != stored:
+            changed.append(item)
+    with transaction.atomic():
+        InvoiceItem.objects.bulk_update(changed, ['total', 'vat_amount'])
+        invoice.apply_totals(items)
+        invoice.save(update_fields=['subtotal', 'vat_amount', 'total', 'updated_at'])
+    return True, f"{len(changed)} of {len(items)} lines changed; total {invoice.total}"
+
+
+def _reindex_search(service, invoice, job):
+    invoices = Invoice.objects.filter(company_id=job.company_id, **job.params)
+    search.reindex_invoices(invoices)
+    return True, "Search documents rewritten"
+
+
+HANDLERS = {
+    'submit': _submit,
+    'refresh_status': _refresh_status,
+    'cancel': _cancel,
+    'recalculate': _recalculate,
+    'reindex_search': _reindex_search,
+}
+
+
+def default_service():
+    # Not imported at module level: the admin imports this module at start-up
+    from .zatca_service import ZATCAService
+    return ZATCAService()
+
+
+def renew(job):
+    """Extend the lease of a job this worker still holds; False if it was taken over"""
+    return bool(BatchJob.objects.filter(pk=job.pk, status='running', worker=job.worker).update(
+        lease_expires_at=lease_expiry()))
+
+
+def _keep_lease(job, finished):
+    """Renew the lease of `job` every third of BATCH_LEASE_SECONDS until `finished` is set"""
+    try:
+        while not finished.wait(settings.BATCH_LEASE_SECONDS / 3) and renew(job):
+            pass
+    finally:
+        # This thread's own connection, if it opened one
+        connection.close()
+
+
+def run_job(job, service=None):
+    """Run one claimed job and record its outcome; returns None if the job was taken over"""
+    # The lease was taken when the whole batch was claimed; start this job's own
+    if not renew(job):
+        return None
+    job.retryable = False
+    finished = threading.Event()
+    keeper = threading.Thread(target=_keep_lease, args=(job, finished), daemon=True)
+    keeper.start()
+    try:
+        success, message = HANDLERS[job.action](service or default_service(), job.invoice, job)
+    except Exception as e:
+        success, message = False, f"Error: {e}"
+    finally:
+        finished.set()
+        keeper.join()
+    job.status = 'done' if success else 'failed'
+    job.message = message
+    job.finished_at = timezone.now()
+    job.lease_expires_at = None
+    job.save(update_fields=['status', 'message', 'retryable', 'finished_at', 'lease_expires_at'])
+    JOBS.inc(action=job.action, result=job.status)
+    return job
+
+
+def run_pending(limit=100, worker=None, company_ids=None, service=None, stopping=None):
+    """
+    Claim and run up to `limit` jobs; returns {'done': n, 'failed': n}. Once
+    a job fails retryably, the rest of its company's claimed jobs go back in
+    the queue (and are held there), as does everything left once `stopping()`
+    is true.
+    """
+    service = service or default_service()
+    results = {'done': 0, 'failed': 0}
+    failed_companies, unrun = set(), []
+    for job in claim(limit, worker, company_ids):
+        if job.company_id in failed_companies or (stopping is not None and stopping()):
+            unrun.append(job)
+            continue
+        job = run_job(job, service)
+        if job is not None:
+            results[job.status] += 1
+            if job.retryable:
+                failed_companies.add(job.company_id)
+    release(unrun)
+    return results
+
+
+def release(jobs):
+    """Put claimed jobs that were not run back in the queue, without counting the attempt"""
+    if jobs:
+        BatchJob.objects.filter(pk__in=[job.pk for job in jobs], status='running', worker=jobs[0].worker).update(
+            status='pending', worker='', started_at=None, lease_expires_at=None, attempts=F('attempts') - 1)
+
+
+def retry(jobs):
+    """Put failed jobs in the `jobs` queryset back in the queue; returns how many"""
+    return jobs.filter(status='failed').update(
+        status='pending', worker='', message='', retryable=False, started_at=None, lease_expires_at=None, finished_at=None)
+
+
+def requeue(jobs):
+    """Put running jobs in the `jobs` queryset (e.g. of a worker that died) back in the queue"""
+    return jobs.filter(status='running').update(status='pending', worker='', started_at=None, lease_expires_at=None)
+
+
+def requeue_expired(jobs=None):
+    """Put running jobs whose lease has passed back in the queue; returns how many"""
+    jobs = BatchJob.objects.all() if jobs is None else jobs
+    return requeue(jobs.filter(claimable()))
@@ -0,0 +1,262 @@
+"""
+Benchmark suite for the invoice lifecycle hot paths.
+
+seed() fills the current database with synthetic companies, customers and
+invoices; run_suite() times the model, service, view and API hot paths
+against that data and returns a JSON-serializable report in the same shape
+as pytest-benchmark's (machine_info + benchmarks[].stats), so runs can be
+stored and compared over time with compare().
+
+Use the run_benchmarks management command rather than calling these against
+a production database.
+"""
+import platform
+import random
+import statistics
+import subprocess
+import time
+from contextlib import contextmanager
+from datetime import date, datetime, time as dtime, timedelta
+from pathlib import Path
+
+import django
+from django.conf import settings
+from django.db import connection
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from . import calculator, serializers
+from .mock_zatca import MockZATCAServer
+from .models import Company, Customer, Invoice, InvoiceItem
+from .zatca_service import ZATCAService
+
+
+BENCH_PREFIX = 'BENCH-'
+
+# Lines fed to the bulk calculator case, whatever the size of the seeded data
+BULK_LINES = 10000
+
+CUSTOMER_NAMES = ['Trading Est.', 'مؤسسة التجارة', 'Contracting Co.', 'شركة المقاولات', 'Retail LLC', 'متجر التجزئة']
+ITEM_NAMES = ['Consulting hours', 'خدمات استشارية', 'Office supplies', 'مستلزمات مكتبية', 'Data plan', 'باقة بيانات']
+
+
+@contextmanager
+def benchmark_database(keepdb=False):
+    """
+    Point the default connection at a separate, freshly migrated database for
+    the duration of the block (like the test runner does). On SQLite the
+    database is the on-disk benchmark.sqlite3 rather than an in-memory one.
+    """
+    test_settings = connection.settings_dict['TEST']
+    if connection.vendor == 'sqlite' and not test_settings.get('NAME'):
+        test_settings['NAME'] = str(Path(settings.BASE_DIR) / 'benchmark.sqlite3')
+
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=keepdb)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=keepdb)
+
+
+def _vat_number(index):
+    return f'3{index:013d}3'
+
+
+def seed(lines, lines_per_invoice=10, companies=10, customers=1000, batch_size=5000, seed_value=42, stdout=None):
+    """
+    Create synthetic data totalling `lines` invoice items, spread over
+    lines // lines_per_invoice invoices. Rows are written with bulk_create
+    and totals are computed up front, so seeding millions of lines does not
+    go through InvoiceItem.save().
+    """
+    rng = random.Random(seed_value)
+
+    company_objs = Company.objects.bulk_create([
+        Company(
+            name=f'Seller {index}', vat_number=_vat_number(index), cr_number=f'10100{index:05d}',
+            address='Riyadh', city='Riyadh', postal_code='12345', building_number='1234',
+            street_name='King Fahd Road', district='Olaya',
+        )
+        for index in range(companies)
+    ])
+    customer_objs = []
+    for start in range(0, customers, batch_size):
+        created = Customer.objects.bulk_create([
+            Customer(
+                name=f'{rng.choice(CUSTOMER_NAMES)} {index}', vat_number=_vat_number(10 ** 6 + index),
+                address='Jeddah', city='Jeddah', postal_code='23456', building_number='5678',
+                street_name='Tahlia Street', district='Rawdah',
+            )
+            for index in range(start, min(start + batch_size, customers))
+        ])
+        customer_objs.extend(created)
+
+    invoice_count = max(lines // lines_per_invoice, 1)
+    invoices_per_batch = max(batch_size // lines_per_invoice, 1)
+    types = [choice for choice, _ in Invoice.INVOICE_TYPES]
+    statuses = ['draft', 'draft', 'submitted', 'approved', 'approved', 'approved', 'rejected', 'cancelled']
+    first_day = date(2025, 1, 1)
+
+    for start in range(0, invoice_count, invoices_per_batch):
+        # Draw the batch's lines as scaled integers, then price them all in one
+        # calculator.calculate_lines() call, the same path imports use.
+        headers, descriptions, quantities, prices, rates = [], [], [], [], []
+        for index in range(start, min(start + invoices_per_batch, invoice_count)):
+            for line in range(lines_per_invoice):
+                quantities.append(rng.randint(1, 20) * 100)
+                prices.append(rng.randint(100, 100000))
+                rates.append(1500 if line % 10 else 0)
+                descriptions.append(f'{rng.choice(ITEM_NAMES)} {line + 1}')
+            headers.append((index, rng.choice(types), rng.choice(customer_objs), rng.choice(statuses)))
+        nets, vats = calculator.calculate_lines(quantities, prices, [0] * len(quantities), rates)
+
+        invoices, pending_items = [], []
+        for position, (index, invoice_type, customer, status) in enumerate(headers):
+            lines = slice(position * lines_per_invoice, (position + 1) * lines_per_invoice)
+            totals = calculator.invoice_totals(nets[lines], rates[lines])
+            company = company_objs[index % companies]
+            invoices.append(Invoice(
+                invoice_number=f'{BENCH_PREFIX}{index:09d}', invoice_type=invoice_type,
+                issue_date=first_day + timedelta(days=index % 365), issue_time=dtime(9, 0),
+                company=company, customer=customer, subtotal=calculator.to_decimal(totals.subtotal),
+                vat_amount=calculator.to_decimal(totals.vat), total=calculator.to_decimal(totals.total), status=status,
+                parties=None if status == 'draft' else Invoice.snapshot_parties(company, customer),
+            ))
+            pending_items.append([
+                InvoiceItem(
+                    description=descriptions[line], quantity=calculator.to_decimal(quantities[line]),
+                    unit_price=calculator.to_decimal(prices[line]), vat_rate=calculator.to_decimal(rates[line]),
+                    vat_amount=calculator.to_decimal(vats[line]), total=calculator.to_decimal(nets[line]),
+                )
+                for line in range(lines.start, lines.stop)
+            ])
+
+        Invoice.objects.bulk_create(invoices)
+        batch = []
+        for invoice, items in zip(invoices, pending_items):
+            for item in items:
+                item.invoice = invoice
+            batch.extend(items)
+        InvoiceItem.objects.bulk_create(batch, batch_size=batch_size)
+        if stdout is not None:
+            stdout.write(f'  seeded {min(start + invoices_per_batch, invoice_count)}/{invoice_count} invoices')
+
+
+def measure(func, rounds=5, warmup=1):
+    """Run func warmup + rounds times and return timing statistics (seconds) for the measured rounds"""
+    for _ in range(warmup):
+        func()
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    mean = statistics.fmean(timings)
+    return {
+        'min': min(timings),
+        'max': max(timings),
+        'mean': mean,
+        'stddev': statistics.stdev(timings) if len(timings) > 1 else 0.0,
+        'median': statistics.median(timings),
+        'rounds': rounds,
+        'ops': 1 / mean if mean else None,
+        'data': timings,
+    }
+
+
+def _git_commit():
+    try:
+        result = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, timeout=5)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return result.stdout.strip() or None
+
+
+def _get(client, url):
+    def run():
+        response = client.get(url)
+        assert response.status_code == 200, f'{url} returned {response.status_code}'
+        if response.streaming:
+            # Consume streamed responses so their rendering is included
+            b''.join(response.streaming_content)
+    return run
+
+
+def benchmark_cases(invoice, api_url):
+    """Return (name, group, callable) for every benchmarked hot path"""
+    service = ZATCAService(api_url=api_url)
+    client = Client()
+    pk = invoice.pk
+
+    def submit():
+        success, message, _ = service.submit_invoice(serializers.payload_queryset().get(pk=pk))
+        assert success, message
+
+    # A bounded sample of seeded lines as scaled integers, for the bulk calculator case
+    columns = list(zip(*(
+        [calculator.to_units(value) for value in row]
+        for row in InvoiceItem.objects.order_by('pk').values_list(
+            'quantity', 'unit_price', 'discount', 'vat_rate')[:BULK_LINES]
+    )))
+
+    return [
+        ('calculate_totals', 'model', lambda: Invoice.objects.get(pk=pk).calculate_totals()),
+        ('calculate_lines_bulk', 'model', lambda: calculator.calculate_lines(*columns)),
+        ('prepare_invoice_data', 'service', lambda: service.prepare_invoice_data(Invoice.objects.get(pk=pk))),
+        ('serialize_invoice', 'service', lambda: serializers.serialize_invoice(serializers.payload_queryset().get(pk=pk))),
+        ('generate_qr_code', 'service', lambda: service.generate_qr_code(Invoice.objects.get(pk=pk))),
+        ('invoice_list_view', 'view', _get(client, reverse('invoice_list'))),
+        ('dashboard_view', 'view', _get(client, reverse('home'))),
+        ('invoice_detail_view', 'view', _get(client, reverse('invoice_detail', args=[pk]))),
+        ('invoice_print_view', 'view', _get(client, reverse('invoice_print', args=[pk]))),
+        ('submit_invoice', 'api', submit),
+    ]
+
+
+def run_suite(rounds=5, warmup=1, only=None, scale=None, stdout=None):
+    """Time every hot path against the seeded data and return the report dict"""
+    invoice = Invoice.objects.filter(invoice_number__startswith=BENCH_PREFIX).order_by('pk').first()
+    if invoice is None:
+        raise ValueError('No benchmark data found; run seed() first')
+
+    results = []
+    with MockZATCAServer() as server, override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+        for name, group, func in benchmark_cases(invoice, server.url):
+            if only and name not in only:
+                continue
+            stats = measure(func, rounds=rounds, warmup=warmup)
+            results.append({'name': name, 'group': group, 'stats': stats})
+            if stdout is not None:
+                stdout.write(f"  {name:<24} median {stats['median'] * 1000:10.2f} ms  (min {stats['min'] * 1000:.2f} ms)")
+
+    return {
+        'machine_info': {
+            'python_version': platform.python_version(),
+            'python_implementation': platform.python_implementation(),
+            'django_version': django.get_version(),
+            'platform': platform.platform(),
+            'machine': platform.machine(),
+            'database': connection.vendor,
+        },
+        'commit_info': {'id': _git_commit()},
+        'datetime': datetime.now().astimezone().isoformat(),
+        'settings': {'module': settings.SETTINGS_MODULE, 'debug': settings.DEBUG},
+        'scale': scale or {},
+        'benchmarks': results,
+    }
+
+
+def compare(baseline, current):
+    """Return (name, baseline median, current median, change in percent) for benchmarks present in both reports"""
+    previous = {bench['name']: bench['stats']['median'] for bench in baseline.get('benchmarks', [])}
+    rows = []
+    for bench in current['benchmarks']:
+        old = previous.get(bench['name'])
+        if old is None:
+            continue
+        new = bench['stats']['median']
+        rows.append((bench['name'], old, new, (new - old) / old * 100 if old else 0.0))
+    return rows
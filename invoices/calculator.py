@@ -0,0 +1,119 @@
+"""
+Exact invoice line and total calculation in scaled integers.
+
+Amounts are handled as integer halalas (1/100 SAR), quantities as hundredths
+and VAT rates as hundredths of a percent, so there is no binary floating
+point and no Decimal context involved. Rounding follows ZATCA's rules for
+two-decimal amounts, half away from zero:
+
+- line net amount = quantity x unit price - line discount, rounded per line
+- line VAT amount = line net amount x rate, rounded per line
+- VAT per category (rate) = sum of the category's net amounts x rate,
+  rounded once; the invoice VAT total is the sum of the categories, which is
+  what the authority recomputes from the submitted XML
+- invoice total = net total + VAT total - invoice-level discount
+
+calculate_lines() works on whole columns at once; with NumPy installed and
+enough lines it runs on int64 arrays, falling back to Python integers when
+the values could overflow 64 bits. NumPy is only imported the first time
+such a column comes along, since models imports this module at start-up.
+"""
+from collections import namedtuple
+from decimal import ROUND_HALF_UP, Decimal
+from functools import lru_cache
+
+
+# Below this many lines the NumPy round trip costs more than it saves
+NUMPY_MIN_LINES = 512
+
+_INT64_SAFE = 2 ** 62
+
+Totals = namedtuple('Totals', ['subtotal', 'vat', 'discount', 'total', 'by_rate'])
+Totals.__doc__ = "Invoice totals in halalas; by_rate maps rate (hundredths of a percent) to (net, vat)"
+
+
+def to_units(value, places=2):
+    """Scale a Decimal (or str/int) to an integer number of 10**-places units, rounding half up"""
+    return int(Decimal(value).scaleb(places).to_integral_value(rounding=ROUND_HALF_UP))
+
+
+def to_decimal(units, places=2):
+    """Inverse of to_units: 1234 -> Decimal('12.34')"""
+    return Decimal(units).scaleb(-places)
+
+
+def to_float(units, places=2):
+    """JSON-friendly amount; exact in its shortest repr for any realistic invoice amount"""
+    return units / 10 ** places
+
+
+def round_div(numerator, denominator):
+    """numerator / denominator rounded half away from zero (denominator > 0)"""
+    quotient = (abs(numerator) + denominator // 2) // denominator
+    return quotient if numerator >= 0 else -quotient
+
+
+@lru_cache(maxsize=None)
+def _numpy():
+    """The numpy module, or None when it is not installed"""
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def _round_div_array(numpy, numerator, denominator):
+    return numpy.sign(numerator) * ((numpy.abs(numerator) + denominator // 2) // denominator)
+
+
+def line_amounts(quantity, unit_price, discount, vat_rate):
+    """(net, vat) in halalas for one line given as Decimals"""
+    net = round_div(to_units(quantity) * to_units(unit_price), 100) - to_units(discount)
+    return net, round_div(net * to_units(vat_rate), 10000)
+
+
+def calculate_lines(quantities, unit_prices, discounts, vat_rates):
+    """
+    Vectorized line_amounts() over equal-length sequences of scaled integers
+    (quantities in hundredths, prices and discounts in halalas, rates in
+    hundredths of a percent). Returns (nets, vats) as lists of halalas.
+    """
+    numpy = _numpy() if len(quantities) >= NUMPY_MIN_LINES else None
+    if numpy is not None:
+        quantity = numpy.asarray(quantities, dtype=numpy.int64)
+        price = numpy.asarray(unit_prices, dtype=numpy.int64)
+        rate = numpy.asarray(vat_rates, dtype=numpy.int64)
+        if int(numpy.abs(quantity).max()) * int(numpy.abs(price).max()) < _INT64_SAFE:
+            net = _round_div_array(numpy, quantity * price, 100) - numpy.asarray(discounts, dtype=numpy.int64)
+            if int(numpy.abs(net).max()) * int(numpy.abs(rate).max()) < _INT64_SAFE:
+                return net.tolist(), _round_div_array(numpy, net * rate, 10000).tolist()
+
+    nets = [round_div(q * p, 100) - d for q, p, d in zip(quantities, unit_prices, discounts)]
+    return nets, [round_div(net * r, 10000) for net, r in zip(nets, vat_rates)]
+
+
+def invoice_totals(nets, vat_rates, discount=0):
+    """Totals for one invoice from its line nets and rates (scaled integers)"""
+    taxable = {}
+    for net, rate in zip(nets, vat_rates):
+        taxable[rate] = taxable.get(rate, 0) + net
+    by_rate = {rate: (amount, round_div(amount * rate, 10000)) for rate, amount in taxable.items()}
+    subtotal = sum(taxable.values())
+    vat = sum(vat for _, vat in by_rate.values())
+    return Totals(subtotal, vat, discount, subtotal + vat - discount, by_rate)
+
+
+def calculate(items, discount=Decimal('0')):
+    """
+    One pass over InvoiceItem-like objects (quantity, unit_price, discount,
+    vat_rate). Returns (nets, vats, Totals), all in halalas.
+    """
+    quantities, prices, discounts, rates = [], [], [], []
+    for item in items:
+        quantities.append(to_units(item.quantity))
+        prices.append(to_units(item.unit_price))
+        discounts.append(to_units(item.discount))
+        rates.append(to_units(item.vat_rate))
+    nets, vats = calculate_lines(quantities, prices, discounts, rates)
+    return nets, vats, invoice_totals(nets, rates, to_units(discount))
@@ -0,0 +1,128 @@
+"""
+Incremental change feed for downstream (ERP) sync.
+
+Invoice status transitions and finished ZATCA calls are appended to
+ChangeEvent by signals. A consumer follows one company: it keeps the id of
+the last event it processed as its cursor and asks for what came after it,
+so each poll is one (company, id) index range scan however large the invoice
+tables grow, and nothing is missed or sent twice between polls.
+
+For the cursor to be safe, events have to become visible in id order. On
+PostgreSQL record() takes a transaction-level advisory lock on the invoice's
+company before inserting, so within a company a transaction that took a
+lower id always commits before one with a higher id can insert, while
+different companies never wait for each other; SQLite serializes writers
+already. Across companies a late commit can land below a cursor, which is
+why the feed is read one company at a time.
+
+Waiting requests hold a worker thread (or greenlet). While nothing arrives
+the poll interval doubles up to CHANGE_FEED_IDLE_POLL_INTERVAL, and the
+database connection is given back only before such a long pause. Streams end
+after CHANGE_FEED_STREAM_SECONDS; serving many open streams needs an async or
+gevent worker.
+"""
+import time
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from . import serializers
+from .models import ChangeEvent
+
+
+# Arbitrary first key for pg_advisory_xact_lock(int, int); the second is the company
+LOCK_KEY = 0x7a617463
+
+
+def record(kind, invoice, status=None, previous_status='', **data):
+    """Append an event for `invoice` and return it"""
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                # Companies whose ids collide in 31 bits merely share a lock
+                cursor.execute('SELECT pg_advisory_xact_lock(%s, %s)', [LOCK_KEY, invoice.company_id & 0x7fffffff])
+        return ChangeEvent.objects.create(
+            kind=kind, invoice_id=invoice.pk, company_id=invoice.company_id,
+            invoice_number=invoice.invoice_number, status=status or invoice.status,
+            previous_status=previous_status or '', data=data)
+
+
+def since(company_id, cursor=0, limit=100):
+    """
+    Events of one company after `cursor`, oldest first. Returns (events,
+    more) where `more` says whether further events were already waiting.
+    """
+    events = list(ChangeEvent.objects.filter(company_id=company_id, pk__gt=cursor).order_by('pk')[:limit + 1])
+    return events[:limit], len(events) > limit
+
+
+def _pause(idle_polls, remaining=None):
+    """
+    Sleep until the next poll: CHANGE_FEED_POLL_INTERVAL, doubled for every
+    poll that found nothing up to CHANGE_FEED_IDLE_POLL_INTERVAL, and no
+    longer than `remaining`. The database connection is closed only before
+    the longest pauses, so a feed that is busy keeps its connection.
+    """
+    longest = settings.CHANGE_FEED_IDLE_POLL_INTERVAL
+    interval = min(settings.CHANGE_FEED_POLL_INTERVAL * 2 ** min(idle_polls, 16), longest)
+    if remaining is not None:
+        interval = max(min(interval, remaining), 0)
+    if interval >= longest and not connection.in_atomic_block:
+        connection.close()
+    time.sleep(interval)
+
+
+def wait_for(company_id, cursor=0, limit=100, timeout=0):
+    """since(), polling for up to `timeout` seconds until there is something"""
+    deadline = time.monotonic() + timeout
+    polls = 0
+    while True:
+        events, more = since(company_id, cursor, limit)
+        if events or time.monotonic() >= deadline:
+            return events, more
+        _pause(polls, deadline - time.monotonic())
+        polls += 1
+
+
+def as_dict(event):
+    return {
+        'id': event.pk,
+        'kind': event.kind,
+        'invoice_id': event.invoice_id,
+        'invoice_number': event.invoice_number,
+        'company_id': event.company_id,
+        'status': event.status,
+        'previous_status': event.previous_status,
+        'data': event.data,
+        'created_at': event.created_at.isoformat(),
+    }
+
+
+def stream(company_id, cursor=0, duration=None):
+    """
+    Yield the company's feed as server-sent events, starting after `cursor`, for
+    `duration` seconds (CHANGE_FEED_STREAM_SECONDS by default). A comment line
+    is sent when there has been nothing for a while so proxies keep the
+    connection open; the client reconnects with Last-Event-ID afterwards.
+    """
+    duration = settings.CHANGE_FEED_STREAM_SECONDS if duration is None else duration
+    deadline = time.monotonic() + duration
+    idle_since = time.monotonic()
+    idle_polls = 0
+    yield f'retry: {int(settings.CHANGE_FEED_POLL_INTERVAL * 1000)}\n\n'
+    while True:
+        events, more = since(company_id, cursor, settings.CHANGE_FEED_PAGE_SIZE)
+        for event in events:
+            cursor = event.pk
+            yield f"id: {event.pk}\nevent: {event.kind}\ndata: {serializers.dumps(as_dict(event)).decode('utf-8')}\n\n"
+        now = time.monotonic()
+        if events:
+            idle_since = now
+        elif now - idle_since >= settings.CHANGE_FEED_HEARTBEAT:
+            idle_since = now
+            yield ': keepalive\n\n'
+        if now >= deadline:
+            return
+        if not more:
+            _pause(idle_polls, deadline - now)
+        idle_polls = 0 if events else idle_polls + 1
@@ -1,7 +1,51 @@
 from django import forms
+from django.urls import reverse
+from . import refcache, search
 from .models import Company, Customer, Invoice, InvoiceItem
 
 
+class AutocompleteSelect(forms.Select):
+    """
+    A <select> that renders only the selected option. static/js/main.js adds a
+    search box that fetches matching options from `url` as the user types, so
+    the page never ships the whole table.
+    """
+
+    def __init__(self, url, cache, attrs=None):
+        super().__init__(attrs)
+        self.url = url
+        self.cache = cache
+
+    def get_context(self, name, value, attrs):
+        context = super().get_context(name, value, attrs)
+        context['widget']['attrs']['data-autocomplete-url'] = reverse(self.url)
+        return context
+
+    def optgroups(self, name, value, attrs=None):
+        selected = [int(pk) for pk in value if str(pk).isdigit()]
+        options = [self.create_option(name, '', '---------', not selected, 0)]
+        for index, obj in enumerate(self.cache.get_many(selected).values(), start=1):
+            options.append(self.create_option(name, obj.pk, str(obj), True, index))
+        return [(None, options, 0)]
+
+
+class CachedModelChoiceField(forms.ModelChoiceField):
+    """ModelChoiceField that resolves the submitted pk through a refcache.ModelCache"""
+
+    def __init__(self, cache, **kwargs):
+        self.cache = cache
+        kwargs.setdefault('widget', AutocompleteSelect(f'{cache.label}_autocomplete', cache, attrs={'class': 'form-control'}))
+        super().__init__(queryset=cache.model.objects.all(), **kwargs)
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        obj = self.cache.get(int(value)) if str(value).isdigit() else None
+        if obj is None:
+            raise forms.ValidationError(self.error_messages['invalid_choice'], code='invalid_choice')
+        return obj
+
+
 class CompanyForm(forms.ModelForm):
     class Meta:
         model = Company
@@ -42,6 +86,9 @@ class CustomerForm(forms.ModelForm):
 
 
 class InvoiceForm(forms.ModelForm):
+    company = CachedModelChoiceField(refcache.companies)
+    customer = CachedModelChoiceField(refcache.customers)
+
     class Meta:
         model = Invoice
         fields = ['invoice_number', 'invoice_type', 'issue_date', 'issue_time', 
@@ -51,12 +98,16 @@ class InvoiceForm(forms.ModelForm):
             'invoice_type': forms.Select(attrs={'class': 'form-control'}),
             'issue_date': forms.DateInput(attrs={'class': 'form-control', 'type': 'date'}),
             'issue_time': forms.TimeInput(attrs={'class': 'form-control', 'type': 'time'}),
-            'company': forms.Select(attrs={'class': 'form-control'}),
-            'customer': forms.Select(attrs={'class': 'form-control'}),
             'discount': forms.NumberInput(attrs={'class': 'form-control', 'step': '0.01'}),
             'notes': forms.Textarea(attrs={'class': 'form-control', 'rows': 3}),
         }
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if not self.instance.pk:
+            self.fields['invoice_number'].required = False
+            self.fields['invoice_number'].help_text = "Leave blank to use the company's next number"
+
 
 class InvoiceItemForm(forms.ModelForm):
     class Meta:
@@ -71,11 +122,94 @@ class InvoiceItemForm(forms.ModelForm):
         }
 
 
+class BaseInvoiceItemFormSet(forms.BaseInlineFormSet):
+    """Inline formset that saves only the lines that changed, in bulk"""
+
+    def add_fields(self, form, index):
+        super().add_fields(form, index)
+        # Resolve the hidden id of existing lines from the formset's own
+        # queryset instead of one SELECT per line.
+        pk_field = form.fields[self.model._meta.pk.name]
+        pk_field.to_python = self._existing_line
+
+    def _existing_line(self, value):
+        if value in forms.Field.empty_values:
+            return None
+        if not hasattr(self, '_lines_by_pk'):
+            self._lines_by_pk = {str(item.pk): item for item in self.get_queryset()}
+        try:
+            return self._lines_by_pk[str(value)]
+        except KeyError:
+            raise forms.ValidationError(
+                'Select a valid choice. That choice is not one of the available choices.', code='invalid_choice')
+
+    def save_diff(self):
+        """
+        Write added lines with one bulk_create, changed lines with one
+        bulk_update and removed lines with one DELETE, then set the invoice's
+        totals from the lines already in memory. The caller saves the invoice.
+        Returns the (created, updated, deleted) lines.
+        """
+        invoice = self.instance
+        created, updated, deleted, renamed, kept = [], [], [], [], []
+
+        for form in self.initial_forms:
+            item = form.instance
+            if self.can_delete and self._should_delete_form(form):
+                deleted.append(item)
+                continue
+            if form.has_changed():
+                item.compute_amounts()
+                updated.append(item)
+                if 'description' in form.changed_data:
+                    renamed.append(item)
+            kept.append(item)
+
+        for form in self.extra_forms:
+            if not form.has_changed() or (self.can_delete and self._should_delete_form(form)):
+                continue
+            item = form.instance
+            item.invoice = invoice
+            item.compute_amounts()
+            created.append(item)
+
+        if deleted:
+            ids = [item.pk for item in deleted]
+            InvoiceItem.objects.filter(pk__in=ids).delete()
+            # Skipped by the post_delete receiver for queryset deletes
+            search.remove_items(ids)
+        if updated:
+            InvoiceItem.objects.bulk_update(updated, self.form._meta.fields + ['vat_amount', 'total'], batch_size=500)
+        if created:
+            InvoiceItem.objects.bulk_create(created, batch_size=500)
+        # Bulk writes skip the post_save receiver that keeps the search index current
+        if created or renamed:
+            search.index_items(created + renamed)
+
+        # The formset already holds every line, so no query is needed. VAT is
+        # rounded per rate category, so it cannot be adjusted line by line.
+        invoice.apply_totals(kept + created)
+        return created, updated, deleted
+
+
 # Formset for invoice items
 InvoiceItemFormSet = forms.inlineformset_factory(
     Invoice,
     InvoiceItem,
     form=InvoiceItemForm,
+    formset=BaseInvoiceItemFormSet,
     extra=1,
     can_delete=True
 )
+
+
+class VATReportForm(forms.Form):
+    company = CachedModelChoiceField(refcache.companies)
+    start = forms.DateField(label='From', widget=forms.DateInput(attrs={'class': 'form-control', 'type': 'date'}))
+    end = forms.DateField(label='To', widget=forms.DateInput(attrs={'class': 'form-control', 'type': 'date'}))
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if cleaned_data.get('start') and cleaned_data.get('end') and cleaned_data['start'] > cleaned_data['end']:
+            raise forms.ValidationError("The start date must be on or before the end date.")
+        return cleaned_data
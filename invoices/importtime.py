@@ -0,0 +1,97 @@
+"""
+Import-time profiling.
+
+profile() starts a fresh interpreter with `python -X importtime`, runs a boot
+snippet (a web worker loading the WSGI application and URLconf, or a
+management command) and parses the per-module import timings it prints. The
+cumulative time of a module includes everything it imported first, so the
+largest entries show which imports to defer.
+
+Heavy, rarely used dependencies (the HTTP client behind ZATCAService, NumPy
+for bulk line calculation, and future crypto, XML or PDF libraries) are
+imported inside the functions that use them. LAZY_MODULES lists those that
+must still be absent after a worker boot; profile() reports any that were
+imported anyway.
+"""
+import re
+import subprocess
+import sys
+import time
+from collections import namedtuple
+
+from django.conf import settings
+
+
+ImportTiming = namedtuple('ImportTiming', ['module', 'self_us', 'cumulative_us', 'depth'])
+
+_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+_SETUP = (
+    "import os, sys\n"
+    "sys.path.insert(0, {base_dir!r})\n"
+    "os.environ.setdefault('DJANGO_SETTINGS_MODULE', {settings_module!r})\n"
+)
+
+BOOT = {
+    # What a WSGI worker does before serving its first request
+    'wsgi': (
+        "from django.core.wsgi import get_wsgi_application\n"
+        "get_wsgi_application()\n"
+        "from django.urls import get_resolver\n"
+        "get_resolver().url_patterns\n"
+    ),
+    # manage.py up to the point where the command would run
+    'command': (
+        "import django\n"
+        "django.setup()\n"
+        "from django.core.management import ManagementUtility\n"
+        "ManagementUtility(['manage.py', {command!r}]).fetch_command({command!r})\n"
+    ),
+}
+
+# Modules a worker should not import until they are needed
+LAZY_MODULES = ['requests', 'urllib3', 'numpy', 'invoices.zatca_service', 'invoices.transport']
+
+
+def boot_code(target='wsgi', command=None):
+    code = _SETUP.format(base_dir=str(settings.BASE_DIR), settings_module=settings.SETTINGS_MODULE)
+    code += BOOT[target].format(command=command)
+    # Reported on stdout, after the timings have gone to stderr
+    code += f"print(','.join(name for name in {LAZY_MODULES!r} if name in sys.modules))\n"
+    return code
+
+
+def parse(stderr):
+    """ImportTimings from `-X importtime` output, in the order the imports finished"""
+    timings = []
+    for line in stderr.splitlines():
+        match = _LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            timings.append(ImportTiming(module, int(self_us), int(cumulative_us), len(indent) // 2))
+    return timings
+
+
+def profile(target='wsgi', command=None, python=None):
+    """
+    Boot a fresh interpreter and return (timings, wall seconds, lazy modules
+    that were imported anyway).
+    """
+    start = time.perf_counter()
+    result = subprocess.run(
+        [python or sys.executable, '-X', 'importtime', '-c', boot_code(target, command)],
+        capture_output=True, text=True, cwd=settings.BASE_DIR)
+    elapsed = time.perf_counter() - start
+    if result.returncode:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'boot failed')
+    loaded = [name for name in result.stdout.strip().splitlines()[-1].split(',') if name] if result.stdout.strip() else []
+    return parse(result.stderr), elapsed, loaded
+
+
+def by_package(timings):
+    """Self time summed per top-level package, largest first"""
+    totals = {}
+    for timing in timings:
+        package = timing.module.split('.', 1)[0]
+        totals[package] = totals.get(package, 0) + timing.self_us
+    return sorted(totals.items(), key=lambda item: item[1], reverse=True)
@@ -0,0 +1,207 @@
+"""
+Load drivers.
+
+run_load() is an open-loop driver for ZATCA submission: invoices are
+released at a fixed rate regardless of how quickly earlier submissions
+complete, and latency is measured from each invoice's scheduled release
+time. Queueing delay caused by an undersized worker pool therefore shows up
+in the results instead of being hidden (coordinated omission).
+
+run_view_load() fetches pages over HTTP from the application served by
+serve_wsgi(), to compare settings profiles (see zatca_project.settings_production)
+under concurrent requests.
+"""
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+
+import requests
+from django.core.wsgi import get_wsgi_application
+from django.db import connections
+
+from .models import Invoice
+from .telemetry import API_RETRIES, percentile
+from .zatca_service import ZATCAService
+
+
+def _summarize(values):
+    ordered = sorted(values)
+    return {
+        'p50': percentile(ordered, 50),
+        'p95': percentile(ordered, 95),
+        'p99': percentile(ordered, 99),
+        'max': ordered[-1] if ordered else None,
+    }
+
+
+def run_load(invoice_ids, rate, api_url=None, workers=8):
+    """
+    Submit every invoice in invoice_ids through ZATCAService at `rate`
+    invoices per second using `workers` threads. Returns a summary dict;
+    durations are in milliseconds.
+    """
+    jobs = queue.Queue()
+    results = []
+    results_lock = threading.Lock()
+    retries_before = API_RETRIES.value(action='submit_invoice')
+
+    def worker():
+        service = ZATCAService(api_url=api_url)
+        try:
+            while True:
+                job = jobs.get()
+                if job is None:
+                    return
+                pk, scheduled = job
+                started = time.perf_counter()
+                try:
+                    invoice = Invoice.objects.select_related('company', 'customer').get(pk=pk)
+                    success, message, _ = service.submit_invoice(invoice)
+                except Exception as e:
+                    success, message = False, f"Error: {e}"
+                finished = time.perf_counter()
+                with results_lock:
+                    results.append((success, message, finished - scheduled, finished - started, started - scheduled))
+        finally:
+            connections.close_all()
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+
+    start = time.perf_counter()
+    for index, pk in enumerate(invoice_ids):
+        scheduled = start + index / rate
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        jobs.put((pk, scheduled))
+    for _ in threads:
+        jobs.put(None)
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    succeeded = sum(1 for success, *_ in results if success)
+    errors = Counter(message for success, message, *_ in results if not success)
+    return {
+        'offered_rate': rate,
+        'achieved_rate': len(results) / elapsed if elapsed else None,
+        'workers': workers,
+        'submitted': len(results),
+        'succeeded': succeeded,
+        'failed': len(results) - succeeded,
+        'errors': dict(errors.most_common(5)),
+        'retries': API_RETRIES.value(action='submit_invoice') - retries_before,
+        'latency_ms': _summarize([result[2] * 1000 for result in results]),
+        'service_time_ms': _summarize([result[3] * 1000 for result in results]),
+        'queue_wait_ms': _summarize([result[4] * 1000 for result in results]),
+        'elapsed_s': elapsed,
+    }
+
+
+class _QuietHandler(WSGIRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+
+class PooledWSGIServer(WSGIServer):
+    """
+    WSGI server handling requests on a fixed pool of threads, like a threaded
+    application server: each thread keeps its database connection between
+    requests when CONN_MAX_AGE allows it.
+    """
+
+    def __init__(self, address, threads):
+        super().__init__(address, _QuietHandler)
+        self.pool = ThreadPoolExecutor(threads)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._handle, request, client_address)
+
+    def _handle(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+@contextmanager
+def serve_wsgi(threads=8, host='127.0.0.1'):
+    """Serve the Django application on a free port for the duration of the block; yields its base URL"""
+    httpd = PooledWSGIServer((host, 0), threads)
+    httpd.set_app(get_wsgi_application())
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f'http://{host}:{httpd.server_port}'
+    finally:
+        httpd.shutdown()
+        httpd.pool.shutdown()
+        httpd.server_close()
+
+
+def run_view_load(base_url, paths, count, workers=8, accept_encoding='gzip, deflate, br'):
+    """
+    GET `count` requests spread round-robin over `paths` with `workers`
+    concurrent clients (closed loop: each client sends its next request when
+    the previous one completes). Returns a summary dict; durations in
+    milliseconds, sizes in bytes as sent on the wire.
+    """
+    jobs = queue.Queue()
+    for index in range(count):
+        jobs.put(paths[index % len(paths)])
+    results = []
+    results_lock = threading.Lock()
+
+    def worker():
+        session = requests.Session()
+        session.headers['Accept-Encoding'] = accept_encoding
+        while True:
+            try:
+                path = jobs.get_nowait()
+            except queue.Empty:
+                return
+            started = time.perf_counter()
+            try:
+                response = session.get(base_url + path, stream=True)
+                size = len(response.raw.read())
+                status = response.status_code
+            except requests.RequestException as e:
+                size, status = 0, type(e).__name__
+            finished = time.perf_counter()
+            with results_lock:
+                results.append((path, status, finished - started, size))
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    by_path = {}
+    for path in paths:
+        matching = [result for result in results if result[0] == path]
+        by_path[path] = {
+            'latency_ms': _summarize([result[2] * 1000 for result in matching]),
+            'bytes': matching[-1][3] if matching else None,
+        }
+    return {
+        'requests': len(results),
+        'workers': workers,
+        'throughput': len(results) / elapsed if elapsed else None,
+        'statuses': dict(Counter(result[1] for result in results)),
+        'latency_ms': _summarize([result[2] * 1000 for result in results]),
+        'bytes_total': sum(result[3] for result in results),
+        'paths': by_path,
+        'elapsed_s': elapsed,
+    }
@@ -0,0 +1,132 @@
+import sqlite3
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+
+from invoices.signals import apply_sqlite_pragmas
+from zatca_project.database import SQLITE_TUNED_PRAGMAS
+
+
+# Stock Django SQLite settings versus the tuned profile from zatca_project/database.py
+PROFILES = {
+    'default': {'timeout': 5, 'begin': 'BEGIN', 'pragmas': {}},
+    'tuned': {'timeout': 20, 'begin': 'BEGIN IMMEDIATE', 'pragmas': SQLITE_TUNED_PRAGMAS},
+}
+
+SCHEMA = """
+CREATE TABLE invoice (id INTEGER PRIMARY KEY, number TEXT UNIQUE, status TEXT, total NUMERIC, updated REAL);
+CREATE TABLE zatca_log (id INTEGER PRIMARY KEY, invoice_id INTEGER, action TEXT, success INTEGER, timestamp REAL);
+"""
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare concurrent write throughput and 'database is locked' errors between the "
+        "stock SQLite configuration and the tuned WAL profile"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--web-writers', type=int, default=4, help="Threads creating invoices")
+        parser.add_argument('--zatca-writers', type=int, default=4, help="Threads applying ZATCA status updates")
+        parser.add_argument('--readers', type=int, default=4, help="Threads running list-page style reads")
+        parser.add_argument('--writes', type=int, default=200, help="Transactions per writer thread")
+        parser.add_argument('--profiles', nargs='+', choices=sorted(PROFILES), default=['default', 'tuned'])
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f"{options['web_writers']} web + {options['zatca_writers']} ZATCA writers x {options['writes']} "
+            f"transactions, {options['readers']} readers")
+        header = f"{'profile':<10} {'commits':>8} {'locked':>8} {'seconds':>9} {'commits/s':>10} {'reads/s':>9}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for name in options['profiles']:
+            with tempfile.TemporaryDirectory() as directory:
+                result = self.run_profile(Path(directory) / 'bench.sqlite3', PROFILES[name], options)
+            self.stdout.write(
+                f"{name:<10} {result['commits']:>8} {result['locked']:>8} {result['elapsed']:>9.2f} "
+                f"{result['commits'] / result['elapsed']:>10.1f} {result['reads'] / result['elapsed']:>9.0f}")
+
+    def connect(self, path, profile):
+        conn = sqlite3.connect(path, timeout=profile['timeout'], isolation_level=None, check_same_thread=False)
+        apply_sqlite_pragmas(conn.cursor(), profile['pragmas'])
+        return conn
+
+    def run_profile(self, path, profile, options):
+        setup = self.connect(path, profile)
+        setup.executescript(SCHEMA)
+        setup.close()
+
+        counts = {'commits': 0, 'locked': 0, 'reads': 0}
+        lock = threading.Lock()
+        stop = threading.Event()
+
+        def transaction(conn, statements):
+            try:
+                conn.execute(profile['begin'])
+                for sql, params in statements(conn):
+                    conn.execute(sql, params)
+                conn.execute('COMMIT')
+                key = 'commits'
+            except sqlite3.OperationalError as e:
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+                if 'locked' not in str(e) and 'busy' not in str(e):
+                    raise
+                key = 'locked'
+            with lock:
+                counts[key] += 1
+
+        def web_writer(worker):
+            conn = self.connect(path, profile)
+            for index in range(options['writes']):
+                transaction(conn, lambda c: [(
+                    'INSERT INTO invoice (number, status, total, updated) VALUES (?, ?, ?, ?)',
+                    (f'W{worker}-{index}', 'draft', 115, time.time()),
+                )])
+            conn.close()
+
+        def zatca_writer(worker):
+            conn = self.connect(path, profile)
+
+            def update(c):
+                # Read-then-write, like submit_invoice: look up the invoice, then update it and log
+                row = c.execute('SELECT id FROM invoice ORDER BY random() LIMIT 1').fetchone()
+                invoice_id = row[0] if row else 0
+                return [
+                    ('UPDATE invoice SET status = ?, updated = ? WHERE id = ?', ('submitted', time.time(), invoice_id)),
+                    ('INSERT INTO zatca_log (invoice_id, action, success, timestamp) VALUES (?, ?, ?, ?)',
+                     (invoice_id, 'submit_invoice', 1, time.time())),
+                ]
+
+            for _ in range(options['writes']):
+                transaction(conn, update)
+            conn.close()
+
+        def reader():
+            conn = self.connect(path, profile)
+            while not stop.is_set():
+                try:
+                    conn.execute('SELECT status, COUNT(*) FROM invoice GROUP BY status').fetchall()
+                    with lock:
+                        counts['reads'] += 1
+                except sqlite3.OperationalError:
+                    pass
+            conn.close()
+
+        writers = [threading.Thread(target=web_writer, args=(n,)) for n in range(options['web_writers'])]
+        writers += [threading.Thread(target=zatca_writer, args=(n,)) for n in range(options['zatca_writers'])]
+        readers = [threading.Thread(target=reader) for _ in range(options['readers'])]
+
+        start = time.perf_counter()
+        for thread in writers + readers:
+            thread.start()
+        for thread in writers:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        stop.set()
+        for thread in readers:
+            thread.join()
+        return dict(counts, elapsed=elapsed)
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from invoices.mock_zatca import LatencyModel, MockZATCAServer
+
+
+def fraction(value):
+    value = float(value)
+    if not 0 <= value <= 1:
+        raise ValueError(value)
+    return value
+
+
+class Command(BaseCommand):
+    help = "Run a local mock of the ZATCA API for load and soak testing"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8099)
+        parser.add_argument('--latency', default='none',
+                            help="Delay distribution in ms: none, fixed:MS, uniform:MIN,MAX, normal:MEAN,SD, "
+                                 "exponential:MEAN or lognormal:MEDIAN,SIGMA")
+        parser.add_argument('--error-rate', type=fraction, default=0.0, help="Fraction of requests failing (0-1)")
+        parser.add_argument('--error-status', type=int, default=500, help="Status code for injected failures")
+        parser.add_argument('--throttle-rate', type=fraction, default=0.0, help="Fraction of requests answered with 429")
+        parser.add_argument('--retry-after', type=float, default=1.0, help="Retry-After seconds sent with 429")
+        parser.add_argument('--seed', type=int, help="Random seed for reproducible fault injection")
+        parser.add_argument('--verbose-requests', action='store_true', help="Log every request")
+
+    def handle(self, *args, **options):
+        if options['error_rate'] + options['throttle_rate'] > 1:
+            raise CommandError("--error-rate and --throttle-rate must add up to at most 1")
+        try:
+            latency = LatencyModel.parse(options['latency'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        server = MockZATCAServer(
+            host=options['host'], port=options['port'], latency=latency,
+            error_rate=options['error_rate'], throttle_rate=options['throttle_rate'],
+            error_status=options['error_status'], retry_after=options['retry_after'],
+            seed=options['seed'], verbose=options['verbose_requests'],
+        )
+        self.stdout.write(
+            f"Mock ZATCA API listening on {server.url} (latency {latency}, "
+            f"errors {options['error_rate']:.1%}, throttled {options['throttle_rate']:.1%})")
+        self.stdout.write(f"Point the app at it with ZATCA_API_URL = '{server.url}'. Quit with CONTROL-C.")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.httpd.server_close()
+            self.stdout.write(f"Served: {server.stats()}")
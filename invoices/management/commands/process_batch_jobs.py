@@ -0,0 +1,85 @@
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from invoices import batch, workers
+
+
+class Command(BaseCommand):
+    help = (
+        "Run queued batch jobs (bulk submit, status refresh, cancel and recalculate). With --workers, "
+        "companies are sharded over that many processes; SIGTTIN/SIGTTOU add or remove a worker"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=settings.BATCH_CLAIM_SIZE,
+                            help="Jobs claimed at a time (default BATCH_CLAIM_SIZE)")
+        parser.add_argument('--company', type=int, action='append', dest='companies',
+                            help="Only jobs for this company id (repeatable; single process only)")
+        parser.add_argument('--workers', type=int,
+                            help="Worker processes, each owning a share of the companies (default: run in this process)")
+        parser.add_argument('--status', action='store_true',
+                            help="Print pending jobs per shard for --workers (default BATCH_WORKERS) and exit")
+        parser.add_argument('--loop', action='store_true', help="Keep polling for new jobs instead of exiting when the queue is empty")
+        parser.add_argument('--sleep', type=float, default=2.0, help="Seconds between polls of an empty queue with --loop")
+        parser.add_argument('--api-url', help="ZATCA API base URL (default ZATCA_API_URL)")
+
+    def handle(self, *args, **options):
+        if options['status']:
+            for shard, depth in workers.shard_depths(workers.configured_ring(options['workers'])).items():
+                self.stdout.write(f"{shard}\t{depth}")
+            return
+        if options['workers']:
+            return self.run_pool(options)
+
+        from invoices.zatca_service import ZATCAService
+        service = ZATCAService(api_url=options['api_url'])
+        worker = batch.worker_name()
+        totals = {'done': 0, 'failed': 0}
+        while True:
+            results = batch.run_pending(options['limit'], worker, options['companies'], service)
+            for key, count in results.items():
+                totals[key] += count
+            if sum(results.values()):
+                self.stdout.write(f"  {results['done']} done, {results['failed']} failed")
+            elif options['loop']:
+                time.sleep(options['sleep'])
+            else:
+                break
+        self.stdout.write(self.style.SUCCESS(f"{totals['done']} jobs done, {totals['failed']} failed"))
+
+    def run_pool(self, options):
+        supervisor = workers.Supervisor(
+            options['workers'], limit=options['limit'], api_url=options['api_url'], poll_interval=options['sleep'])
+
+        def stop(signum, frame):
+            supervisor.stopping = True
+
+        def add_worker(signum, frame):
+            supervisor.target += 1
+
+        def remove_worker(signum, frame):
+            supervisor.target = max(supervisor.target - 1, 1)
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        signal.signal(signal.SIGTTIN, add_worker)
+        signal.signal(signal.SIGTTOU, remove_worker)
+
+        last = {}
+
+        def report(supervisor):
+            depths = workers.publish_depths(supervisor.ring)
+            if depths != last:
+                self.stdout.write('  ' + ', '.join(f"{shard}: {depth}" for shard, depth in depths.items()))
+                last.clear()
+                last.update(depths)
+
+        try:
+            totals = supervisor.run(until_empty=not options['loop'], on_tick=report)
+        finally:
+            supervisor.stop()
+        self.stdout.write(self.style.SUCCESS(
+            f"{totals['done']} jobs done, {totals['failed']} failed"))
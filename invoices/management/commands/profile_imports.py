@@ -0,0 +1,73 @@
+import json
+import statistics
+
+from django.core.management.base import BaseCommand, CommandError
+
+from invoices import importtime
+
+
+class Command(BaseCommand):
+    help = (
+        "Boot a fresh interpreter as a web worker (or up to a management command) under "
+        "`python -X importtime` and report the modules with the largest cumulative import time"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--command', metavar='NAME',
+                            help="Profile loading this management command instead of a WSGI worker")
+        parser.add_argument('--top', type=int, default=25, help="Modules to list (default 25)")
+        parser.add_argument('--repeat', type=int, default=5,
+                            help="Boots to run; timings come from the fastest (default 5)")
+        parser.add_argument('--packages', action='store_true', help="Also list self time per top-level package")
+        parser.add_argument('--json', action='store_true', help="Print the report as JSON")
+        parser.add_argument('--check', action='store_true',
+                            help="Fail if a module in importtime.LAZY_MODULES was imported during the boot")
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1 or options['top'] < 1:
+            raise CommandError("--repeat and --top must be positive")
+        target = 'command' if options['command'] else 'wsgi'
+        runs = []
+        for _ in range(options['repeat']):
+            try:
+                runs.append(importtime.profile(target, options['command']))
+            except RuntimeError as e:
+                raise CommandError(f"Boot failed: {e}")
+        # The fastest run has the least scheduling noise
+        timings, _, loaded = min(runs, key=lambda run: run[1])
+        walls = [run[1] for run in runs]
+        top = sorted(timings, key=lambda timing: timing.cumulative_us, reverse=True)[:options['top']]
+
+        report = {
+            'target': options['command'] or 'wsgi',
+            'wall_ms': {'min': min(walls) * 1000, 'median': statistics.median(walls) * 1000},
+            'imports_ms': sum(timing.self_us for timing in timings) / 1000,
+            'modules': len(timings),
+            'lazy_modules_loaded': loaded,
+            'top': [timing._asdict() for timing in top],
+            'packages': importtime.by_package(timings)[:options['top']],
+        }
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self.report(report, options['packages'])
+
+        if options['check'] and loaded:
+            raise CommandError(f"Imported at boot but meant to load lazily: {', '.join(loaded)}")
+
+    def report(self, report, packages):
+        self.stdout.write(
+            f"{report['target']}: {report['modules']} modules, {report['imports_ms']:.1f} ms importing; "
+            f"boot wall time min {report['wall_ms']['min']:.0f} ms, median {report['wall_ms']['median']:.0f} ms")
+        self.stdout.write(f"\n{'cumulative ms':>14} {'self ms':>9}  module")
+        for timing in report['top']:
+            self.stdout.write(
+                f"{timing['cumulative_us'] / 1000:>14.1f} {timing['self_us'] / 1000:>9.1f}  "
+                f"{timing['module']}")
+        if packages:
+            self.stdout.write(f"\n{'self ms':>14}  package")
+            for package, self_us in report['packages']:
+                self.stdout.write(f"{self_us / 1000:>14.1f}  {package}")
+        if report['lazy_modules_loaded']:
+            self.stdout.write(self.style.WARNING(
+                f"\nLoaded at boot but meant to be lazy: {', '.join(report['lazy_modules_loaded'])}"))
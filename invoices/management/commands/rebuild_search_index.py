@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from invoices import search
+
+
+class Command(BaseCommand):
+    help = "Rebuild the search index for companies, customers, invoices and invoice lines"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        self.stdout.write("Rebuilding search index...")
+        with transaction.atomic():
+            search.rebuild(batch_size=options['batch_size'], stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS("Search index rebuilt"))
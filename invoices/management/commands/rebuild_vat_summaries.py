@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from invoices import reporting
+
+
+class Command(BaseCommand):
+    help = "Recompute the precomputed VAT summary rows from invoice lines"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--company', type=int, help="Only this company id")
+        parser.add_argument('--from', dest='start', help="First issue date (YYYY-MM-DD)")
+        parser.add_argument('--to', dest='end', help="Last issue date (YYYY-MM-DD)")
+
+    def handle(self, *args, **options):
+        count = reporting.rebuild(company_id=options['company'], start=options['start'], end=options['end'])
+        self.stdout.write(self.style.SUCCESS(f"Refreshed {count} company/day buckets"))
@@ -0,0 +1,77 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from invoices import calculator, reporting
+from invoices.models import Invoice, InvoiceItem
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute line amounts and invoice totals with the exact halala calculator, "
+        "writing only rows whose stored amounts differ"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--include-issued', action='store_true',
+                            help="Also recalculate invoices that have left draft (changes issued amounts)")
+        parser.add_argument('--batch-size', type=int, default=2000, help="Invoices per batch (default 2000)")
+        parser.add_argument('--dry-run', action='store_true', help="Report differences without writing them")
+
+    def handle(self, *args, **options):
+        invoices = Invoice.objects.all() if options['include_issued'] else Invoice.objects.filter(status='draft')
+        ids = list(invoices.order_by('pk').values_list('pk', flat=True))
+        counts = {'invoices': 0, 'lines': 0, 'changed_invoices': 0, 'changed_lines': 0}
+
+        for start in range(0, len(ids), options['batch_size']):
+            batch = ids[start:start + options['batch_size']]
+            with transaction.atomic():
+                self.recalculate(batch, counts, options['dry_run'])
+            self.stdout.write(f"  {min(start + len(batch), len(ids))}/{len(ids)} invoices")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Checked {counts['invoices']} invoices and {counts['lines']} lines; "
+            f"{counts['changed_invoices']} invoices and {counts['changed_lines']} lines "
+            f"{'would change' if options['dry_run'] else 'updated'}"))
+
+    def recalculate(self, invoice_ids, counts, dry_run):
+        rows = list(
+            InvoiceItem.objects.filter(invoice_id__in=invoice_ids).order_by('invoice_id', 'pk')
+            .values_list('pk', 'invoice_id', 'quantity', 'unit_price', 'discount', 'vat_rate', 'total', 'vat_amount'))
+        to_units = calculator.to_units
+        rates = [to_units(row[5]) for row in rows]
+        nets, vats = calculator.calculate_lines(
+            [to_units(row[2]) for row in rows], [to_units(row[3]) for row in rows],
+            [to_units(row[4]) for row in rows], rates)
+
+        changed_lines, lines_by_invoice, touched = [], {}, set()
+        for row, net, vat, rate in zip(rows, nets, vats, rates):
+            if to_units(row[6]) != net or to_units(row[7]) != vat:
+                touched.add(row[1])
+                changed_lines.append(InvoiceItem(
+                    pk=row[0], total=calculator.to_decimal(net), vat_amount=calculator.to_decimal(vat)))
+            invoice_lines = lines_by_invoice.setdefault(row[1], ([], []))
+            invoice_lines[0].append(net)
+            invoice_lines[1].append(rate)
+
+        changed_invoices = []
+        headers = Invoice.objects.filter(pk__in=invoice_ids).values_list(
+            'pk', 'discount', 'subtotal', 'vat_amount', 'total')
+        for pk, discount, subtotal, vat_amount, total in headers:
+            invoice_nets, invoice_rates = lines_by_invoice.get(pk, ([], []))
+            totals = calculator.invoice_totals(invoice_nets, invoice_rates, to_units(discount))
+            if (to_units(subtotal), to_units(vat_amount), to_units(total)) != (totals.subtotal, totals.vat, totals.total):
+                changed_invoices.append(Invoice(
+                    pk=pk, subtotal=calculator.to_decimal(totals.subtotal),
+                    vat_amount=calculator.to_decimal(totals.vat), total=calculator.to_decimal(totals.total)))
+                touched.add(pk)
+
+        counts['invoices'] += len(invoice_ids)
+        counts['lines'] += len(rows)
+        counts['changed_invoices'] += len(changed_invoices)
+        counts['changed_lines'] += len(changed_lines)
+        if not dry_run:
+            InvoiceItem.objects.bulk_update(changed_lines, ['total', 'vat_amount'], batch_size=1000)
+            Invoice.objects.bulk_update(changed_invoices, ['subtotal', 'vat_amount', 'total'], batch_size=1000)
+            # bulk_update sends no signals; move the changed amounts into VATSummary
+            for pk in sorted(touched):
+                reporting.update_invoice(Invoice(pk=pk))
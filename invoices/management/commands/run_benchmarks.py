@@ -0,0 +1,88 @@
+import json
+from pathlib import Path
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from invoices import benchmarks
+from invoices.models import InvoiceItem
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed synthetic invoices into a separate benchmark database and time the invoice "
+        "lifecycle hot paths. Results are written as JSON for comparison between runs."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lines', type=int, default=10000, help="Total invoice lines to seed (default 10000)")
+        parser.add_argument('--lines-per-invoice', type=int, default=10)
+        parser.add_argument('--companies', type=int, default=10)
+        parser.add_argument('--customers', type=int, default=1000)
+        parser.add_argument('--rounds', type=int, default=5, help="Measured rounds per benchmark")
+        parser.add_argument('--warmup', type=int, default=1, help="Unmeasured warm-up rounds per benchmark")
+        parser.add_argument('--only', nargs='+', metavar='NAME', help="Only run the named benchmarks")
+        parser.add_argument('--output', help="JSON results path (default benchmark-<timestamp>.json)")
+        parser.add_argument('--compare', metavar='PATH', help="Previous results file to compare against")
+        parser.add_argument('--max-regression', type=float, metavar='PCT',
+                            help="Fail if any median is more than PCT percent slower than --compare")
+        parser.add_argument('--keepdb', action='store_true',
+                            help="Keep the benchmark database and reuse its data when the scale matches")
+
+    def handle(self, *args, **options):
+        if options['max_regression'] is not None and not options['compare']:
+            raise CommandError("--max-regression requires --compare")
+
+        with benchmarks.benchmark_database(keepdb=options['keepdb']):
+            report = self.run(options)
+
+        output = Path(options['output'] or f"benchmark-{timezone.now():%Y%m%d-%H%M%S}.json")
+        output.write_text(json.dumps(report, indent=2))
+        self.stdout.write(self.style.SUCCESS(f"Results written to {output}"))
+
+        if options['compare']:
+            self.compare(report, options['compare'], options['max_regression'])
+
+    def run(self, options):
+        scale = {
+            'lines': options['lines'],
+            'lines_per_invoice': options['lines_per_invoice'],
+            'companies': options['companies'],
+            'customers': options['customers'],
+        }
+        expected_lines = max(options['lines'] // options['lines_per_invoice'], 1) * options['lines_per_invoice']
+        existing_lines = InvoiceItem.objects.count()
+        if existing_lines != expected_lines:
+            if existing_lines:
+                call_command('flush', interactive=False, verbosity=0)
+            self.stdout.write(f"Seeding {options['lines']} lines...")
+            benchmarks.seed(
+                options['lines'], options['lines_per_invoice'], options['companies'],
+                options['customers'], stdout=self.stdout)
+        else:
+            self.stdout.write("Reusing existing benchmark data")
+
+        self.stdout.write(f"Running benchmarks ({options['rounds']} rounds, {options['warmup']} warm-up)...")
+        return benchmarks.run_suite(
+            rounds=options['rounds'], warmup=options['warmup'], only=options['only'],
+            scale=scale, stdout=self.stdout)
+
+    def compare(self, report, path, max_regression):
+        try:
+            baseline = json.loads(Path(path).read_text())
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Cannot read {path}: {e}")
+
+        regressions = []
+        self.stdout.write(f"\n{'benchmark':<24} {'baseline ms':>12} {'current ms':>12} {'change':>9}")
+        for name, old, new, change in benchmarks.compare(baseline, report):
+            line = f"{name:<24} {old * 1000:>12.2f} {new * 1000:>12.2f} {change:>+8.1f}%"
+            if max_regression is not None and change > max_regression:
+                regressions.append(name)
+                line = self.style.ERROR(line)
+            self.stdout.write(line)
+
+        if regressions:
+            raise CommandError(
+                f"{len(regressions)} benchmark(s) regressed by more than {max_regression}%: {', '.join(regressions)}")
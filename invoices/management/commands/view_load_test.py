@@ -0,0 +1,96 @@
+import json
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from django.urls import reverse
+
+from invoices import benchmarks
+from invoices.loadtest import run_view_load, serve_wsgi
+from invoices.models import Invoice
+
+
+class Command(BaseCommand):
+    help = (
+        "Serve the application over HTTP on a separate benchmark database and load the invoice "
+        "list and detail pages with concurrent clients. Run it under each settings profile "
+        "(DJANGO_SETTINGS_MODULE) and pass the first run's --output to the second's --compare."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help="Total requests (default 500)")
+        parser.add_argument('--workers', type=int, default=8, help="Concurrent clients (default 8)")
+        parser.add_argument('--server-threads', type=int, default=8, help="Application server threads (default 8)")
+        parser.add_argument('--invoices', type=int, default=500, help="Invoices to seed (default 500)")
+        parser.add_argument('--lines-per-invoice', type=int, default=10)
+        parser.add_argument('--output', help="Write the summary as JSON to this path")
+        parser.add_argument('--compare', metavar='PATH', help="Previous --output to compare against")
+        parser.add_argument('--json', action='store_true', help="Print the summary as JSON")
+        parser.add_argument('--keepdb', action='store_true', help="Keep and reuse the benchmark database")
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or options['workers'] < 1 or options['server_threads'] < 1:
+            raise CommandError("--requests, --workers and --server-threads must be positive")
+
+        profile = {'module': settings.SETTINGS_MODULE, 'debug': settings.DEBUG}
+        with benchmarks.benchmark_database(keepdb=options['keepdb']):
+            paths = self.prepare_paths(options['invoices'], options['lines_per_invoice'])
+            with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, '127.0.0.1']), \
+                    serve_wsgi(options['server_threads']) as base_url:
+                self.stdout.write(
+                    f"Sending {options['requests']} requests from {options['workers']} clients "
+                    f"to {base_url} ({profile['module']}, DEBUG={profile['debug']})...")
+                # One unmeasured pass so both profiles start with warm caches
+                run_view_load(base_url, paths, len(paths), options['workers'])
+                summary = run_view_load(base_url, paths, options['requests'], options['workers'])
+        summary['settings'] = profile
+
+        if options['output']:
+            Path(options['output']).write_text(json.dumps(summary, indent=2))
+        if options['json']:
+            self.stdout.write(json.dumps(summary, indent=2))
+        else:
+            self.report(summary)
+        if options['compare']:
+            self.compare(summary, options['compare'])
+
+    def prepare_paths(self, count, lines_per_invoice):
+        ids = list(Invoice.objects.order_by('pk').values_list('pk', flat=True)[:count])
+        if len(ids) < count:
+            if ids:
+                call_command('flush', interactive=False, verbosity=0)
+            self.stdout.write(f"Seeding {count} invoices...")
+            benchmarks.seed(count * lines_per_invoice, lines_per_invoice)
+            ids = list(Invoice.objects.order_by('pk').values_list('pk', flat=True)[:count])
+        # The list page and the detail pages of the first invoices, alternating
+        details = [reverse('invoice_detail', args=[pk]) for pk in ids[:20]]
+        return [path for detail in details for path in (reverse('invoice_list'), detail)]
+
+    def report(self, summary):
+        stats = summary['latency_ms']
+        self.stdout.write(
+            f"{summary['requests']} requests in {summary['elapsed_s']:.1f}s: {summary['throughput']:.1f} req/s, "
+            f"statuses {summary['statuses']}")
+        self.stdout.write(
+            f"  latency_ms  p50 {stats['p50']:8.1f}  p95 {stats['p95']:8.1f}  p99 {stats['p99']:8.1f}  "
+            f"max {stats['max']:8.1f}")
+        self.stdout.write(f"  transferred {summary['bytes_total'] / 1024:.0f} KiB")
+
+    def compare(self, summary, path):
+        try:
+            baseline = json.loads(Path(path).read_text())
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Cannot read {path}: {e}")
+        rows = [
+            ('throughput req/s', baseline['throughput'], summary['throughput']),
+            ('p50 ms', baseline['latency_ms']['p50'], summary['latency_ms']['p50']),
+            ('p95 ms', baseline['latency_ms']['p95'], summary['latency_ms']['p95']),
+            ('KiB per request', baseline['bytes_total'] / baseline['requests'] / 1024,
+             summary['bytes_total'] / summary['requests'] / 1024),
+        ]
+        self.stdout.write(f"\n{'':<18} {baseline['settings']['module']:>28} {summary['settings']['module']:>36}")
+        for name, old, new in rows:
+            change = (new - old) / old * 100 if old else 0.0
+            self.stdout.write(f"{name:<18} {old:>28.1f} {new:>36.1f} {change:>+8.1f}%")
@@ -0,0 +1,68 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from invoices.models import ZATCALog
+from invoices.telemetry import percentile
+
+
+class Command(BaseCommand):
+    help = "Summarize ZATCA API latency (p50/p95/p99) and error budgets per action and per day"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30, help="Look-back window in days (default 30)")
+        parser.add_argument('--action', help="Only report this action (e.g. submit_invoice)")
+        parser.add_argument('--phase', default='total', choices=['dns', 'connect', 'tls', 'ttfb', 'total'],
+                            help="Timing phase to summarize (default total)")
+
+    def handle(self, *args, **options):
+        since = timezone.now() - timedelta(days=options['days'])
+        logs = ZATCALog.objects.filter(timestamp__gte=since)
+        if options['action']:
+            logs = logs.filter(action=options['action'])
+
+        daily = defaultdict(lambda: {'durations': [], 'calls': 0, 'errors': 0})
+        overall = defaultdict(lambda: {'durations': [], 'calls': 0, 'errors': 0})
+        rows = logs.order_by().values_list('action', 'timestamp', 'success', 'timings')
+        for action, timestamp, success, timings in rows.iterator(chunk_size=2000):
+            day = timezone.localdate(timestamp)
+            for bucket in (daily[(action, day)], overall[action]):
+                bucket['calls'] += 1
+                bucket['errors'] += 0 if success else 1
+                if timings and options['phase'] in timings:
+                    bucket['durations'].append(timings[options['phase']])
+
+        if not overall:
+            self.stdout.write("No ZATCA calls recorded in the selected window.")
+            return
+
+        header = f"{'action':<20} {'day':<10} {'calls':>7} {'errors':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for (action, day), bucket in sorted(daily.items()):
+            self.stdout.write(self._format_row(action, day.isoformat(), bucket))
+
+        budget = settings.ZATCA_ERROR_BUDGET
+        self.stdout.write('')
+        self.stdout.write(f"Error budget: {budget:.2%} failed calls per action over {options['days']} days")
+        for action, bucket in sorted(overall.items()):
+            self.stdout.write(self._format_row(action, 'all', bucket))
+            error_rate = bucket['errors'] / bucket['calls']
+            remaining = budget * bucket['calls'] - bucket['errors']
+            line = f"  error rate {error_rate:.2%}, budget remaining {remaining:.1f} failed calls"
+            if error_rate > budget:
+                self.stdout.write(self.style.ERROR(line + " (EXHAUSTED)"))
+            else:
+                self.stdout.write(self.style.SUCCESS(line))
+
+    def _format_row(self, action, day, bucket):
+        durations = sorted(bucket['durations'])
+
+        def fmt(q):
+            value = percentile(durations, q)
+            return f"{value:>9.1f}" if value is not None else f"{'-':>9}"
+
+        return f"{action:<20} {day:<10} {bucket['calls']:>7} {bucket['errors']:>7} {fmt(50)} {fmt(95)} {fmt(99)}"
@@ -0,0 +1,86 @@
+import json
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from invoices import benchmarks
+from invoices.loadtest import run_load
+from invoices.management.commands.mock_zatca_server import fraction
+from invoices.mock_zatca import LatencyModel, MockZATCAServer
+from invoices.models import Invoice
+
+
+class Command(BaseCommand):
+    help = (
+        "Push invoices through ZATCAService at a fixed rate, against a local mock server "
+        "(started in-process unless --api-url is given), using a separate benchmark database"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rate', type=float, default=10.0, help="Invoices per second (default 10)")
+        parser.add_argument('--duration', type=float, default=30.0, help="Seconds to run (default 30)")
+        parser.add_argument('--workers', type=int, default=8, help="Submission threads (default 8)")
+        parser.add_argument('--lines-per-invoice', type=int, default=5)
+        parser.add_argument('--api-url', help="Use an already running server, e.g. from mock_zatca_server")
+        parser.add_argument('--latency', default='lognormal:50,0.5',
+                            help="Latency spec for the in-process mock (see mock_zatca_server --help)")
+        parser.add_argument('--error-rate', type=fraction, default=0.0)
+        parser.add_argument('--throttle-rate', type=fraction, default=0.0)
+        parser.add_argument('--retry-after', type=float, default=0.0)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--json', action='store_true', help="Print the summary as JSON")
+        parser.add_argument('--keepdb', action='store_true', help="Keep and reuse the benchmark database")
+
+    def handle(self, *args, **options):
+        if options['rate'] <= 0 or options['duration'] <= 0 or options['workers'] < 1:
+            raise CommandError("--rate, --duration and --workers must be positive")
+        count = max(int(options['rate'] * options['duration']), 1)
+
+        with benchmarks.benchmark_database(keepdb=options['keepdb']):
+            invoice_ids = self.prepare_invoices(count, options['lines_per_invoice'])
+            if options['api_url']:
+                summary = self.run(invoice_ids, options['api_url'], options)
+            else:
+                try:
+                    latency = LatencyModel.parse(options['latency'])
+                except ValueError as e:
+                    raise CommandError(str(e))
+                with MockZATCAServer(
+                    latency=latency, error_rate=options['error_rate'], throttle_rate=options['throttle_rate'],
+                    retry_after=options['retry_after'], seed=options['seed'],
+                ) as server:
+                    summary = self.run(invoice_ids, server.url, options)
+                    summary['server'] = server.stats()
+
+        if options['json']:
+            self.stdout.write(json.dumps(summary, indent=2))
+            return
+        self.stdout.write(
+            f"Submitted {summary['submitted']} invoices in {summary['elapsed_s']:.1f}s "
+            f"({summary['achieved_rate']:.1f}/s offered {summary['offered_rate']:g}/s, {summary['workers']} workers)")
+        self.stdout.write(
+            f"Succeeded {summary['succeeded']}, failed {summary['failed']}, client retries {summary['retries']:g}")
+        for name in ('latency_ms', 'service_time_ms', 'queue_wait_ms'):
+            stats = summary[name]
+            self.stdout.write(
+                f"  {name:<16} p50 {stats['p50']:9.1f}  p95 {stats['p95']:9.1f}  "
+                f"p99 {stats['p99']:9.1f}  max {stats['max']:9.1f}")
+        for message, occurrences in summary['errors'].items():
+            self.stdout.write(self.style.WARNING(f"  {occurrences} x {message}"))
+        if 'server' in summary:
+            self.stdout.write(f"Mock server saw {summary['server']['requests']} requests: {summary['server']['by_status']}")
+
+    def prepare_invoices(self, count, lines_per_invoice):
+        ids = list(Invoice.objects.order_by('pk').values_list('pk', flat=True)[:count])
+        if len(ids) < count:
+            if ids:
+                call_command('flush', interactive=False, verbosity=0)
+            self.stdout.write(f"Seeding {count} invoices...")
+            benchmarks.seed(count * lines_per_invoice, lines_per_invoice)
+            ids = list(Invoice.objects.order_by('pk').values_list('pk', flat=True)[:count])
+        return ids
+
+    def run(self, invoice_ids, api_url, options):
+        self.stdout.write(
+            f"Submitting {len(invoice_ids)} invoices at {options['rate']:g}/s to {api_url}...")
+        return run_load(invoice_ids, options['rate'], api_url=api_url, workers=options['workers'])
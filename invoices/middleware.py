@@ -0,0 +1,184 @@
+import logging
+import re
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.middleware.gzip import GZipMiddleware
+
+from .metrics import REGISTRY
+
+
+logger = logging.getLogger(__name__)
+
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+REQUESTS = REGISTRY.counter(
+    'zatca_http_requests_total', 'HTTP requests handled, by URL name, method and status code')
+REQUEST_DURATION = REGISTRY.histogram(
+    'zatca_http_request_duration_seconds', 'View latency by URL name')
+DB_QUERIES = REGISTRY.histogram(
+    'zatca_http_db_queries', 'SQL queries issued per request by URL name', buckets=QUERY_COUNT_BUCKETS)
+DB_DURATION = REGISTRY.histogram(
+    'zatca_http_db_duration_seconds', 'Total SQL time per request by URL name')
+DUPLICATE_QUERIES = REGISTRY.counter(
+    'zatca_http_duplicate_queries_total', 'Repeated SQL fingerprints (likely N+1) by URL name')
+
+_PLACEHOLDER_LIST = re.compile(r'%s(?:\s*,\s*%s)+')
+_WHITESPACE = re.compile(r'\s+')
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Raised in assert mode when a request exceeds its query budget"""
+
+
+def fingerprint(sql):
+    """Normalize SQL so queries differing only in parameters compare equal"""
+    sql = _PLACEHOLDER_LIST.sub('%s, ...', sql)
+    return _WHITESPACE.sub(' ', sql).strip()
+
+
+class QueryRecorder:
+    """Database execute wrapper collecting query count, time and fingerprints"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            key = fingerprint(sql)
+            self.fingerprints[key] = self.fingerprints.get(key, 0) + 1
+
+    def duplicates(self, threshold=2):
+        """Return {fingerprint: count} for statements run at least `threshold` times"""
+        return {sql: count for sql, count in self.fingerprints.items() if count >= threshold}
+
+    def record(self):
+        """Context manager installing the recorder on every configured database"""
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(self))
+        return stack
+
+
+class RecordingStream:
+    """
+    Iterator over a streaming response's content that records the queries
+    run while each chunk is produced, and calls `finish` once when the
+    stream is exhausted or closed
+    """
+
+    def __init__(self, content, recorder, finish):
+        self.iterator = iter(content)
+        self.recorder = recorder
+        self.finish = finish
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            with self.recorder.record():
+                return next(self.iterator)
+        except StopIteration:
+            self.close()
+            raise
+
+    def close(self):
+        finish, self.finish = self.finish, None
+        if finish is not None:
+            finish()
+
+
+class QueryMetricsMiddleware:
+    """
+    Record SQL query count, SQL time, duplicate queries and view latency per
+    URL name. Results are exported through Server-Timing headers and the
+    /metrics endpoint. With QUERY_METRICS_ASSERT enabled, requests exceeding
+    QUERY_METRICS_MAX_QUERIES or repeating a statement
+    QUERY_METRICS_DUPLICATE_THRESHOLD times raise QueryBudgetExceeded.
+
+    Queries run while a (synchronous) streaming response is iterated are
+    recorded when the stream ends; its Server-Timing header, sent before the
+    body, only covers the view.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not getattr(settings, 'QUERY_METRICS_ENABLED', True):
+            return self.get_response(request)
+
+        recorder = QueryRecorder()
+        start = time.perf_counter()
+        with recorder.record():
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - start
+
+        match = getattr(request, 'resolver_match', None)
+        view = match.url_name if match and match.url_name else 'unresolved'
+        db_timing = f'db;dur={recorder.duration * 1000:.2f};desc="{recorder.count} queries"'
+        app_timing = f'app;dur={elapsed * 1000:.2f}'
+
+        if response.streaming and not response.is_async:
+            response['Server-Timing'] = f'{db_timing}, {app_timing}'
+            response.streaming_content = RecordingStream(
+                response.streaming_content, recorder,
+                lambda: self.observe(request, response, view, recorder, elapsed))
+            return response
+
+        duplicates = self.observe(request, response, view, recorder, elapsed)
+        repeated = sum(count - 1 for count in duplicates.values())
+        response['Server-Timing'] = f'{db_timing}, dup;desc="{repeated} duplicate queries", {app_timing}'
+        return response
+
+    def observe(self, request, response, view, recorder, elapsed):
+        """Export the request's metrics (and check its budget); returns the duplicate queries"""
+        threshold = getattr(settings, 'QUERY_METRICS_DUPLICATE_THRESHOLD', 5)
+        duplicates = recorder.duplicates(threshold)
+        repeated = sum(count - 1 for count in duplicates.values())
+
+        REQUESTS.inc(view=view, method=request.method, status=response.status_code)
+        REQUEST_DURATION.observe(elapsed, view=view)
+        DB_QUERIES.observe(recorder.count, view=view)
+        DB_DURATION.observe(recorder.duration, view=view)
+        if repeated:
+            DUPLICATE_QUERIES.inc(repeated, view=view)
+            for sql, count in duplicates.items():
+                logger.warning("Possible N+1 in %s: %d x %s", view, count, sql)
+
+        if getattr(settings, 'QUERY_METRICS_ASSERT', False):
+            self.check_budget(view, recorder, duplicates)
+        return duplicates
+
+    def check_budget(self, view, recorder, duplicates):
+        max_queries = getattr(settings, 'QUERY_METRICS_MAX_QUERIES', None)
+        if max_queries is not None and recorder.count > max_queries:
+            raise QueryBudgetExceeded(
+                f"{view} issued {recorder.count} queries (budget {max_queries})")
+        if duplicates:
+            sql, count = max(duplicates.items(), key=lambda item: item[1])
+            raise QueryBudgetExceeded(f"{view} repeated a query {count} times: {sql}")
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """
+    GZipMiddleware that leaves server-sent event streams alone: gzip buffers
+    its output, which would hold events back until the buffer fills. Brotli
+    is only used for pre-compressed static files (see invoices.staticfiles),
+    as Django's BREACH length randomization exists for gzip alone.
+    """
+
+    def process_response(self, request, response):
+        if response.get('Content-Type', '').startswith('text/event-stream'):
+            return response
+        return super().process_response(request, response)
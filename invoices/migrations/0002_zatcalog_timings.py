@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-19 05:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='zatcalog',
+            name='timings',
+            field=models.JSONField(blank=True, help_text='Call timings in ms (dns, connect, tls, ttfb, total), payload bytes and retries', null=True),
+        ),
+    ]
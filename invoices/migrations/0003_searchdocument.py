@@ -0,0 +1,85 @@
+# Generated by Django 6.0 on 2026-10-19 05:37
+
+from django.db import migrations, models
+
+
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE invoices_searchdocument_fts USING fts5(
+        text,
+        content='invoices_searchdocument',
+        content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3 4'
+    )
+    """,
+    """
+    CREATE TRIGGER invoices_searchdocument_ai AFTER INSERT ON invoices_searchdocument BEGIN
+        INSERT INTO invoices_searchdocument_fts (rowid, text) VALUES (new.id, new.text);
+    END
+    """,
+    """
+    CREATE TRIGGER invoices_searchdocument_ad AFTER DELETE ON invoices_searchdocument BEGIN
+        INSERT INTO invoices_searchdocument_fts (invoices_searchdocument_fts, rowid, text)
+        VALUES ('delete', old.id, old.text);
+    END
+    """,
+    """
+    CREATE TRIGGER invoices_searchdocument_au AFTER UPDATE OF text ON invoices_searchdocument BEGIN
+        INSERT INTO invoices_searchdocument_fts (invoices_searchdocument_fts, rowid, text)
+        VALUES ('delete', old.id, old.text);
+        INSERT INTO invoices_searchdocument_fts (rowid, text) VALUES (new.id, new.text);
+    END
+    """,
+]
+
+SQLITE_REVERSE = [
+    'DROP TRIGGER IF EXISTS invoices_searchdocument_au',
+    'DROP TRIGGER IF EXISTS invoices_searchdocument_ad',
+    'DROP TRIGGER IF EXISTS invoices_searchdocument_ai',
+    'DROP TABLE IF EXISTS invoices_searchdocument_fts',
+]
+
+POSTGRESQL_FORWARD = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX invoices_searchdocument_text_trgm ON invoices_searchdocument USING gin (text gin_trgm_ops)',
+]
+
+POSTGRESQL_REVERSE = [
+    'DROP INDEX IF EXISTS invoices_searchdocument_text_trgm',
+]
+
+
+def _run(statements):
+    def run(apps, schema_editor):
+        for sql in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(sql)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0002_zatcalog_timings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('invoice', 'Invoice'), ('customer', 'Customer'), ('company', 'Company'), ('item', 'Invoice Item')], max_length=10)),
+                ('object_id', models.BigIntegerField()),
+                ('invoice_id', models.BigIntegerField(blank=True, db_index=True, null=True)),
+                ('label', models.CharField(max_length=255)),
+                ('text', models.TextField()),
+            ],
+            options={
+                'unique_together': {('kind', 'object_id')},
+            },
+        ),
+        migrations.RunPython(
+            _run({'sqlite': SQLITE_FORWARD, 'postgresql': POSTGRESQL_FORWARD}),
+            _run({'sqlite': SQLITE_REVERSE, 'postgresql': POSTGRESQL_REVERSE}),
+        ),
+    ]
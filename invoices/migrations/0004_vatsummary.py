@@ -0,0 +1,34 @@
+# Generated by Django 6.0 on 2026-10-19 05:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0003_searchdocument'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VATSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('vat_rate', models.DecimalField(decimal_places=2, max_digits=5)),
+                ('invoice_type', models.CharField(choices=[('standard', 'Standard Invoice'), ('simplified', 'Simplified Invoice'), ('debit', 'Debit Note'), ('credit', 'Credit Note')], max_length=20)),
+                ('status', models.CharField(choices=[('draft', 'Draft'), ('submitted', 'Submitted to ZATCA'), ('approved', 'Approved'), ('rejected', 'Rejected'), ('cancelled', 'Cancelled')], max_length=20)),
+                ('invoice_count', models.PositiveIntegerField(default=0, help_text='Invoices with at least one line at this rate')),
+                ('line_count', models.PositiveIntegerField(default=0)),
+                ('taxable_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('vat_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='vat_summaries', to='invoices.company')),
+            ],
+            options={
+                'verbose_name_plural': 'VAT summaries',
+                'ordering': ['company', 'day', 'vat_rate'],
+                'unique_together': {('company', 'day', 'vat_rate', 'invoice_type', 'status')},
+            },
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 6.0 on 2026-10-19 05:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0004_vatsummary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InvoiceSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('series', models.CharField(default='INV', max_length=20)),
+                ('format', models.CharField(default='{series}-{company}-{year}-{number:06d}', help_text='Python format string; available fields: series, company, year, number', max_length=100)),
+                ('next_number', models.PositiveBigIntegerField(default=1)),
+                ('fill_gaps', models.BooleanField(default=True, help_text='Reuse released numbers before issuing new ones')),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sequences', to='invoices.company')),
+            ],
+            options={
+                'unique_together': {('company', 'series')},
+            },
+        ),
+        migrations.CreateModel(
+            name='SequenceGap',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.PositiveBigIntegerField()),
+                ('end', models.PositiveBigIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('sequence', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='gaps', to='invoices.invoicesequence')),
+            ],
+            options={
+                'ordering': ['sequence', 'start'],
+            },
+        ),
+    ]
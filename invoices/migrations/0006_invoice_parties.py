@@ -0,0 +1,44 @@
+# Generated by Django 6.0 on 2026-10-19 05:44
+
+from django.db import migrations, models
+
+
+SELLER_FIELDS = [
+    'name', 'vat_number', 'cr_number', 'building_number', 'street_name', 'district', 'city', 'postal_code', 'country',
+]
+BUYER_FIELDS = [
+    'name', 'vat_number', 'building_number', 'street_name', 'district', 'city', 'postal_code', 'country', 'email', 'phone',
+]
+
+
+def freeze_issued_invoices(apps, schema_editor):
+    """Snapshot current company/customer details onto invoices already out of draft"""
+    Invoice = apps.get_model('invoices', 'Invoice')
+    issued = Invoice.objects.exclude(status='draft').filter(parties__isnull=True).select_related('company', 'customer')
+    batch = []
+    for invoice in issued.iterator(chunk_size=2000):
+        invoice.parties = {
+            'seller': {field: getattr(invoice.company, field) for field in SELLER_FIELDS},
+            'buyer': {field: getattr(invoice.customer, field) for field in BUYER_FIELDS},
+        }
+        batch.append(invoice)
+        if len(batch) == 2000:
+            Invoice.objects.bulk_update(batch, ['parties'])
+            batch = []
+    Invoice.objects.bulk_update(batch, ['parties'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0005_invoicesequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='parties',
+            field=models.JSONField(blank=True, help_text='Seller and buyer details as issued, frozen when the invoice left draft', null=True),
+        ),
+        migrations.RunPython(freeze_issued_invoices, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 6.0 on 2026-10-19 05:52
+
+import invoices.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0006_invoice_parties'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='zatcalog',
+            name='request_sha256',
+            field=models.CharField(blank=True, help_text='SHA-256 of the request body as sent', max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='invoice',
+            name='zatca_response',
+            field=invoices.models.PayloadJSONField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='zatcalog',
+            name='request_data',
+            field=invoices.models.PayloadJSONField(),
+        ),
+        migrations.AlterField(
+            model_name='zatcalog',
+            name='response_data',
+            field=invoices.models.PayloadJSONField(blank=True, null=True),
+        ),
+    ]
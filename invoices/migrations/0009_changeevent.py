@@ -0,0 +1,30 @@
+# Generated by Django 6.0 on 2026-10-19 06:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0008_batchjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeEvent',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('status', 'Invoice status changed'), ('deleted', 'Invoice deleted'), ('zatca', 'ZATCA call finished')], max_length=20)),
+                ('invoice_id', models.BigIntegerField()),
+                ('company_id', models.BigIntegerField()),
+                ('invoice_number', models.CharField(max_length=50)),
+                ('status', models.CharField(max_length=20)),
+                ('previous_status', models.CharField(blank=True, max_length=20)),
+                ('data', models.JSONField(blank=True, default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+    ]
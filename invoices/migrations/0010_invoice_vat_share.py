@@ -0,0 +1,70 @@
+# Generated by Django 6.0 on 2026-10-19 06:32
+
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def _units(value):
+    return int(Decimal(value).scaleb(2).to_integral_value(rounding=ROUND_HALF_UP))
+
+
+def fill_vat_shares(apps, schema_editor):
+    """Record every invoice's share and rebuild VATSummary from the shares, so the two agree"""
+    Invoice = apps.get_model('invoices', 'Invoice')
+    InvoiceItem = apps.get_model('invoices', 'InvoiceItem')
+    VATSummary = apps.get_model('invoices', 'VATSummary')
+    summaries = {}
+    headers = Invoice.objects.order_by('pk').values_list('pk', 'company_id', 'issue_date', 'invoice_type', 'status')
+    batch = []
+
+    def flush():
+        rates = {}
+        lines = (InvoiceItem.objects.filter(invoice_id__in=[header[0] for header in batch])
+                 .values_list('invoice_id', 'vat_rate').annotate(Count('pk'), Sum('total')).order_by())
+        for invoice_id, rate, line_count, taxable in lines:
+            rates.setdefault(invoice_id, []).append((rate, line_count, taxable))
+        invoices = []
+        for pk, company_id, day, invoice_type, status in batch:
+            share = {'key': [company_id, day.isoformat(), invoice_type, status], 'rates': {}}
+            for rate, line_count, taxable in rates.get(pk, []):
+                rate, taxable = _units(rate), _units(taxable)
+                vat = (taxable * rate + 5000) // 10000 if taxable >= 0 else -((-taxable * rate + 5000) // 10000)
+                share['rates'][str(Decimal(rate).scaleb(-2))] = [line_count, taxable, vat]
+                totals = summaries.setdefault((company_id, day, invoice_type, status, rate), [0, 0, 0, 0])
+                for index, amount in enumerate([1, line_count, taxable, vat]):
+                    totals[index] += amount
+            invoices.append(Invoice(pk=pk, vat_share=share))
+        Invoice.objects.bulk_update(invoices, ['vat_share'], batch_size=1000)
+        batch.clear()
+
+    for header in headers.iterator(chunk_size=2000):
+        batch.append(header)
+        if len(batch) == 2000:
+            flush()
+    flush()
+    VATSummary.objects.all().delete()
+    VATSummary.objects.bulk_create([
+        VATSummary(
+            company_id=company_id, day=day, vat_rate=Decimal(rate).scaleb(-2), invoice_type=invoice_type,
+            status=status, invoice_count=counts[0], line_count=counts[1],
+            taxable_amount=Decimal(counts[2]).scaleb(-2), vat_amount=Decimal(counts[3]).scaleb(-2))
+        for (company_id, day, invoice_type, status, rate), counts in summaries.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0009_changeevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='vat_share',
+            field=models.JSONField(blank=True, default=dict, editable=False, help_text='What this invoice currently adds to VATSummary (see invoices.reporting)'),
+        ),
+        migrations.RunPython(fill_vat_shares, migrations.RunPython.noop),
+    ]
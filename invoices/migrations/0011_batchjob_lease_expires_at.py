@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-19 06:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0010_invoice_vat_share'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='batchjob',
+            name='lease_expires_at',
+            field=models.DateTimeField(blank=True, help_text='A running job whose lease has passed is presumed orphaned and claimed again', null=True),
+        ),
+    ]
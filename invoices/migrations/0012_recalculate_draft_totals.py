@@ -0,0 +1,131 @@
+# Generated by Django 6.0 on 2026-10-19 07:10
+
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db import migrations
+from django.db.models import Count, Sum
+
+
+# The halala arithmetic of invoices.calculator as of this migration, frozen here
+# so later changes to the calculator do not change what the migration did
+
+def _units(value):
+    return int(Decimal(value).scaleb(2).to_integral_value(rounding=ROUND_HALF_UP))
+
+
+def _amount(units):
+    return Decimal(units).scaleb(-2)
+
+
+def _round_div(numerator, denominator):
+    quotient = (abs(numerator) + denominator // 2) // denominator
+    return quotient if numerator >= 0 else -quotient
+
+
+def _line_amounts(item):
+    net = _round_div(_units(item.quantity) * _units(item.unit_price), 100) - _units(item.discount)
+    return net, _round_div(net * _units(item.vat_rate), 10000)
+
+
+def _invoice_totals(nets, rates, discount):
+    taxable = {}
+    for net, rate in zip(nets, rates):
+        taxable[rate] = taxable.get(rate, 0) + net
+    subtotal = sum(taxable.values())
+    vat = sum(_round_div(amount * rate, 10000) for rate, amount in taxable.items())
+    return subtotal, vat, subtotal + vat - discount
+
+
+def _fill_vat_shares(apps):
+    """Record every invoice's share and rebuild VATSummary from the shares (as in 0010)"""
+    Invoice = apps.get_model('invoices', 'Invoice')
+    InvoiceItem = apps.get_model('invoices', 'InvoiceItem')
+    VATSummary = apps.get_model('invoices', 'VATSummary')
+    summaries = {}
+    headers = Invoice.objects.order_by('pk').values_list('pk', 'company_id', 'issue_date', 'invoice_type', 'status')
+    batch = []
+
+    def flush():
+        rates = {}
+        lines = (InvoiceItem.objects.filter(invoice_id__in=[header[0] for header in batch])
+                 .values_list('invoice_id', 'vat_rate').annotate(Count('pk'), Sum('total')).order_by())
+        for invoice_id, rate, line_count, taxable in lines:
+            rates.setdefault(invoice_id, []).append((rate, line_count, taxable))
+        invoices = []
+        for pk, company_id, day, invoice_type, status in batch:
+            share = {'key': [company_id, day.isoformat(), invoice_type, status], 'rates': {}}
+            for rate, line_count, taxable in rates.get(pk, []):
+                rate, taxable = _units(rate), _units(taxable)
+                vat = _round_div(taxable * rate, 10000)
+                share['rates'][str(_amount(rate))] = [line_count, taxable, vat]
+                totals = summaries.setdefault((company_id, day, invoice_type, status, rate), [0, 0, 0, 0])
+                for index, amount in enumerate([1, line_count, taxable, vat]):
+                    totals[index] += amount
+            invoices.append(Invoice(pk=pk, vat_share=share))
+        Invoice.objects.bulk_update(invoices, ['vat_share'], batch_size=1000)
+        batch.clear()
+
+    for header in headers.iterator(chunk_size=2000):
+        batch.append(header)
+        if len(batch) == 2000:
+            flush()
+    flush()
+    VATSummary.objects.all().delete()
+    VATSummary.objects.bulk_create([
+        VATSummary(
+            company_id=company_id, day=day, vat_rate=_amount(rate), invoice_type=invoice_type,
+            status=status, invoice_count=counts[0], line_count=counts[1],
+            taxable_amount=_amount(counts[2]), vat_amount=_amount(counts[3]))
+        for (company_id, day, invoice_type, status, rate), counts in summaries.items()
+    ], batch_size=1000)
+
+
+def recalculate_drafts(apps, schema_editor):
+    """
+    Reprice unsubmitted invoices with the halala calculator, as
+    `recalculate_invoices` does, so drafts saved with the old rounding pass the
+    stored-totals validation rule. Issued invoices keep the amounts they were
+    reported with.
+    """
+    Invoice = apps.get_model('invoices', 'Invoice')
+    InvoiceItem = apps.get_model('invoices', 'InvoiceItem')
+    ids = list(Invoice.objects.filter(status='draft').order_by('pk').values_list('pk', flat=True))
+    changed_any = False
+    for start in range(0, len(ids), 2000):
+        batch = ids[start:start + 2000]
+        lines, changed_lines = {}, []
+        for item in InvoiceItem.objects.filter(invoice_id__in=batch).order_by('invoice_id', 'pk'):
+            net, vat = _line_amounts(item)
+            if (_units(item.total), _units(item.vat_amount)) != (net, vat):
+                item.total, item.vat_amount = _amount(net), _amount(vat)
+                changed_lines.append(item)
+            invoice_lines = lines.setdefault(item.invoice_id, ([], []))
+            invoice_lines[0].append(net)
+            invoice_lines[1].append(_units(item.vat_rate))
+
+        changed_invoices = []
+        for invoice in Invoice.objects.filter(pk__in=batch).only('discount', 'subtotal', 'vat_amount', 'total'):
+            totals = _invoice_totals(*lines.get(invoice.pk, ([], [])), _units(invoice.discount))
+            amounts = tuple(_amount(units) for units in totals)
+            if (invoice.subtotal, invoice.vat_amount, invoice.total) != amounts:
+                invoice.subtotal, invoice.vat_amount, invoice.total = amounts
+                changed_invoices.append(invoice)
+
+        InvoiceItem.objects.bulk_update(changed_lines, ['total', 'vat_amount'], batch_size=1000)
+        Invoice.objects.bulk_update(changed_invoices, ['subtotal', 'vat_amount', 'total'], batch_size=1000)
+        changed_any = changed_any or bool(changed_lines)
+
+    if changed_any:
+        # Line amounts feed the VAT summaries; recompute them and the invoice shares
+        _fill_vat_shares(apps)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0011_batchjob_lease_expires_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(recalculate_drafts, migrations.RunPython.noop),
+    ]
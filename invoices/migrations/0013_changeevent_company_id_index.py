@@ -0,0 +1,17 @@
+# Generated by Django 6.0 on 2026-10-19 06:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0012_recalculate_draft_totals'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='changeevent',
+            index=models.Index(fields=['company_id', 'id'], name='invoices_ch_company_b485fe_idx'),
+        ),
+    ]
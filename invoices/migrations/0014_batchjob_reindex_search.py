@@ -0,0 +1,24 @@
+# Generated by Django 6.0 on 2026-10-19 06:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0013_changeevent_company_id_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='batchjob',
+            name='action',
+            field=models.CharField(choices=[('submit', 'Submit to ZATCA'), ('refresh_status', 'Refresh ZATCA status'), ('cancel', 'Cancel in ZATCA'), ('recalculate', 'Recalculate amounts'), ('reindex_search', 'Rebuild search documents')], max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='batchjob',
+            name='invoice',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='batch_jobs', to='invoices.invoice'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-19 06:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0014_batchjob_reindex_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='batchjob',
+            name='retryable',
+            field=models.BooleanField(default=False, help_text="Failed for a reason that may pass (network error, throttling, ZATCA outage); holds the company's later jobs until retried"),
+        ),
+    ]
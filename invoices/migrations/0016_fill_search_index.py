@@ -0,0 +1,81 @@
+# Generated by Django 6.0 on 2026-10-19 06:55
+
+import re
+import unicodedata
+
+from django.db import migrations
+
+
+# invoices.search.normalize() as of this migration
+_FOLD = str.maketrans({
+    '\u0640': None,  # tatweel
+    '\u0649': '\u064a',  # alef maksura -> ya
+    '\u0629': '\u0647',  # ta marbuta -> ha
+    **{chr(0x0660 + digit): str(digit) for digit in range(10)},  # Arabic-Indic digits
+    **{chr(0x06f0 + digit): str(digit) for digit in range(10)},  # Extended Arabic-Indic digits
+})
+_TOKENS = re.compile(r'\w+')
+
+
+def _join(*values):
+    text = unicodedata.normalize('NFKD', ' '.join(value for value in values if value))
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return ' '.join(_TOKENS.findall(text.translate(_FOLD).casefold()))
+
+
+def fill_search_index(apps, schema_editor):
+    """
+    Index the companies, customers, invoices and lines that existed before
+    0003 added the index; on SQLite the FTS5 triggers index each row as it
+    is inserted. Rewrites any documents already there, like rebuild_search_index.
+    """
+    Company = apps.get_model('invoices', 'Company')
+    Customer = apps.get_model('invoices', 'Customer')
+    Invoice = apps.get_model('invoices', 'Invoice')
+    InvoiceItem = apps.get_model('invoices', 'InvoiceItem')
+    SearchDocument = apps.get_model('invoices', 'SearchDocument')
+
+    def company(obj):
+        return {'label': f"{obj.name} ({obj.vat_number})", 'text': _join(obj.name, obj.vat_number, obj.cr_number)}
+
+    def customer(obj):
+        label = f"{obj.name} ({obj.vat_number})" if obj.vat_number else obj.name
+        return {'label': label, 'text': _join(obj.name, obj.vat_number, obj.email)}
+
+    def invoice(obj):
+        return {
+            'invoice_id': obj.pk,
+            'label': f"{obj.invoice_number} - {obj.customer.name}",
+            'text': _join(obj.invoice_number, obj.customer.name, obj.customer.vat_number,
+                          obj.company.name, obj.company.vat_number),
+        }
+
+    def item(obj):
+        return {'invoice_id': obj.invoice_id, 'label': obj.description[:255], 'text': _join(obj.description)}
+
+    SearchDocument.objects.all().delete()
+    sources = [
+        ('company', Company.objects.order_by('pk'), company),
+        ('customer', Customer.objects.order_by('pk'), customer),
+        ('invoice', Invoice.objects.select_related('customer', 'company').order_by('pk'), invoice),
+        ('item', InvoiceItem.objects.order_by('pk'), item),
+    ]
+    for kind, queryset, build in sources:
+        batch = []
+        for obj in queryset.iterator(chunk_size=2000):
+            batch.append(SearchDocument(kind=kind, object_id=obj.pk, **build(obj)))
+            if len(batch) == 2000:
+                SearchDocument.objects.bulk_create(batch)
+                batch = []
+        SearchDocument.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0015_batchjob_retryable'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_search_index, migrations.RunPython.noop),
+    ]
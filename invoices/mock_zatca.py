@@ -0,0 +1,252 @@
+"""
+Local stand-in for the ZATCA e-invoicing API.
+
+Implements the endpoints used by ZATCAService:
+
+    POST /invoices                 -> {"uuid", "qrCode", "status"}
+    GET  /invoices/{uuid}          -> {"uuid", "status"}
+    POST /invoices/{uuid}/cancel   -> {"uuid", "status": "cancelled"}
+    GET  /_stats                   -> request counts by endpoint and status
+
+Responses are deterministic: the UUID is derived from the invoice number so
+repeated runs produce identical data. Latency, server errors and 429
+throttling can be injected to exercise retries and connection pooling.
+"""
+import base64
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+UUID_NAMESPACE = uuid.UUID('6c3c1f4e-0b1a-4c35-9d55-2f5b8d7c9a10')
+
+_INVOICE_PATH = re.compile(r'^/invoices/(?P<uuid>[^/]+)$')
+_CANCEL_PATH = re.compile(r'^/invoices/(?P<uuid>[^/]+)/cancel$')
+
+
+def invoice_uuid(invoice_number):
+    return str(uuid.uuid5(UUID_NAMESPACE, invoice_number))
+
+
+def invoice_qr(payload):
+    seller = payload.get('seller', {})
+    totals = payload.get('totals', {})
+    text = '|'.join(str(value) for value in (
+        seller.get('name', ''), seller.get('vatNumber', ''), payload.get('issueDate', ''),
+        totals.get('total', ''), totals.get('vatAmount', ''),
+    ))
+    return base64.b64encode(text.encode('utf-8')).decode('ascii')
+
+
+class LatencyModel:
+    """
+    Response delay distribution, parsed from a spec string (milliseconds):
+
+        none                    no delay
+        fixed:50                always 50 ms
+        uniform:20,200          uniformly between 20 and 200 ms
+        normal:100,30           mean 100 ms, standard deviation 30 ms
+        exponential:80          mean 80 ms
+        lognormal:60,0.8        median 60 ms, sigma 0.8 (long tail)
+    """
+    KINDS = {'none': 0, 'fixed': 1, 'uniform': 2, 'normal': 2, 'exponential': 1, 'lognormal': 2}
+
+    def __init__(self, kind='none', params=()):
+        if kind not in self.KINDS:
+            raise ValueError(f"Unknown latency distribution '{kind}'")
+        if len(params) != self.KINDS[kind]:
+            raise ValueError(f"'{kind}' latency takes {self.KINDS[kind]} parameter(s)")
+        self.kind = kind
+        self.params = tuple(params)
+
+    @classmethod
+    def parse(cls, spec):
+        kind, _, args = (spec or 'none').partition(':')
+        try:
+            params = [float(value) for value in args.split(',')] if args else []
+        except ValueError:
+            raise ValueError(f"Invalid latency spec '{spec}'")
+        return cls(kind, params)
+
+    def sample(self, rng):
+        """Return a delay in seconds"""
+        if self.kind == 'none':
+            return 0.0
+        if self.kind == 'fixed':
+            ms = self.params[0]
+        elif self.kind == 'uniform':
+            ms = rng.uniform(*self.params)
+        elif self.kind == 'normal':
+            ms = rng.gauss(*self.params)
+        elif self.kind == 'exponential':
+            ms = rng.expovariate(1 / self.params[0]) if self.params[0] else 0.0
+        else:
+            median, sigma = self.params
+            ms = rng.lognormvariate(0, sigma) * median
+        return max(ms, 0.0) / 1000
+
+    def __str__(self):
+        return self.kind + (':' + ','.join(f'{value:g}' for value in self.params) if self.params else '')
+
+
+class MockZATCAHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Send headers and body in one segment instead of stalling on delayed ACKs
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        return json.loads(body) if body else {}
+
+    def _reply(self, status, data, endpoint, headers=None):
+        self.server.record(endpoint, status)
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _inject_fault(self, endpoint):
+        """Sleep for the configured latency, then maybe answer with an injected 429 or error"""
+        delay, fault = self.server.draw()
+        if delay:
+            time.sleep(delay)
+        if fault == 'throttle':
+            self._reply(429, {'error': 'Too many requests'}, endpoint,
+                        {'Retry-After': f'{self.server.retry_after:g}'})
+            return True
+        if fault == 'error':
+            self._reply(self.server.error_status, {'error': 'Injected failure'}, endpoint)
+            return True
+        return False
+
+    def do_POST(self):
+        try:
+            payload = self._read_json()
+        except ValueError:
+            return self._reply(400, {'error': 'Malformed JSON'}, 'invalid')
+
+        if self.path == '/invoices':
+            if self._inject_fault('submit'):
+                return
+            number = payload.get('invoiceNumber')
+            if not number:
+                return self._reply(400, {'error': 'invoiceNumber is required'}, 'submit')
+            return self._reply(200, {
+                'uuid': invoice_uuid(number),
+                'qrCode': invoice_qr(payload),
+                'status': 'submitted',
+            }, 'submit')
+
+        match = _CANCEL_PATH.match(self.path)
+        if match:
+            if self._inject_fault('cancel'):
+                return
+            return self._reply(200, {'uuid': match['uuid'], 'status': 'cancelled'}, 'cancel')
+        return self._reply(404, {'error': 'Not found'}, 'unknown')
+
+    def do_GET(self):
+        if self.path == '/_stats':
+            return self._reply(200, self.server.stats(), 'stats')
+        match = _INVOICE_PATH.match(self.path)
+        if match:
+            if self._inject_fault('status'):
+                return
+            return self._reply(200, {'uuid': match['uuid'], 'status': 'approved'}, 'status')
+        return self._reply(404, {'error': 'Not found'}, 'unknown')
+
+
+class MockZATCAHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency=None, error_rate=0.0, throttle_rate=0.0,
+                 error_status=500, retry_after=1.0, seed=None, verbose=False):
+        super().__init__(address, MockZATCAHandler)
+        self.latency = latency or LatencyModel()
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.verbose = verbose
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._counts = Counter()
+
+    def draw(self):
+        """Return (delay seconds, fault) for one request; fault is None, 'throttle' or 'error'"""
+        with self._lock:
+            delay = self.latency.sample(self._rng)
+            roll = self._rng.random()
+        if roll < self.throttle_rate:
+            return delay, 'throttle'
+        if roll < self.throttle_rate + self.error_rate:
+            return delay, 'error'
+        return delay, None
+
+    def record(self, endpoint, status):
+        with self._lock:
+            self._counts[(endpoint, status)] += 1
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._counts)
+        return {
+            'requests': sum(count for (endpoint, _), count in counts.items() if endpoint != 'stats'),
+            'by_status': {f'{endpoint} {status}': count for (endpoint, status), count in sorted(counts.items())},
+        }
+
+
+class MockZATCAServer:
+    """
+    Threaded mock API server. Use as a context manager to run it in a
+    background thread:
+
+        with MockZATCAServer(latency=LatencyModel.parse('lognormal:40,0.5')) as server:
+            ZATCAService(api_url=server.url).submit_invoice(invoice)
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, **options):
+        self.httpd = MockZATCAHTTPServer((host, port), **options)
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def stats(self):
+        return self.httpd.stats()
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
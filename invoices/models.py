@@ -1,6 +1,31 @@
 from django.db import models
 from django.contrib.auth.models import User
 
+from . import calculator
+
+
+class RawJSON(dict):
+    """
+    A decoded JSON object that remembers the exact text it was encoded as
+    (see invoices.serializers). PayloadJSONField stores that text as is
+    instead of encoding the dict again.
+    """
+
+    def __init__(self, data, text):
+        super().__init__(data)
+        self.text = text
+
+
+class PayloadJSONField(models.JSONField):
+    """JSONField that writes RawJSON values without re-serializing them"""
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        # jsonb on PostgreSQL normalizes the text anyway, so only other
+        # backends store the original bytes.
+        if isinstance(value, RawJSON) and connection.vendor != 'postgresql':
+            return value.text
+        return super().get_db_prep_value(value, connection, prepared)
+
 
 class Company(models.Model):
     """Company/Seller Information"""
@@ -61,6 +86,16 @@ class Invoice(models.Model):
         ('cancelled', 'Cancelled'),
     ]
 
+    # Company and Customer fields copied into `parties` when the invoice leaves draft
+    SELLER_FIELDS = [
+        'name', 'vat_number', 'cr_number', 'building_number', 'street_name', 'district', 'city',
+        'postal_code', 'country',
+    ]
+    BUYER_FIELDS = [
+        'name', 'vat_number', 'building_number', 'street_name', 'district', 'city', 'postal_code',
+        'country', 'email', 'phone',
+    ]
+
     # Invoice Basic Info
     invoice_number = models.CharField(max_length=50, unique=True)
     invoice_type = models.CharField(max_length=20, choices=INVOICE_TYPES, default='standard')
@@ -80,8 +115,10 @@ class Invoice(models.Model):
     # ZATCA Specific Fields
     uuid = models.CharField(max_length=255, blank=True, null=True, verbose_name="ZATCA UUID")
     qr_code = models.TextField(blank=True, null=True)
-    zatca_response = models.JSONField(blank=True, null=True)
+    zatca_response = PayloadJSONField(blank=True, null=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='draft')
+    parties = models.JSONField(blank=True, null=True, help_text="Seller and buyer details as issued, frozen when the invoice left draft")
+    vat_share = models.JSONField(default=dict, blank=True, editable=False, help_text="What this invoice currently adds to VATSummary (see invoices.reporting)")
     
     # Additional Info
     notes = models.TextField(blank=True, null=True)
@@ -93,15 +130,62 @@ class Invoice(models.Model):
         ordering = ['-issue_date', '-issue_time']
 
     def __str__(self):
-        return f"{self.invoice_number} - {self.customer.name}"
+        return f"{self.invoice_number} - {self.buyer['name']}"
+
+    def save(self, *args, **kwargs):
+        """
+        Freeze seller and buyer details the first time the invoice is saved
+        outside draft. vat_share belongs to invoices.reporting, so a full save
+        of an existing invoice writes every other loaded field but not that one.
+        """
+        if kwargs.get('update_fields') is None and not self._state.adding and not kwargs.get('force_insert'):
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.attname for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'vat_share' and field.attname not in deferred
+            ]
+        if self.status != 'draft' and self.parties is None:
+            self.freeze_parties()
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'parties'}
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def snapshot_parties(cls, company, customer):
+        return {
+            'seller': {field: getattr(company, field) for field in cls.SELLER_FIELDS},
+            'buyer': {field: getattr(customer, field) for field in cls.BUYER_FIELDS},
+        }
+
+    def freeze_parties(self):
+        """Copy the current company and customer details into `parties` (does not save)"""
+        self.parties = self.snapshot_parties(self.company, self.customer)
+
+    @property
+    def seller(self):
+        """Seller details as issued; read from the live company until the invoice is frozen"""
+        if self.parties:
+            return self.parties['seller']
+        return {field: getattr(self.company, field) for field in self.SELLER_FIELDS}
+
+    @property
+    def buyer(self):
+        """Buyer details as issued; read from the live customer until the invoice is frozen"""
+        if self.parties:
+            return self.parties['buyer']
+        return {field: getattr(self.customer, field) for field in self.BUYER_FIELDS}
 
     def calculate_totals(self):
         """Calculate invoice totals from line items"""
-        items = self.items.all()
-        self.subtotal = sum(item.total for item in items)
-        self.vat_amount = sum(item.vat_amount for item in items)
-        self.total = self.subtotal + self.vat_amount - self.discount
-        self.save()
+        self.apply_totals(self.items.all())
+        self.save(update_fields=['subtotal', 'vat_amount', 'total', 'updated_at'])
+
+    def apply_totals(self, items):
+        """Set subtotal, VAT and total from the given lines (see invoices.calculator); does not save"""
+        _, _, totals = calculator.calculate(items, self.discount)
+        self.subtotal = calculator.to_decimal(totals.subtotal)
+        self.vat_amount = calculator.to_decimal(totals.vat)
+        self.total = calculator.to_decimal(totals.total)
 
 
 class InvoiceItem(models.Model):
@@ -117,11 +201,15 @@ class InvoiceItem(models.Model):
     
     def save(self, *args, **kwargs):
         """Calculate line item totals"""
-        line_total = self.quantity * self.unit_price - self.discount
-        self.vat_amount = line_total * (self.vat_rate / 100)
-        self.total = line_total
+        self.compute_amounts()
         super().save(*args, **kwargs)
 
+    def compute_amounts(self):
+        """Set total and vat_amount from quantity, price, discount and rate, rounded per ZATCA"""
+        net, vat = calculator.line_amounts(self.quantity, self.unit_price, self.discount, self.vat_rate)
+        self.total = calculator.to_decimal(net)
+        self.vat_amount = calculator.to_decimal(vat)
+
     def __str__(self):
         return f"{self.description} - {self.quantity} x {self.unit_price}"
 
@@ -130,11 +218,13 @@ class ZATCALog(models.Model):
     """Log ZATCA API interactions"""
     invoice = models.ForeignKey(Invoice, on_delete=models.CASCADE, related_name='zatca_logs')
     action = models.CharField(max_length=50)
-    request_data = models.JSONField()
-    response_data = models.JSONField(blank=True, null=True)
+    request_data = PayloadJSONField()
+    request_sha256 = models.CharField(max_length=64, blank=True, help_text="SHA-256 of the request body as sent")
+    response_data = PayloadJSONField(blank=True, null=True)
     status_code = models.IntegerField(blank=True, null=True)
     success = models.BooleanField(default=False)
     error_message = models.TextField(blank=True, null=True)
+    timings = models.JSONField(blank=True, null=True, help_text="Call timings in ms (dns, connect, tls, ttfb, total), payload bytes and retries")
     timestamp = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -142,3 +232,175 @@ class ZATCALog(models.Model):
 
     def __str__(self):
         return f"{self.action} - {self.invoice.invoice_number} - {self.timestamp}"
+
+
+class SearchDocument(models.Model):
+    """
+    Normalized search text for an invoice, customer, company or invoice line.
+    Kept in sync by signals (see invoices.search); on SQLite an FTS5 index is
+    maintained over `text` by triggers, on PostgreSQL a trigram GIN index.
+    """
+    KINDS = [
+        ('invoice', 'Invoice'),
+        ('customer', 'Customer'),
+        ('company', 'Company'),
+        ('item', 'Invoice Item'),
+    ]
+
+    kind = models.CharField(max_length=10, choices=KINDS)
+    object_id = models.BigIntegerField()
+    invoice_id = models.BigIntegerField(blank=True, null=True, db_index=True)
+    label = models.CharField(max_length=255)
+    text = models.TextField()
+
+    class Meta:
+        unique_together = [('kind', 'object_id')]
+
+    def __str__(self):
+        return f"{self.kind}: {self.label}"
+
+
+class VATSummary(models.Model):
+    """
+    Precomputed VAT totals per company, issue date, VAT rate, invoice type and
+    status. invoices.reporting adjusts the rows an invoice contributes to
+    whenever it changes, so VAT returns read these rows instead of
+    aggregating invoice lines.
+    """
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='vat_summaries')
+    day = models.DateField()
+    vat_rate = models.DecimalField(max_digits=5, decimal_places=2)
+    invoice_type = models.CharField(max_length=20, choices=Invoice.INVOICE_TYPES)
+    status = models.CharField(max_length=20, choices=Invoice.STATUS_CHOICES)
+    invoice_count = models.PositiveIntegerField(default=0, help_text="Invoices with at least one line at this rate")
+    line_count = models.PositiveIntegerField(default=0)
+    taxable_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    vat_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        verbose_name_plural = "VAT summaries"
+        ordering = ['company', 'day', 'vat_rate']
+        unique_together = [('company', 'day', 'vat_rate', 'invoice_type', 'status')]
+
+    def __str__(self):
+        return f"{self.company} {self.day} {self.vat_rate}% {self.invoice_type}/{self.status}"
+
+
+class InvoiceSequence(models.Model):
+    """
+    Invoice number counter for one company and series. Numbers are handed out
+    by invoices.sequences, which advances next_number with a single atomic
+    UPDATE so concurrent allocations never see the same value.
+    """
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='sequences')
+    series = models.CharField(max_length=20, default='INV')
+    format = models.CharField(
+        max_length=100, default='{series}-{company}-{year}-{number:06d}',
+        help_text="Python format string; available fields: series, company, year, number")
+    next_number = models.PositiveBigIntegerField(default=1)
+    fill_gaps = models.BooleanField(default=True, help_text="Reuse released numbers before issuing new ones")
+
+    class Meta:
+        unique_together = [('company', 'series')]
+
+    def __str__(self):
+        return f"{self.company} {self.series} (next {self.next_number})"
+
+    def format_number(self, number, year):
+        return self.format.format(series=self.series, company=self.company_id, year=year, number=number)
+
+
+class SequenceGap(models.Model):
+    """A run of numbers (start..end inclusive) that was reserved but never used"""
+    sequence = models.ForeignKey(InvoiceSequence, on_delete=models.CASCADE, related_name='gaps')
+    start = models.PositiveBigIntegerField()
+    end = models.PositiveBigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['sequence', 'start']
+
+    def __str__(self):
+        return f"{self.sequence.series} {self.start}-{self.end}"
+
+
+class BatchJob(models.Model):
+    """
+    One queued operation on one invoice. Admin bulk actions and batch
+    importers enqueue these instead of calling the ZATCA API inline; the
+    process_batch_jobs command claims and runs them (see invoices.batch).
+    """
+    ACTION_CHOICES = [
+        ('submit', 'Submit to ZATCA'),
+        ('refresh_status', 'Refresh ZATCA status'),
+        ('cancel', 'Cancel in ZATCA'),
+        ('recalculate', 'Recalculate amounts'),
+        ('reindex_search', 'Rebuild search documents'),
+    ]
+
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    action = models.CharField(max_length=20, choices=ACTION_CHOICES)
+    # Empty for jobs that cover many invoices of the company (reindex_search)
+    invoice = models.ForeignKey(Invoice, on_delete=models.CASCADE, related_name='batch_jobs', blank=True, null=True)
+    # Copied from the invoice so workers can be assigned companies without a join
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='batch_jobs')
+    params = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    worker = models.CharField(max_length=100, blank=True)
+    message = models.TextField(blank=True)
+    retryable = models.BooleanField(
+        default=False, help_text="Failed for a reason that may pass (network error, throttling, ZATCA outage); "
+                                 "holds the company's later jobs until retried")
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    lease_expires_at = models.DateTimeField(
+        blank=True, null=True, help_text="A running job whose lease has passed is presumed orphaned and claimed again")
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ['pk']
+        indexes = [models.Index(fields=['status', 'id'])]
+
+    def __str__(self):
+        target = self.invoice_id or f"company {self.company_id}"
+        return f"{self.get_action_display()} {target} ({self.status})"
+
+
+class ChangeEvent(models.Model):
+    """
+    Append-only log of invoice status changes and ZATCA call outcomes, read by
+    downstream systems through the change feed (see invoices.changes). The
+    primary key is the feed cursor: events become visible in id order.
+    """
+    KINDS = [
+        ('status', 'Invoice status changed'),
+        ('deleted', 'Invoice deleted'),
+        ('zatca', 'ZATCA call finished'),
+    ]
+
+    id = models.BigAutoField(primary_key=True)
+    kind = models.CharField(max_length=20, choices=KINDS)
+    # Plain ids so that events outlive the invoices they describe
+    invoice_id = models.BigIntegerField()
+    company_id = models.BigIntegerField()
+    invoice_number = models.CharField(max_length=50)
+    status = models.CharField(max_length=20)
+    previous_status = models.CharField(max_length=20, blank=True)
+    data = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
+        # The per-company feed (?company=) scans one company's events after the cursor
+        indexes = [models.Index(fields=['company_id', 'id'])]
+
+    def __str__(self):
+        return f"#{self.id} {self.kind} {self.invoice_number} {self.status}"
@@ -0,0 +1,130 @@
+"""
+Per-process cache of Company and Customer rows.
+
+Forms, autocomplete lookups and importers resolve the same few companies
+and customers over and over; these caches keep recently used rows in a
+size-bounded LRU with a TTL, keyed by primary key and by VAT number. Saves
+and deletes in this process invalidate entries through the signal receivers
+in invoices.signals; in other processes an entry can be stale for at most
+REFCACHE_TTL seconds.
+
+Cached instances are shared between callers and must be treated as read-only.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .metrics import REGISTRY
+from .models import Company, Customer
+
+
+LOOKUPS = REGISTRY.counter('zatca_refcache_lookups_total', 'Reference cache lookups by model and result (hit/miss)')
+
+
+class LRUCache:
+    """Thread-safe mapping holding at most `maxsize` entries, each for at most `ttl` seconds"""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return None if entry is None else entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class ModelCache:
+    """Look up `model` instances by pk or VAT number through an LRUCache"""
+
+    def __init__(self, model, maxsize=None, ttl=None):
+        self.model = model
+        self.label = model._meta.model_name
+        self.cache = LRUCache(maxsize or settings.REFCACHE_MAXSIZE, ttl or settings.REFCACHE_TTL)
+
+    def _store(self, obj):
+        self.cache.set(('pk', obj.pk), obj)
+        if obj.vat_number:
+            self.cache.set(('vat', obj.vat_number), obj)
+        return obj
+
+    def _lookup(self, key, **lookup):
+        obj = self.cache.get(key)
+        LOOKUPS.inc(model=self.label, result='miss' if obj is None else 'hit')
+        if obj is None:
+            obj = self.model.objects.filter(**lookup).first()
+            if obj is not None:
+                self._store(obj)
+        return obj
+
+    def get(self, pk):
+        """Return the instance with this pk, or None"""
+        return self._lookup(('pk', pk), pk=pk)
+
+    def get_by_vat(self, vat_number):
+        """Return the instance with this VAT number (the first one for customers), or None"""
+        return self._lookup(('vat', vat_number), vat_number=vat_number)
+
+    def get_many(self, pks):
+        """Return {pk: instance} for the given pks, loading all misses in one query"""
+        found, missing = {}, []
+        for pk in pks:
+            obj = self.cache.get(('pk', pk))
+            if obj is None:
+                missing.append(pk)
+            else:
+                found[pk] = obj
+        LOOKUPS.inc(len(found), model=self.label, result='hit')
+        LOOKUPS.inc(len(missing), model=self.label, result='miss')
+        if missing:
+            for pk, obj in self.model.objects.in_bulk(missing).items():
+                found[pk] = self._store(obj)
+        return found
+
+    def prime(self, objects):
+        """Add already loaded instances to the cache"""
+        for obj in objects:
+            self._store(obj)
+
+    def invalidate(self, instance):
+        cached = self.cache.pop(('pk', instance.pk))
+        for obj in (cached, instance):
+            if obj is not None and obj.vat_number:
+                self.cache.pop(('vat', obj.vat_number))
+
+    def clear(self):
+        self.cache.clear()
+
+
+companies = ModelCache(Company)
+customers = ModelCache(Customer)
@@ -0,0 +1,261 @@
+"""
+VAT reporting over the precomputed VATSummary table.
+
+Each invoice records in Invoice.vat_share what it currently adds to the
+summary: its company, issue date, type and status, and per VAT rate its line
+count, taxable amount and VAT (rounded per rate as on the invoice, see
+invoices.calculator). When an invoice is saved or deleted the signal
+receivers in invoices.signals call update_invoice() or remove_share(), which
+apply the difference to the affected VATSummary rows with F() updates. The
+work is proportional to the invoice's own lines, and concurrent saves to the
+same day never rewrite each other's rows. Reports then only ever read
+summary rows: a quarterly return for one company touches roughly
+days x rates x types x statuses rows, however many lines were invoiced.
+
+rebuild() recomputes the table from the lines for maintenance (the
+rebuild_vat_summaries command); it should not run alongside invoice edits.
+"""
+import csv
+import operator
+from datetime import date
+from decimal import Decimal
+from functools import reduce
+
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+
+from . import calculator
+from .models import Invoice, InvoiceItem, VATSummary
+
+
+# Invoices that have been reported to ZATCA and therefore belong in a return
+REPORTABLE_STATUSES = ('submitted', 'approved')
+
+# Amount columns of a VAT return row, after vat_rate
+RETURN_COLUMNS = ('sales_taxable', 'sales_vat', 'credit_taxable', 'credit_vat', 'net_taxable', 'net_vat')
+
+# Fields whose change can move an invoice's lines between buckets or rows
+SUMMARY_FIELDS = {
+    'company', 'company_id', 'issue_date', 'invoice_type', 'status', 'subtotal', 'vat_amount', 'total',
+}
+
+REBUILD_BATCH_SIZE = 2000
+
+
+def _money(value):
+    # SQLite returns aggregated decimals without their scale
+    return Decimal(value).quantize(Decimal('0.01'))
+
+
+def _rate_rows(invoice_ids):
+    """(invoice id, vat rate, line count, taxable amount) per invoice and rate"""
+    return (
+        InvoiceItem.objects.filter(invoice_id__in=invoice_ids)
+        .values_list('invoice_id', 'vat_rate').annotate(line_count=Count('pk'), taxable=Sum('total')).order_by()
+    )
+
+
+def _share(company_id, day, invoice_type, status, rates):
+    """A vat_share value; `rates` is [(vat rate, line count, taxable amount), ...]"""
+    share = {'key': [company_id, day.isoformat(), invoice_type, status], 'rates': {}}
+    for rate, line_count, taxable in rates:
+        rate, taxable = calculator.to_units(rate), calculator.to_units(taxable)
+        share['rates'][str(calculator.to_decimal(rate))] = [
+            line_count, taxable, calculator.round_div(taxable * rate, 10000)]
+    return share
+
+
+def _deltas(share, sign, deltas):
+    """Add sign x `share` to {summary row key: [invoices, lines, taxable, vat]}"""
+    if not share:
+        return
+    for rate, amounts in share['rates'].items():
+        delta = deltas.setdefault((*share['key'], rate), [0, 0, 0, 0])
+        for index, amount in enumerate([1, *amounts]):
+            delta[index] += sign * amount
+
+
+def _apply(deltas):
+    emptied = []
+    for (company_id, day, invoice_type, status, rate), (invoices, lines, taxable, vat) in deltas.items():
+        if not (invoices or lines or taxable or vat):
+            continue
+        row = VATSummary.objects.filter(
+            company_id=company_id, day=day, vat_rate=Decimal(rate), invoice_type=invoice_type, status=status)
+        changes = {
+            'invoice_count': F('invoice_count') + invoices,
+            'line_count': F('line_count') + lines,
+            'taxable_amount': F('taxable_amount') + calculator.to_decimal(taxable),
+            'vat_amount': F('vat_amount') + calculator.to_decimal(vat),
+        }
+        if invoices < 0:
+            emptied.append(Q(company_id=company_id, day=day, vat_rate=Decimal(rate),
+                             invoice_type=invoice_type, status=status))
+        if row.update(**changes) or invoices <= 0:
+            # A missing row has nothing to take away (e.g. its company is being deleted)
+            continue
+        # Two savers may both find the row missing; the second insert is ignored
+        # and both then add their share to the one row
+        VATSummary.objects.bulk_create([VATSummary(
+            company_id=company_id, day=day, vat_rate=Decimal(rate), invoice_type=invoice_type, status=status,
+        )], ignore_conflicts=True)
+        row.update(**changes)
+    # Only a row that lost an invoice can have dropped to zero
+    if emptied:
+        VATSummary.objects.filter(invoice_count=0).filter(reduce(operator.or_, emptied)).delete()
+
+
+def update_invoice(invoice):
+    """Recompute one invoice's share from its lines and apply the change to VATSummary"""
+    with transaction.atomic():
+        # The row lock orders concurrent updates of the same invoice
+        row = (Invoice.objects.select_for_update().filter(pk=invoice.pk)
+               .values_list('company_id', 'issue_date', 'invoice_type', 'status', 'vat_share').first())
+        if row is None:
+            return
+        *header, previous = row
+        share = _share(*header, [rates[1:] for rates in _rate_rows([invoice.pk])])
+        if share == previous:
+            return
+        deltas = {}
+        _deltas(previous, -1, deltas)
+        _deltas(share, 1, deltas)
+        _apply(deltas)
+        Invoice.objects.filter(pk=invoice.pk).update(vat_share=share)
+    # Deferred rather than assigned: the next read loads it from the row, so
+    # the instance cannot keep a share an enclosing transaction rolled back
+    invoice.__dict__.pop('vat_share', None)
+
+
+def remove_share(share):
+    """Take a deleted invoice's share out of VATSummary"""
+    deltas = {}
+    _deltas(share, -1, deltas)
+    with transaction.atomic():
+        _apply(deltas)
+
+
+def rebuild(company_id=None, start=None, end=None):
+    """
+    Recompute the summary rows and every invoice's vat_share from the lines,
+    optionally limited to a company and date range. Returns the number of
+    (company, day) buckets with invoices.
+    """
+    invoices = Invoice.objects.all()
+    summaries = VATSummary.objects.all()
+    if company_id is not None:
+        invoices = invoices.filter(company_id=company_id)
+        summaries = summaries.filter(company_id=company_id)
+    if start is not None:
+        invoices = invoices.filter(issue_date__gte=start)
+        summaries = summaries.filter(day__gte=start)
+    if end is not None:
+        invoices = invoices.filter(issue_date__lte=end)
+        summaries = summaries.filter(day__lte=end)
+
+    headers = invoices.order_by('pk').values_list('pk', 'company_id', 'issue_date', 'invoice_type', 'status')
+    deltas, buckets, batch = {}, set(), []
+    with transaction.atomic():
+        summaries.delete()
+        for header in headers.iterator(chunk_size=REBUILD_BATCH_SIZE):
+            batch.append(header)
+            if len(batch) == REBUILD_BATCH_SIZE:
+                _rebuild_batch(batch, deltas, buckets)
+                batch = []
+        _rebuild_batch(batch, deltas, buckets)
+        VATSummary.objects.bulk_create([
+            VATSummary(
+                company_id=company, day=day, vat_rate=Decimal(rate), invoice_type=invoice_type, status=status,
+                invoice_count=counts[0], line_count=counts[1],
+                taxable_amount=calculator.to_decimal(counts[2]), vat_amount=calculator.to_decimal(counts[3]))
+            for (company, day, invoice_type, status, rate), counts in deltas.items()
+        ], batch_size=1000)
+    return len(buckets)
+
+
+def _rebuild_batch(headers, deltas, buckets):
+    rates = {}
+    for invoice_id, *row in _rate_rows([header[0] for header in headers]):
+        rates.setdefault(invoice_id, []).append(row)
+    changed = []
+    for pk, *header in headers:
+        share = _share(*header, rates.get(pk, []))
+        _deltas(share, 1, deltas)
+        buckets.add((header[0], header[1]))
+        changed.append(Invoice(pk=pk, vat_share=share))
+    Invoice.objects.bulk_update(changed, ['vat_share'], batch_size=1000)
+
+
+def quarter_bounds(year, quarter):
+    """First and last day of a calendar quarter (1-4)"""
+    first_month = 3 * (quarter - 1) + 1
+    start = date(year, first_month, 1)
+    end = date(year + 1, 1, 1) if quarter == 4 else date(year, first_month + 3, 1)
+    return start, date.fromordinal(end.toordinal() - 1)
+
+
+def current_quarter(today=None):
+    today = today or date.today()
+    return quarter_bounds(today.year, (today.month - 1) // 3 + 1)
+
+
+def vat_return(company, start, end):
+    """
+    Output VAT per rate for reportable invoices issued between start and end
+    (inclusive): sales (standard, simplified and debit notes) less credit notes.
+    """
+    is_credit = Q(invoice_type='credit')
+    rows = (
+        VATSummary.objects
+        .filter(company=company, day__range=(start, end), status__in=REPORTABLE_STATUSES)
+        .values('vat_rate')
+        .annotate(
+            sales_taxable=Sum('taxable_amount', filter=~is_credit, default=0),
+            sales_vat=Sum('vat_amount', filter=~is_credit, default=0),
+            credit_taxable=Sum('taxable_amount', filter=is_credit, default=0),
+            credit_vat=Sum('vat_amount', filter=is_credit, default=0),
+        )
+        .order_by('-vat_rate')
+    )
+    result = []
+    for row in rows:
+        for column in ('sales_taxable', 'sales_vat', 'credit_taxable', 'credit_vat'):
+            row[column] = _money(row[column])
+        row['net_taxable'] = row['sales_taxable'] - row['credit_taxable']
+        row['net_vat'] = row['sales_vat'] - row['credit_vat']
+        result.append(row)
+    return result
+
+
+def breakdown(company, start, end):
+    """Invoice counts and amounts per invoice type and status, all statuses included"""
+    rows = (
+        VATSummary.objects
+        .filter(company=company, day__range=(start, end))
+        .values('invoice_type', 'status')
+        .annotate(
+            invoice_count=Sum('invoice_count'),
+            line_count=Sum('line_count'),
+            taxable_amount=Sum('taxable_amount'),
+            vat_amount=Sum('vat_amount'),
+        )
+        .order_by('invoice_type', 'status')
+    )
+    return [dict(row, taxable_amount=_money(row['taxable_amount']), vat_amount=_money(row['vat_amount'])) for row in rows]
+
+
+def write_csv(output, company, start, end):
+    """Write the VAT return and the type/status breakdown as CSV to a file-like object"""
+    writer = csv.writer(output)
+    writer.writerow(['company', company.name, 'vat_number', company.vat_number, 'from', start, 'to', end])
+    writer.writerow([])
+    writer.writerow(['vat_rate', *RETURN_COLUMNS])
+    for row in vat_return(company, start, end):
+        writer.writerow([row['vat_rate'], *(row[column] for column in RETURN_COLUMNS)])
+    writer.writerow([])
+    writer.writerow(['invoice_type', 'status', 'invoice_count', 'line_count', 'taxable_amount', 'vat_amount'])
+    for row in breakdown(company, start, end):
+        writer.writerow([
+            row['invoice_type'], row['status'], row['invoice_count'], row['line_count'],
+            row['taxable_amount'], row['vat_amount'],
+        ])
@@ -0,0 +1,223 @@
+"""
+Search index over invoices, customers, companies and invoice lines.
+
+Each indexed object has one SearchDocument row holding normalized text:
+lower-cased, Arabic harakat, tatweel and Latin accents removed, hamza/madda
+carriers, alef maksura and ta marbuta folded and Arabic-Indic digits mapped
+to ASCII, so queries match regardless of how the text was typed. Invoice documents also carry the
+customer's and company's name and VAT number, so an invoice can be found by
+its buyer or seller without a join.
+
+Documents are kept in sync by the signal receivers in invoices.signals and
+can be rebuilt with the rebuild_search_index command. When a company or
+customer is renamed, its invoices' documents are rewritten by a batch job
+(see invoices.batch), so they catch up once a worker has run it. Lookups use the FTS5
+index on SQLite (prefix matching on every term) and the trigram index on
+PostgreSQL.
+"""
+import re
+import unicodedata
+from collections import namedtuple
+
+from django.db import connection
+
+from .models import Company, Customer, Invoice, InvoiceItem, SearchDocument
+
+
+SearchHit = namedtuple('SearchHit', ['kind', 'object_id', 'invoice_id', 'label'])
+
+_FOLD = str.maketrans({
+    '\u0640': None,  # tatweel
+    '\u0649': '\u064a',  # alef maksura -> ya
+    '\u0629': '\u0647',  # ta marbuta -> ha
+    **{chr(0x0660 + digit): str(digit) for digit in range(10)},  # Arabic-Indic digits
+    **{chr(0x06f0 + digit): str(digit) for digit in range(10)},  # Extended Arabic-Indic digits
+})
+_TOKENS = re.compile(r'\w+')
+
+
+def normalize(text):
+    """Fold text into the form stored in the index (also applied to queries)"""
+    # NFKD splits hamza and madda off alef/waw/ya and accents off Latin
+    # letters; dropping combining marks then also removes the harakat.
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return ' '.join(_TOKENS.findall(text.translate(_FOLD).casefold()))
+
+
+def _join(*values):
+    return normalize(' '.join(value for value in values if value))
+
+
+def company_document(company):
+    return {
+        'label': f"{company.name} ({company.vat_number})",
+        'text': _join(company.name, company.vat_number, company.cr_number),
+    }
+
+
+def customer_document(customer):
+    label = f"{customer.name} ({customer.vat_number})" if customer.vat_number else customer.name
+    return {'label': label, 'text': _join(customer.name, customer.vat_number, customer.email)}
+
+
+def invoice_document(invoice, customer=None, company=None):
+    customer = customer or invoice.customer
+    company = company or invoice.company
+    return {
+        'invoice_id': invoice.pk,
+        'label': f"{invoice.invoice_number} - {customer.name}",
+        'text': _join(invoice.invoice_number, customer.name, customer.vat_number, company.name, company.vat_number),
+    }
+
+
+def item_document(item):
+    return {'invoice_id': item.invoice_id, 'label': item.description[:255], 'text': _join(item.description)}
+
+
+def _upsert(kind, object_id, document):
+    """Create or update a document; return True if its indexed text changed"""
+    current = SearchDocument.objects.filter(kind=kind, object_id=object_id).values('label', 'text').first()
+    if current is None:
+        SearchDocument.objects.create(kind=kind, object_id=object_id, **document)
+        return True
+    if current['label'] == document['label'] and current['text'] == document['text']:
+        return False
+    SearchDocument.objects.filter(kind=kind, object_id=object_id).update(**document)
+    return current['text'] != document['text']
+
+
+def index_company(company):
+    return _upsert('company', company.pk, company_document(company))
+
+
+def index_customer(customer):
+    return _upsert('customer', customer.pk, customer_document(customer))
+
+
+def index_invoice(invoice):
+    return _upsert('invoice', invoice.pk, invoice_document(invoice))
+
+
+def index_item(item):
+    return _upsert('item', item.pk, item_document(item))
+
+
+def index_items(items):
+    """Index many invoice lines at once (for bulk_create/bulk_update paths)"""
+    items = list(items)
+    SearchDocument.objects.filter(kind='item', object_id__in=[item.pk for item in items]).delete()
+    SearchDocument.objects.bulk_create(
+        [SearchDocument(kind='item', object_id=item.pk, **item_document(item)) for item in items],
+        batch_size=1000,
+    )
+
+
+def reindex_invoices(invoices, batch_size=1000):
+    """Rewrite the documents of every invoice in the queryset"""
+    invoices = invoices.select_related('customer', 'company').order_by('pk')
+    batch = []
+    for invoice in invoices.iterator(chunk_size=batch_size):
+        batch.append(invoice)
+        if len(batch) == batch_size:
+            _replace_invoice_documents(batch)
+            batch = []
+    if batch:
+        _replace_invoice_documents(batch)
+
+
+def _replace_invoice_documents(invoices):
+    SearchDocument.objects.filter(kind='invoice', object_id__in=[invoice.pk for invoice in invoices]).delete()
+    SearchDocument.objects.bulk_create(
+        [SearchDocument(kind='invoice', object_id=invoice.pk, **invoice_document(invoice)) for invoice in invoices])
+
+
+def remove(kind, object_id):
+    SearchDocument.objects.filter(kind=kind, object_id=object_id).delete()
+
+
+def remove_items(item_ids):
+    """Drop the documents of many invoice lines in one query"""
+    SearchDocument.objects.filter(kind='item', object_id__in=item_ids).delete()
+
+
+def remove_invoice(invoice_id):
+    """Drop the documents of an invoice and all of its lines"""
+    SearchDocument.objects.filter(invoice_id=invoice_id).delete()
+
+
+def rebuild(batch_size=2000, stdout=None):
+    """Drop and rebuild every search document"""
+    SearchDocument.objects.all().delete()
+    sources = [
+        ('company', Company.objects.order_by('pk'), company_document),
+        ('customer', Customer.objects.order_by('pk'), customer_document),
+        ('invoice', Invoice.objects.select_related('customer', 'company').order_by('pk'), invoice_document),
+        ('item', InvoiceItem.objects.order_by('pk'), item_document),
+    ]
+    for kind, queryset, build in sources:
+        count, batch = 0, []
+        for obj in queryset.iterator(chunk_size=batch_size):
+            batch.append(SearchDocument(kind=kind, object_id=obj.pk, **build(obj)))
+            if len(batch) == batch_size:
+                SearchDocument.objects.bulk_create(batch)
+                count += len(batch)
+                batch = []
+        SearchDocument.objects.bulk_create(batch)
+        count += len(batch)
+        if stdout is not None:
+            stdout.write(f"  indexed {count} {kind} documents")
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO invoices_searchdocument_fts (invoices_searchdocument_fts) VALUES ('optimize')")
+
+
+def search(query, kinds=None, limit=20):
+    """
+    Return up to `limit` SearchHits whose text contains every term of
+    `query` as a word prefix, best matches first.
+    """
+    terms = normalize(query).split()
+    if not terms:
+        return []
+    if connection.vendor == 'sqlite':
+        return _search_fts5(terms, kinds, limit)
+    documents = SearchDocument.objects.all()
+    for term in terms:
+        documents = documents.filter(text__contains=term)
+    if kinds:
+        documents = documents.filter(kind__in=kinds)
+    rows = documents.order_by('kind', 'label').values_list('kind', 'object_id', 'invoice_id', 'label')[:limit]
+    return [SearchHit(*row) for row in rows]
+
+
+def _search_fts5(terms, kinds, limit):
+    match = ' '.join('"{}"*'.format(term.replace('"', '""')) for term in terms)
+    sql = (
+        'SELECT d.kind, d.object_id, d.invoice_id, d.label '
+        'FROM invoices_searchdocument_fts f JOIN invoices_searchdocument d ON d.id = f.rowid '
+        'WHERE invoices_searchdocument_fts MATCH %s'
+    )
+    params = [match]
+    if kinds:
+        sql += ' AND d.kind IN ({})'.format(', '.join(['%s'] * len(kinds)))
+        params.extend(kinds)
+    sql += ' ORDER BY f.rank LIMIT %s'
+    params.append(limit)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [SearchHit(*row) for row in cursor.fetchall()]
+
+
+def matching_ids(kind, query, limit=1000):
+    """
+    Primary keys of `kind` objects matching query. For invoices this
+    includes invoices with a matching line item.
+    """
+    kinds = ['invoice', 'item'] if kind == 'invoice' else [kind]
+    ids = []
+    for hit in search(query, kinds=kinds, limit=limit):
+        object_id = hit.invoice_id if hit.kind == 'item' else hit.object_id
+        if object_id not in ids:
+            ids.append(object_id)
+    return ids
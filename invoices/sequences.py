@@ -0,0 +1,144 @@
+"""
+Invoice number allocation.
+
+Each (company, series) pair has an InvoiceSequence. Numbers are taken with a
+single `UPDATE ... SET next_number = next_number + n` inside a transaction,
+so the counter row is the only thing concurrent writers contend on and no two
+callers ever receive the same number. Numbers already used by hand-typed
+invoices are skipped, so an allocated number never conflicts on the unique
+index.
+
+Batch importers should reserve() a block up front instead of calling
+next_number() per invoice: one counter update covers the whole block, and
+numbers left over when the block is closed are recorded as SequenceGap rows.
+Sequences with fill_gaps set hand those out again before new numbers.
+"""
+from collections import deque
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Invoice, InvoiceSequence, SequenceGap
+
+
+def get_sequence(company, series=None):
+    """Return the sequence for company and series, creating it with the configured format"""
+    sequence, _ = InvoiceSequence.objects.get_or_create(
+        company=company, series=series or settings.INVOICE_NUMBER_SERIES,
+        defaults={'format': settings.INVOICE_NUMBER_FORMAT},
+    )
+    return sequence
+
+
+def _take(sequence, count):
+    """Take `count` raw numbers, released gaps first; call inside a transaction"""
+    numbers = []
+    if sequence.fill_gaps:
+        gaps = (SequenceGap.objects.select_for_update(skip_locked=True)
+                .filter(sequence=sequence).order_by('start'))
+        for gap in gaps:
+            take = min(count - len(numbers), gap.end - gap.start + 1)
+            numbers.extend(range(gap.start, gap.start + take))
+            if gap.start + take > gap.end:
+                gap.delete()
+            else:
+                gap.start += take
+                gap.save(update_fields=['start'])
+            if len(numbers) == count:
+                return numbers
+
+    remaining = count - len(numbers)
+    InvoiceSequence.objects.filter(pk=sequence.pk).update(next_number=F('next_number') + remaining)
+    end = InvoiceSequence.objects.values_list('next_number', flat=True).get(pk=sequence.pk)
+    numbers.extend(range(end - remaining, end))
+    return numbers
+
+
+def _allocate(sequence, count, year):
+    """Return `count` (number, invoice_number) pairs not used by any invoice yet"""
+    allocated = []
+    with transaction.atomic():
+        while len(allocated) < count:
+            batch = [(number, sequence.format_number(number, year)) for number in _take(sequence, count - len(allocated))]
+            used = set(Invoice.objects.filter(
+                invoice_number__in=[formatted for _, formatted in batch]).values_list('invoice_number', flat=True))
+            allocated.extend(pair for pair in batch if pair[1] not in used)
+    return allocated
+
+
+def next_number(company, series=None, year=None):
+    """Allocate a single invoice number"""
+    sequence = get_sequence(company, series)
+    return _allocate(sequence, 1, year or timezone.localdate().year)[0][1]
+
+
+def release(sequence, numbers):
+    """Record unused raw numbers as gaps, merging consecutive runs"""
+    runs = []
+    for number in sorted(numbers):
+        if runs and runs[-1][1] == number - 1:
+            runs[-1][1] = number
+        else:
+            runs.append([number, number])
+    SequenceGap.objects.bulk_create(SequenceGap(sequence=sequence, start=start, end=end) for start, end in runs)
+
+
+class NumberBlock:
+    """
+    A block of invoice numbers reserved for one importer. next() hands them out
+    without touching the database until the block runs dry, when another block
+    of the same size is reserved. Use as a context manager so that unused
+    numbers are released on exit.
+    """
+
+    def __init__(self, sequence, size, year):
+        self.sequence = sequence
+        self.size = size
+        self.year = year
+        self.reserved = deque()
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.next()
+
+    def __len__(self):
+        return len(self.reserved)
+
+    def reserve(self):
+        self.reserved.extend(_allocate(self.sequence, self.size, self.year))
+
+    def next(self):
+        if self.closed:
+            raise ValueError("NumberBlock is closed")
+        if not self.reserved:
+            self.reserve()
+        return self.reserved.popleft()[1]
+
+    def close(self):
+        """Give the numbers that were not handed out back to the sequence"""
+        if not self.closed and self.reserved:
+            release(self.sequence, [number for number, _ in self.reserved])
+            self.reserved.clear()
+        self.closed = True
+
+
+def reserve(company, count, series=None, year=None):
+    """
+    Reserve `count` numbers for a batch import and return a NumberBlock. Call
+    outside long-running transactions so the counter row is locked only for
+    the reservation itself.
+    """
+    block = NumberBlock(get_sequence(company, series), count, year or timezone.localdate().year)
+    block.reserve()
+    return block
@@ -0,0 +1,129 @@
+"""
+ZATCA payload serialization.
+
+A payload is encoded to JSON bytes exactly once: the same bytes are sent as
+the HTTP request body, stored in ZATCALog.request_data (PayloadJSONField
+writes a RawJSON's text as is on SQLite and MySQL) and hashed for
+ZATCALog.request_sha256, so the log shows what was actually sent. orjson is
+used when installed; otherwise the standard library json module produces the
+same compact UTF-8 output.
+"""
+import hashlib
+import json
+from collections import namedtuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from . import calculator
+from .models import Invoice, RawJSON
+
+
+EncodedPayload = namedtuple('EncodedPayload', ['data', 'body', 'size', 'sha256'])
+EncodedPayload.__doc__ = "A payload (as RawJSON), its encoded body in bytes, the body's length and SHA-256 hex digest"
+
+
+def dumps(data):
+    """Compact UTF-8 JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def loads(body):
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+def encode(data):
+    """Encode data once and return an EncodedPayload"""
+    body = dumps(data)
+    return EncodedPayload(RawJSON(data, body.decode('utf-8')), body, len(body), hashlib.sha256(body).hexdigest())
+
+
+def decode(body):
+    """Parse a response body; objects come back as RawJSON so they are stored without re-encoding"""
+    if not body:
+        return {}
+    data = loads(body)
+    if isinstance(data, dict):
+        return RawJSON(data, body.decode('utf-8') if isinstance(body, bytes) else body)
+    return data
+
+
+def payload_queryset(queryset=None):
+    """Invoices with everything invoice_payload() reads loaded in one query plus one for the lines"""
+    if queryset is None:
+        queryset = Invoice.objects.all()
+    return queryset.select_related('company', 'customer').prefetch_related('items')
+
+
+def invoice_payload(invoice):
+    """
+    Invoice data in ZATCA format
+    This is a sample structure - adjust based on actual ZATCA API requirements
+    Seller and buyer come from the invoice's frozen snapshot once it has left draft
+    """
+    seller, buyer = invoice.seller, invoice.buyer
+    # Line and total amounts are recomputed exactly in halalas; the inputs
+    # all have two decimals, so float() of them is exact in JSON
+    items = list(invoice.items.all())
+    nets, vats, totals = calculator.calculate(items, invoice.discount)
+    amount = calculator.to_float
+    return {
+        "invoiceNumber": invoice.invoice_number,
+        "invoiceType": invoice.invoice_type,
+        "issueDate": invoice.issue_date.isoformat(),
+        "issueTime": invoice.issue_time.isoformat(),
+        "seller": {
+            "name": seller['name'],
+            "vatNumber": seller['vat_number'],
+            "crNumber": seller['cr_number'],
+            "address": {
+                "street": seller['street_name'],
+                "buildingNumber": seller['building_number'],
+                "district": seller['district'],
+                "city": seller['city'],
+                "postalCode": seller['postal_code'],
+                "country": seller['country']
+            }
+        },
+        "buyer": {
+            "name": buyer['name'],
+            "vatNumber": buyer['vat_number'] or "",
+            "address": {
+                "street": buyer['street_name'] or "",
+                "buildingNumber": buyer['building_number'] or "",
+                "district": buyer['district'] or "",
+                "city": buyer['city'],
+                "postalCode": buyer['postal_code'] or "",
+                "country": buyer['country']
+            }
+        },
+        "invoiceLines": [
+            {
+                "description": item.description,
+                "quantity": float(item.quantity),
+                "unitPrice": float(item.unit_price),
+                "vatRate": float(item.vat_rate),
+                "vatAmount": amount(vat),
+                "discount": float(item.discount),
+                "lineTotal": amount(net)
+            }
+            for item, net, vat in zip(items, nets, vats)
+        ],
+        "totals": {
+            "subtotal": amount(totals.subtotal),
+            "vatAmount": amount(totals.vat),
+            "discount": amount(totals.discount),
+            "total": amount(totals.total)
+        }
+    }
+
+
+def serialize_invoice(invoice):
+    """EncodedPayload of an invoice's ZATCA payload"""
+    return encode(invoice_payload(invoice))
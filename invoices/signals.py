@@ -0,0 +1,146 @@
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import batch, changes, refcache, reporting, search
+from .models import Company, Customer, Invoice, InvoiceItem, ZATCALog
+
+
+def apply_sqlite_pragmas(cursor, pragmas):
+    for name, value in pragmas.items():
+        cursor.execute(f'PRAGMA {name} = {value}')
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    """Apply SQLITE_PRAGMAS (WAL, busy_timeout, ...) to every new SQLite connection"""
+    pragmas = getattr(settings, 'SQLITE_PRAGMAS', None)
+    if connection.vendor != 'sqlite' or not pragmas:
+        return
+    with connection.cursor() as cursor:
+        apply_sqlite_pragmas(cursor, pragmas)
+
+
+# Search index maintenance (see invoices.search)
+
+INVOICE_SEARCH_FIELDS = {'invoice_number', 'customer', 'customer_id', 'company', 'company_id'}
+
+
+# Invoice documents carry the party names; rewriting them all is left to a batch worker
+
+@receiver(post_save, sender=Company)
+def index_company(sender, instance, **kwargs):
+    if search.index_company(instance) and not kwargs['created']:
+        batch.enqueue_reindex(company=instance)
+
+
+@receiver(post_save, sender=Customer)
+def index_customer(sender, instance, **kwargs):
+    if search.index_customer(instance) and not kwargs['created']:
+        batch.enqueue_reindex(customer=instance)
+
+
+@receiver(post_save, sender=Invoice)
+def index_invoice(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or INVOICE_SEARCH_FIELDS & set(update_fields):
+        search.index_invoice(instance)
+
+
+@receiver(post_save, sender=InvoiceItem)
+def index_invoice_item(sender, instance, **kwargs):
+    search.index_item(instance)
+
+
+@receiver(post_delete, sender=InvoiceItem)
+def unindex_invoice_item(sender, instance, origin=None, **kwargs):
+    # When the whole invoice (or a queryset of invoices) goes, unindex_invoice
+    # drops its line documents in one query; whoever deletes a queryset of
+    # lines drops theirs with search.remove_items()
+    if not (isinstance(origin, Invoice) or getattr(origin, 'model', None) in (Invoice, InvoiceItem)):
+        search.remove('item', instance.pk)
+
+
+@receiver(post_delete, sender=Company)
+def unindex_company(sender, instance, **kwargs):
+    search.remove('company', instance.pk)
+
+
+@receiver(post_delete, sender=Customer)
+def unindex_customer(sender, instance, **kwargs):
+    search.remove('customer', instance.pk)
+
+
+@receiver(post_delete, sender=Invoice)
+def unindex_invoice(sender, instance, **kwargs):
+    search.remove_invoice(instance.pk)
+
+
+# VAT summary maintenance (see invoices.reporting)
+
+def _affects_summary(update_fields):
+    return update_fields is None or bool(reporting.SUMMARY_FIELDS & set(update_fields))
+
+
+@receiver(pre_save, sender=Invoice)
+def remember_previous_status(sender, instance, update_fields=None, **kwargs):
+    # Read for the change feed, which records status transitions
+    instance._previous_status = None
+    if instance.pk and (update_fields is None or 'status' in update_fields):
+        instance._previous_status = Invoice.objects.filter(pk=instance.pk).values_list('status', flat=True).first()
+
+
+@receiver(post_save, sender=Invoice)
+def refresh_vat_summary(sender, instance, update_fields=None, **kwargs):
+    if _affects_summary(update_fields):
+        reporting.update_invoice(instance)
+
+
+@receiver(pre_delete, sender=Invoice)
+def load_vat_share(sender, instance, **kwargs):
+    # Needed after the row is gone; lists load invoices without it
+    if 'vat_share' in instance.get_deferred_fields():
+        instance.refresh_from_db(fields=['vat_share'])
+
+
+@receiver(post_delete, sender=Invoice)
+def refresh_vat_summary_after_delete(sender, instance, **kwargs):
+    reporting.remove_share(instance.vat_share)
+
+
+# Change feed (see invoices.changes)
+
+@receiver(post_save, sender=Invoice)
+def record_status_change(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_previous_status', None)
+    if created or (previous is not None and previous != instance.status):
+        changes.record('status', instance, previous_status=previous)
+
+
+@receiver(post_delete, sender=Invoice)
+def record_invoice_deleted(sender, instance, **kwargs):
+    changes.record('deleted', instance)
+
+
+@receiver(post_save, sender=ZATCALog)
+def record_zatca_outcome(sender, instance, created, **kwargs):
+    # Logs are created before the call and saved again with its outcome
+    if created or (instance.status_code is None and not instance.error_message):
+        return
+    changes.record(
+        'zatca', instance.invoice, log_id=instance.pk, action=instance.action, success=instance.success,
+        status_code=instance.status_code, error=instance.error_message or '')
+
+
+# Reference data cache invalidation (see invoices.refcache)
+
+@receiver(post_save, sender=Company)
+@receiver(post_delete, sender=Company)
+def invalidate_cached_company(sender, instance, **kwargs):
+    refcache.companies.invalidate(instance)
+
+
+@receiver(post_save, sender=Customer)
+@receiver(post_delete, sender=Customer)
+def invalidate_cached_customer(sender, instance, **kwargs):
+    refcache.customers.invalidate(instance)
@@ -0,0 +1,115 @@
+"""
+Fingerprinted, pre-compressed static files.
+
+CompressedManifestStaticFilesStorage is ManifestStaticFilesStorage (file
+names carry a hash of their content, so a changed file gets a new URL) that
+also writes .gz and, when the brotli package is installed, .br copies of
+every hashed text asset during collectstatic. Compression therefore happens
+once per deploy at the highest level instead of on every request.
+
+StaticFilesMiddleware serves STATIC_ROOT from the application process for
+deployments without a front-end web server: it picks the smallest encoding
+the client accepts and marks hashed files as cacheable forever. The file
+list is read once at startup, so restart after collectstatic.
+"""
+import gzip
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import FileResponse
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+COMPRESSIBLE = {'.css', '.js', '.mjs', '.json', '.map', '.svg', '.txt', '.html', '.xml', '.ico'}
+
+# Below this a compressed copy saves less than the extra header costs
+MIN_COMPRESS_SIZE = 256
+
+IMMUTABLE = f'public, max-age={365 * 24 * 3600}, immutable'
+
+# Smallest first; (Content-Encoding, file suffix, Accept-Encoding pattern)
+ENCODINGS = [
+    ('br', '.br', re.compile(r'\bbr\b')),
+    ('gzip', '.gz', re.compile(r'\bgzip\b')),
+]
+
+
+def compress_file(path):
+    """Write .gz (and .br) copies of `path` where they are smaller; returns the suffixes written"""
+    with open(path, 'rb') as f:
+        content = f.read()
+    variants = {'.gz': gzip.compress(content, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['.br'] = brotli.compress(content, quality=11)
+    written = []
+    for suffix, compressed in variants.items():
+        if len(compressed) < len(content):
+            with open(path + suffix, 'wb') as f:
+                f.write(compressed)
+            written.append(suffix)
+    return written
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+
+    def post_process(self, *args, **kwargs):
+        yield from super().post_process(*args, **kwargs)
+        if kwargs.get('dry_run'):
+            return
+        for name in set(self.hashed_files.values()):
+            path = self.path(name)
+            if os.path.splitext(name)[1] in COMPRESSIBLE and os.path.getsize(path) >= MIN_COMPRESS_SIZE:
+                compress_file(path)
+
+
+class StaticFilesMiddleware:
+    """Serve collected static files, pre-compressed where possible, with long-lived cache headers"""
+
+    def __init__(self, get_response):
+        if not settings.STATIC_ROOT or not os.path.isdir(settings.STATIC_ROOT):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.prefix = '/' + settings.STATIC_URL.lstrip('/')
+        hashed = set(getattr(staticfiles_storage, 'hashed_files', {}).values())
+        self.files = {}
+        for directory, _, names in os.walk(settings.STATIC_ROOT):
+            for filename in names:
+                path = os.path.join(directory, filename)
+                name = os.path.relpath(path, settings.STATIC_ROOT).replace(os.sep, '/')
+                if name.endswith(('.gz', '.br')) and os.path.exists(path[:-3]):
+                    continue
+                self.files[self.prefix + name] = (
+                    path,
+                    mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+                    [(encoding, pattern, path + suffix) for encoding, suffix, pattern in ENCODINGS
+                     if os.path.exists(path + suffix)],
+                    name in hashed,
+                )
+
+    def __call__(self, request):
+        found = self.files.get(request.path_info) if request.method in ('GET', 'HEAD') else None
+        if found is None:
+            return self.get_response(request)
+        path, content_type, variants, immutable = found
+        accepted = request.headers.get('Accept-Encoding', '')
+        encoding = None
+        for candidate, pattern, variant in variants:
+            if pattern.search(accepted):
+                encoding, path = candidate, variant
+                break
+        response = FileResponse(open(path, 'rb'), content_type=content_type)
+        if encoding:
+            response['Content-Encoding'] = encoding
+        if variants:
+            patch_vary_headers(response, ('Accept-Encoding',))
+        response['Cache-Control'] = IMMUTABLE if immutable else 'public, max-age=60'
+        return response
@@ -0,0 +1,62 @@
+"""
+Streaming output for invoices with very many lines.
+
+Lines are read in chunks of INVOICE_STREAM_CHUNK_SIZE with values_list()
+and .iterator(), so no InvoiceItem instances are built and at most one chunk
+is held in memory however long the invoice is. Totals come from the stored
+invoice aggregates rather than being summed from the lines.
+"""
+import csv
+
+from django.conf import settings
+from django.template.loader import render_to_string
+
+LINE_FIELDS = ['description', 'quantity', 'unit_price', 'discount', 'total', 'vat_rate', 'vat_amount']
+
+# Where invoice_print.html's line rows go
+LINES_MARKER = '<!-- invoice-lines -->'
+
+
+def iter_line_chunks(invoice, chunk_size=None):
+    """Yield lists of line dicts (LINE_FIELDS plus a 1-based `number`) in line order"""
+    chunk_size = chunk_size or settings.INVOICE_STREAM_CHUNK_SIZE
+    rows = invoice.items.order_by('pk').values_list(*LINE_FIELDS).iterator(chunk_size=chunk_size)
+    chunk = []
+    for number, row in enumerate(rows, 1):
+        line = dict(zip(LINE_FIELDS, row))
+        line['number'] = number
+        chunk.append(line)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def stream_print(invoice, request=None):
+    """Yield the printable invoice page, rendering the line rows a chunk at a time"""
+    page = render_to_string('invoices/invoice_print.html', {'invoice': invoice}, request)
+    head, tail = page.split(LINES_MARKER, 1)
+    yield head
+    for chunk in iter_line_chunks(invoice):
+        yield render_to_string('invoices/invoice_print_lines.html', {'lines': chunk})
+    yield tail
+
+
+class Echo:
+    """File-like object whose write() returns the value, for csv.writer in a generator"""
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(invoice):
+    """Yield the invoice's lines and stored totals as CSV rows"""
+    writer = csv.writer(Echo())
+    yield writer.writerow(['invoice_number', invoice.invoice_number, 'issue_date', invoice.issue_date])
+    yield writer.writerow(['line', *LINE_FIELDS])
+    for chunk in iter_line_chunks(invoice):
+        yield ''.join(writer.writerow([line['number'], *(line[field] for field in LINE_FIELDS)]) for line in chunk)
+    yield writer.writerow([])
+    for field in ('subtotal', 'vat_amount', 'discount', 'total'):
+        yield writer.writerow([field, getattr(invoice, field)])
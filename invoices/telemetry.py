@@ -0,0 +1,107 @@
+"""
+Timing instrumentation for outgoing ZATCA API calls.
+
+Each call is wrapped in an ApiCall, which collects the DNS, TCP connect, TLS
+handshake, time-to-first-byte and total durations, payload sizes and retry
+count. Connection phases are measured by the pooled connection classes
+installed through invoices.transport.TimedHTTPAdapter; reused keep-alive
+connections report zero for those phases.
+
+This module does not import the HTTP stack, so the metrics it registers are
+exported by processes that never load the ZATCA client.
+"""
+import math
+import threading
+import time
+
+from .metrics import REGISTRY
+
+
+BYTE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+PHASES = ('dns', 'connect', 'tls', 'ttfb', 'total')
+
+API_CALLS = REGISTRY.counter(
+    'zatca_api_calls_total', 'ZATCA API calls by action, outcome and HTTP status')
+API_PHASE_SECONDS = REGISTRY.histogram(
+    'zatca_api_phase_seconds', 'ZATCA API call duration by action and phase (dns, connect, tls, ttfb, total)')
+API_REQUEST_BYTES = REGISTRY.histogram(
+    'zatca_api_request_bytes', 'ZATCA API request body size by action', buckets=BYTE_BUCKETS)
+API_RESPONSE_BYTES = REGISTRY.histogram(
+    'zatca_api_response_bytes', 'ZATCA API response body size by action', buckets=BYTE_BUCKETS)
+API_RETRIES = REGISTRY.counter(
+    'zatca_api_retries_total', 'Retries performed by the ZATCA HTTP client by action')
+
+_local = threading.local()
+
+
+def current_call():
+    return getattr(_local, 'call', None)
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted sequence"""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(q / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class ApiCall:
+    """Timings and sizes collected for one logical ZATCA API call"""
+
+    def __init__(self, action):
+        self.action = action
+        self.dns = 0.0
+        self.connect = 0.0
+        self.tls = 0.0
+        self.ttfb = 0.0
+        self.total = 0.0
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.retries = 0
+        self.status_code = None
+
+    def run(self, send, *args, **kwargs):
+        """Call send(*args, **kwargs) while recording timings, then publish metrics"""
+        _local.call = self
+        start = time.perf_counter()
+        response = None
+        try:
+            response = send(*args, **kwargs)
+            return response
+        finally:
+            self.total = time.perf_counter() - start
+            _local.call = None
+            if response is not None:
+                self._read_response(response)
+            self._publish()
+
+    def _read_response(self, response):
+        self.status_code = response.status_code
+        body = response.request.body or b''
+        self.request_bytes = len(body.encode('utf-8') if isinstance(body, str) else body)
+        self.response_bytes = len(response.content)
+        retries = getattr(response.raw, 'retries', None)
+        self.retries = len(retries.history) if retries is not None else 0
+        setup = self.dns + self.connect + self.tls
+        self.ttfb = max(response.elapsed.total_seconds() - setup, 0.0)
+
+    def _publish(self):
+        if self.status_code is None:
+            outcome, status = 'error', 'none'
+        else:
+            outcome = 'success' if self.status_code == 200 else 'error'
+            status = self.status_code
+        API_CALLS.inc(action=self.action, outcome=outcome, status=status)
+        for phase in PHASES:
+            API_PHASE_SECONDS.observe(getattr(self, phase), action=self.action, phase=phase)
+        API_REQUEST_BYTES.observe(self.request_bytes, action=self.action)
+        API_RESPONSE_BYTES.observe(self.response_bytes, action=self.action)
+        if self.retries:
+            API_RETRIES.inc(self.retries, action=self.action)
+
+    def as_dict(self):
+        """Compact form stored in ZATCALog.timings (durations in milliseconds)"""
+        data = {phase: round(getattr(self, phase) * 1000, 1) for phase in PHASES}
+        data.update(req=self.request_bytes, resp=self.response_bytes, retries=self.retries)
+        return data
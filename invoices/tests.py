@@ -1,3 +1,913 @@
-from django.test import TestCase
+import csv
+import gzip
+import json
+import os
+import tempfile
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.backends.sqlite3.base import DatabaseWrapper as SQLiteDatabaseWrapper
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from zatca_project.database import SQLITE_TUNED_PRAGMAS
+
+from . import batch, calculator, importtime, refcache, reporting, search, sequences, serializers, validation, workers
+from .benchmarks import compare, run_suite, seed
+from .metrics import REGISTRY
+from .middleware import CompressionMiddleware, QueryBudgetExceeded, QueryMetricsMiddleware, QueryRecorder
+from .mock_zatca import LatencyModel, MockZATCAServer, invoice_uuid
+from .models import (
+    BatchJob, ChangeEvent, Company, Customer, Invoice, InvoiceItem, SearchDocument, SequenceGap, VATSummary, ZATCALog,
+)
+from .staticfiles import StaticFilesMiddleware
+from .telemetry import API_CALLS
+from .zatca_service import ZATCAService
+
+
+def make_company(**kwargs):
+    fields = {
+        'name': 'Seller Co', 'vat_number': '300000000000003', 'cr_number': '1010010000',
+        'address': 'Riyadh', 'city': 'Riyadh', 'postal_code': '12345', 'building_number': '1234',
+        'street_name': 'King Fahd Road', 'district': 'Olaya',
+    }
+    fields.update(kwargs)
+    return Company.objects.create(**fields)
+
+
+def make_customer(**kwargs):
+    fields = {
+        'name': 'Buyer Co', 'vat_number': '311111111100003', 'address': 'Jeddah', 'city': 'Jeddah',
+        'postal_code': '23456', 'building_number': '5678', 'street_name': 'Tahlia Street', 'district': 'Rawdah',
+    }
+    fields.update(kwargs)
+    return Customer.objects.create(**fields)
+
+
+def make_invoice(company, customer, number='INV-0001', lines=1, **kwargs):
+    invoice = Invoice.objects.create(
+        invoice_number=number, company=company, customer=customer,
+        issue_date=date(2026, 1, 15), issue_time=time(10, 30), **kwargs)
+    for index in range(lines):
+        InvoiceItem.objects.create(
+            invoice=invoice, description=f'Item {index + 1}', quantity=Decimal('2'),
+            unit_price=Decimal('50.00'), vat_rate=Decimal('15.00'))
+    invoice.calculate_totals()
+    return invoice
+
+
+class QueryMetricsMiddlewareTests(TestCase):
+
+    def setUp(self):
+        REGISTRY.reset()
+        company = make_company()
+        for index in range(6):
+            customer = make_customer(name=f'Buyer {index}', vat_number=None)
+            make_invoice(company, customer, number=f'INV-{index:04d}')
+
+    def test_server_timing_header_and_metrics_endpoint(self):
+        response = self.client.get(reverse('invoice_list'))
+        self.assertIn('db;dur=', response['Server-Timing'])
+
+        body = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('zatca_http_requests_total{method="GET",status="200",view="invoice_list"} 1', body)
+        self.assertIn('zatca_http_db_queries_count{view="invoice_list"} 1', body)
+
+    @override_settings(QUERY_METRICS_ASSERT=True, QUERY_METRICS_DUPLICATE_THRESHOLD=3)
+    def test_invoice_list_has_no_n_plus_one(self):
+        self.assertEqual(self.client.get(reverse('invoice_list')).status_code, 200)
+        self.assertEqual(self.client.get(reverse('home')).status_code, 200)
+
+    @override_settings(QUERY_METRICS_ASSERT=True, QUERY_METRICS_MAX_QUERIES=0)
+    def test_assert_mode_raises_over_budget(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            self.client.get(reverse('invoice_list'))
+
+    def test_streamed_queries_are_recorded_when_the_stream_ends(self):
+        def numbers():
+            for invoice in Invoice.objects.all():
+                yield invoice.invoice_number
+
+        middleware = QueryMetricsMiddleware(lambda request: StreamingHttpResponse(numbers()))
+        response = middleware(RequestFactory().get('/'))
+        self.assertIn('desc="0 queries"', response['Server-Timing'])
+        self.assertNotIn('view="unresolved"', REGISTRY.render())
+
+        self.assertEqual(len(b''.join(response.streaming_content)), 6 * 8)
+        response.close()
+        self.assertIn('zatca_http_db_queries_sum{view="unresolved"} 1\n', REGISTRY.render())
+        self.assertIn('zatca_http_requests_total{method="GET",status="200",view="unresolved"} 1\n', REGISTRY.render())
+
+    def test_recorder_groups_queries_by_fingerprint(self):
+        recorder = QueryRecorder()
+        with recorder.record():
+            for invoice in Invoice.objects.all():
+                invoice.customer.name
+        self.assertEqual(recorder.count, 7)
+        self.assertEqual(list(recorder.duplicates(threshold=6).values()), [6])
+        self.assertGreaterEqual(recorder.duration, 0)
+
+
+class ZATCATelemetryTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = MockZATCAServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        super().tearDownClass()
+
+    def test_submission_records_timings_and_metrics(self):
+        REGISTRY.reset()
+        invoice = make_invoice(make_company(), make_customer())
+        # Resolve by name so the DNS phase is exercised too
+        api_url = f'http://localhost:{self.server.httpd.server_address[1]}'
+        with self.settings(ZATCA_API_URL=api_url):
+            success, message, data = ZATCAService().submit_invoice(invoice)
+
+        self.assertTrue(success, message)
+        log = invoice.zatca_logs.get()
+        self.assertEqual(set(log.timings), {'dns', 'connect', 'tls', 'ttfb', 'total', 'req', 'resp', 'retries'})
+        self.assertGreater(log.timings['req'], 0)
+        self.assertEqual(log.timings['retries'], 0)
+        self.assertEqual(API_CALLS.value(action='submit_invoice', outcome='success', status=200), 1)
+
+        out = StringIO()
+        call_command('zatca_latency_report', stdout=out)
+        self.assertIn('submit_invoice', out.getvalue())
+
+    @override_settings(ZATCA_MAX_RETRIES=2, ZATCA_RETRY_BACKOFF=0)
+    def test_throttled_submission_is_not_resent(self):
+        invoice = make_invoice(make_company(), make_customer())
+        with MockZATCAServer(throttle_rate=1.0, retry_after=0) as server:
+            success, message, data = ZATCAService(api_url=server.url).submit_invoice(invoice)
+            stats = server.stats()
+
+        self.assertFalse(success)
+        self.assertEqual(message, 'ZATCA API Error: 429')
+        self.assertEqual(stats['by_status'], {'submit 429': 1})
+        self.assertEqual(invoice.zatca_logs.get().timings['retries'], 0)
+
+    @override_settings(ZATCA_MAX_RETRIES=2, ZATCA_RETRY_BACKOFF=0, ZATCA_RETRY_MAX_WAIT=0.01)
+    def test_throttled_status_check_is_retried_without_long_waits(self):
+        invoice = make_invoice(make_company(), make_customer(), uuid='abc')
+        # Honouring Retry-After: 60 would keep the test waiting for two minutes
+        with MockZATCAServer(throttle_rate=1.0, retry_after=60) as server:
+            success, message, data = ZATCAService(api_url=server.url).check_invoice_status(invoice)
+            stats = server.stats()
+
+        self.assertEqual(message, 'Error: 429')
+        self.assertEqual(stats['by_status'], {'status 429': 3})
+
+
+class MockZATCATests(TestCase):
+
+    def test_latency_specs(self):
+        self.assertEqual(str(LatencyModel.parse('lognormal:60,0.8')), 'lognormal:60,0.8')
+        self.assertEqual(LatencyModel.parse('fixed:50').sample(None), 0.05)
+        with self.assertRaises(ValueError):
+            LatencyModel.parse('uniform:10')
+
+    def test_responses_are_deterministic(self):
+        invoice = make_invoice(make_company(), make_customer())
+        with MockZATCAServer() as server:
+            service = ZATCAService(api_url=server.url)
+            first = service.submit_invoice(invoice)[2]
+            second = service.submit_invoice(invoice)[2]
+        self.assertEqual(first, second)
+        self.assertEqual(first['uuid'], invoice_uuid('INV-0001'))
+
+
+class BenchmarkSuiteTests(TestCase):
+
+    def test_suite_covers_hot_paths_and_is_json_serializable(self):
+        seed(lines=40, lines_per_invoice=4, companies=2, customers=5)
+        self.assertEqual(InvoiceItem.objects.count(), 40)
+
+        report = run_suite(rounds=1, warmup=0)
+        names = [bench['name'] for bench in report['benchmarks']]
+        self.assertEqual(names, [
+            'calculate_totals', 'calculate_lines_bulk', 'prepare_invoice_data', 'serialize_invoice', 'generate_qr_code',
+            'invoice_list_view', 'dashboard_view', 'invoice_detail_view', 'invoice_print_view', 'submit_invoice',
+        ])
+        first = Invoice.objects.order_by('pk').first()
+        self.assertEqual(first.uuid, invoice_uuid(first.invoice_number))
+
+        round_tripped = json.loads(json.dumps(report))
+        rows = compare(round_tripped, report)
+        self.assertEqual([row[3] for row in rows], [0.0] * len(names))
+
+
+class SQLiteConfigurationTests(TestCase):
+
+    @override_settings(SQLITE_PRAGMAS=SQLITE_TUNED_PRAGMAS)
+    def test_new_connections_get_the_tuned_pragmas(self):
+        with tempfile.TemporaryDirectory() as directory:
+            wrapper = SQLiteDatabaseWrapper({**connection.settings_dict, 'NAME': os.path.join(directory, 'db.sqlite3')})
+            try:
+                with wrapper.cursor() as cursor:
+                    values = [cursor.execute(f'PRAGMA {name}').fetchone()[0]
+                              for name in ('journal_mode', 'synchronous', 'busy_timeout')]
+            finally:
+                wrapper.close()
+        # synchronous=NORMAL reads back as 1
+        self.assertEqual(values, ['wal', 1, 20000])
+
+    def test_write_benchmark_runs(self):
+        out = StringIO()
+        call_command('benchmark_db_writes', web_writers=1, zatca_writers=1, readers=1, writes=5, stdout=out)
+        rows = [line.split() for line in out.getvalue().splitlines()[3:]]
+        self.assertEqual([row[0] for row in rows], ['default', 'tuned'])
+        self.assertEqual([int(row[1]) + int(row[2]) for row in rows], [10, 10])
+
+
+class SearchTests(TestCase):
+
+    def setUp(self):
+        self.company = make_company()
+        self.customer = make_customer(name='مؤسسة التجارة الإلكترونية', vat_number='300000000000004')
+        self.invoice = make_invoice(self.company, self.customer, number='INV-2024-0042')
+
+    def test_arabic_and_prefix_matching(self):
+        # Without hamza and with ta marbuta written as ha, as users often type it
+        hits = search.search('موسسه التجاره', kinds=['customer'])
+        self.assertEqual([hit.object_id for hit in hits], [self.customer.pk])
+        self.assertEqual(search.matching_ids('invoice', 'inv 2024 004'), [self.invoice.pk])
+        self.assertEqual(search.matching_ids('invoice', 'الالكترو'), [self.invoice.pk])
+        self.assertEqual(search.matching_ids('invoice', 'item'), [self.invoice.pk])
+        self.assertEqual(search.search('nothing-like-this'), [])
+
+    def test_index_follows_changes(self):
+        self.customer.name = 'Gulf Trading'
+        self.customer.save()
+        # The customer's invoices are rewritten by one queued job per seller
+        self.assertEqual(search.matching_ids('invoice', 'gulf'), [])
+        self.assertEqual(BatchJob.objects.get().company_id, self.company.pk)
+        self.assertEqual(batch.run_pending(), {'done': 1, 'failed': 0})
+        self.assertEqual(search.matching_ids('invoice', 'gulf'), [self.invoice.pk])
+        self.assertEqual(search.matching_ids('invoice', 'التجارة'), [])
+
+        self.invoice.items.get().delete()
+        self.assertEqual(search.matching_ids('invoice', 'item'), [])
+        make_invoice(self.company, self.customer, number='INV-2', lines=2).delete()
+        self.assertFalse(SearchDocument.objects.filter(kind='item').exists())
+
+        invoice_id = self.invoice.pk
+        self.invoice.delete()
+        self.assertFalse(SearchDocument.objects.filter(invoice_id=invoice_id).exists())
+
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(SearchDocument.objects.filter(kind='customer').count(), 1)
+
+    def test_search_endpoint(self):
+        response = self.client.get(reverse('search'), {'q': '0042', 'kind': 'invoice'})
+        results = response.json()['results']
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]['url'], reverse('invoice_detail', args=[self.invoice.pk]))
+
+
+class VATReportingTests(TestCase):
+
+    def setUp(self):
+        self.company = make_company()
+        self.customer = make_customer()
+
+    def test_summaries_follow_invoice_changes(self):
+        invoice = make_invoice(self.company, self.customer, lines=2)
+        summary = VATSummary.objects.get()
+        self.assertEqual((summary.status, summary.line_count, summary.taxable_amount, summary.vat_amount),
+                         ('draft', 2, Decimal('200.00'), Decimal('30.00')))
+
+        invoice.status = 'approved'
+        invoice.save()
+        self.assertEqual(VATSummary.objects.get().status, 'approved')
+
+        invoice.issue_date = date(2026, 2, 1)
+        invoice.save()
+        self.assertEqual(list(VATSummary.objects.values_list('day', flat=True)), [date(2026, 2, 1)])
+
+        # The instance must not keep the share of a save that was rolled back
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            invoice.status = 'cancelled'
+            invoice.save()
+            raise RuntimeError
+        invoice.status = 'approved'
+        self.assertEqual(invoice.vat_share['key'][3], 'approved')
+        invoice.delete()
+        self.assertFalse(VATSummary.objects.exists())
+
+    def test_deltas_match_rebuild(self):
+        first = make_invoice(self.company, self.customer, number='INV-1', lines=2)
+        second = make_invoice(self.company, self.customer, number='INV-2', lines=1)
+        stale = Invoice.objects.get(pk=first.pk)
+        first.items.first().delete()
+        first.calculate_totals()
+        # A full save from an older copy must not restore the old share
+        stale.status = 'approved'
+        stale.save()
+        second.delete()
+        incremental = list(VATSummary.objects.values_list(
+            'status', 'invoice_count', 'line_count', 'taxable_amount', 'vat_amount'))
+        self.assertEqual(incremental, [('approved', 1, 1, Decimal('100.00'), Decimal('15.00'))])
+        reporting.rebuild()
+        self.assertEqual(list(VATSummary.objects.values_list(
+            'status', 'invoice_count', 'line_count', 'taxable_amount', 'vat_amount')), incremental)
+
+    def test_vat_return_nets_credit_notes(self):
+        make_invoice(self.company, self.customer, number='INV-1', lines=3, status='approved')
+        make_invoice(self.company, self.customer, number='INV-2', lines=1, status='draft')
+        make_invoice(self.company, self.customer, number='CN-1', lines=1, status='submitted', invoice_type='credit')
+        start, end = reporting.quarter_bounds(2026, 1)
+        self.assertEqual((start, end), (date(2026, 1, 1), date(2026, 3, 31)))
+
+        with self.assertNumQueries(1):
+            [row] = reporting.vat_return(self.company, start, end)
+        self.assertEqual((row['net_taxable'], row['net_vat']), (Decimal('200.00'), Decimal('30.00')))
+
+        VATSummary.objects.all().delete()
+        self.assertEqual(reporting.rebuild(), 1)
+        self.assertEqual(reporting.vat_return(self.company, start, end)[0]['net_vat'], Decimal('30.00'))
+
+        response = self.client.get(reverse('vat_report'), {
+            'company': self.company.pk, 'start': start, 'end': end, 'format': 'csv'})
+        lines = response.content.decode().splitlines()
+        self.assertIn('15.00,300.00,45.00,100.00,15.00,200.00,30.00', lines)
+        self.assertIn('credit,submitted,1,1,100.00,15.00', lines)
+        make_company(name='Other Seller', vat_number='300000000000013')
+        response = self.client.get(reverse('vat_report'), {'company': self.company.pk, 'start': start, 'end': end})
+        self.assertContains(response, 'SAR 30.00')
+        self.assertContains(response, 'data-autocomplete-url="/companies/autocomplete/"')
+        self.assertNotContains(response, 'Other Seller')
+
+
+class InvoiceSequenceTests(TestCase):
+
+    def setUp(self):
+        refcache.companies.clear()
+        refcache.customers.clear()
+        self.company = make_company()
+
+    def test_numbers_skip_existing_and_are_per_company(self):
+        prefix = f'INV-{self.company.pk}-2026-'
+        make_invoice(self.company, make_customer(), number=prefix + '000002')
+        self.assertEqual(sequences.next_number(self.company, year=2026), prefix + '000001')
+        self.assertEqual(sequences.next_number(self.company, year=2026), prefix + '000003')
+
+        other = make_company(vat_number='300000000000099')
+        self.assertEqual(sequences.next_number(other, year=2026), f'INV-{other.pk}-2026-000001')
+
+    def test_reserved_block_releases_unused_numbers_as_gaps(self):
+        with sequences.reserve(self.company, 5, series='POS', year=2026) as block:
+            with self.assertNumQueries(0):
+                numbers = [block.next() for _ in range(2)]
+        self.assertEqual(numbers[-1], f'POS-{self.company.pk}-2026-000002')
+        gap = SequenceGap.objects.get()
+        self.assertEqual((gap.start, gap.end), (3, 5))
+
+        # Released numbers are handed out before new ones
+        self.assertEqual(sequences.next_number(self.company, series='POS', year=2026), f'POS-{self.company.pk}-2026-000003')
+        self.assertEqual(SequenceGap.objects.get().start, 4)
+
+    def test_create_view_assigns_number_when_blank(self):
+        customer = make_customer()
+        response = self.client.post(reverse('invoice_create'), {
+            'invoice_number': '', 'invoice_type': 'standard', 'issue_date': '2026-03-01', 'issue_time': '09:00',
+            'company': self.company.pk, 'customer': customer.pk, 'discount': '0',
+            'items-TOTAL_FORMS': '1', 'items-INITIAL_FORMS': '0',
+            'items-0-description': 'Widget', 'items-0-quantity': '1', 'items-0-unit_price': '10',
+            'items-0-vat_rate': '15', 'items-0-discount': '0',
+        })
+        invoice = Invoice.objects.get()
+        self.assertRedirects(response, reverse('invoice_detail', args=[invoice.pk]))
+        self.assertEqual(invoice.invoice_number, f'INV-{self.company.pk}-2026-000001')
+
+
+class PartySnapshotTests(TestCase):
+
+    def test_issued_invoice_keeps_details_as_issued(self):
+        company, customer = make_company(), make_customer()
+        invoice = make_invoice(company, customer)
+        self.assertIsNone(invoice.parties)
+
+        with MockZATCAServer() as server:
+            success, message, data = ZATCAService(api_url=server.url).submit_invoice(invoice)
+        self.assertTrue(success, message)
+        self.assertEqual(invoice.zatca_logs.get().request_data['buyer']['address']['city'], 'Jeddah')
+
+        customer.city = 'Dammam'
+        customer.save()
+        invoice = Invoice.objects.get(pk=invoice.pk)
+        with self.assertNumQueries(1):
+            payload = ZATCAService().prepare_invoice_data(invoice)
+        self.assertEqual(payload['buyer']['address']['city'], 'Jeddah')
+
+        # The invoice and its lines; no company or customer lookups
+        with self.assertNumQueries(2):
+            page = self.client.get(reverse('invoice_print', args=[invoice.pk])).getvalue().decode()
+        self.assertIn('Jeddah', page)
+        self.assertNotIn('Dammam', page)
+
+    def test_status_change_outside_submission_freezes_parties(self):
+        invoice = make_invoice(make_company(), make_customer())
+        invoice.status = 'approved'
+        invoice.save(update_fields=['status'])
+        self.assertEqual(Invoice.objects.get(pk=invoice.pk).parties['seller']['name'], 'Seller Co')
+
+
+class RefCacheTests(TestCase):
+
+    def setUp(self):
+        refcache.companies.clear()
+        refcache.customers.clear()
+
+    def test_lru_evicts_oldest_and_expires(self):
+        cache = refcache.LRUCache(maxsize=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')), (1, None, 3))
+
+        cache.ttl = -1
+        cache.set('d', 4)
+        self.assertIsNone(cache.get('d'))
+
+    def test_lookups_hit_cache_until_invalidated(self):
+        company = make_company()
+        self.assertEqual(refcache.companies.get(company.pk), company)
+        with self.assertNumQueries(0):
+            self.assertEqual(refcache.companies.get(company.pk).name, 'Seller Co')
+            self.assertEqual(refcache.companies.get_by_vat('300000000000003'), company)
+
+        company.vat_number = '300000000000011'
+        company.save()
+        self.assertIsNone(refcache.companies.get_by_vat('300000000000003'))
+        self.assertEqual(refcache.companies.get(company.pk).vat_number, '300000000000011')
+
+    def test_invoice_form_renders_only_selected_options(self):
+        company = make_company()
+        customers = [make_customer(name=f'Customer {index}') for index in range(30)]
+        invoice = make_invoice(company, customers[7])
+
+        html = self.client.get(reverse('invoice_edit', args=[invoice.pk])).content.decode()
+        self.assertIn('data-autocomplete-url="/customers/autocomplete/"', html)
+        self.assertIn('Customer 7', html)
+        self.assertNotIn('Customer 8', html)
+
+        results = self.client.get(reverse('customer_autocomplete'), {'q': 'customer 2'}).json()['results']
+        # "Customer 2" and "Customer 20" to "Customer 29" (prefix match)
+        self.assertEqual(len(results), 11)
+        self.assertTrue(all(result['text'].startswith('Customer 2') for result in results))
+
+
+class InvoiceEditTests(TestCase):
+
+    def setUp(self):
+        refcache.companies.clear()
+        refcache.customers.clear()
+
+    def post_data(self, invoice, items, **changes):
+        data = {
+            'invoice_number': invoice.invoice_number, 'invoice_type': invoice.invoice_type,
+            'issue_date': invoice.issue_date, 'issue_time': '10:30', 'company': invoice.company_id,
+            'customer': invoice.customer_id, 'discount': invoice.discount, 'notes': '',
+            'items-TOTAL_FORMS': len(items) + 1, 'items-INITIAL_FORMS': len(items),
+        }
+        for index, item in enumerate(items):
+            for field in ('description', 'quantity', 'unit_price', 'vat_rate', 'discount'):
+                data[f'items-{index}-{field}'] = getattr(item, field)
+            data[f'items-{index}-id'] = item.pk
+            data[f'items-{index}-invoice'] = invoice.pk
+        data.update(changes)
+        return data
+
+    def test_large_draft_edit_writes_only_the_difference(self):
+        invoice = make_invoice(make_company(), make_customer(), lines=500)
+        items = list(invoice.items.order_by('pk'))
+        removed = {f'items-{index}-DELETE': 'on' for index in range(100, 300)}
+        data = self.post_data(invoice, items, **removed, **{
+            'items-3-quantity': '5',
+            'items-500-description': 'Extra', 'items-500-quantity': '1', 'items-500-unit_price': '20',
+            'items-500-vat_rate': '15', 'items-500-discount': '0',
+        })
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('invoice_edit', args=[invoice.pk]), data)
+        self.assertRedirects(response, reverse('invoice_detail', args=[invoice.pk]), fetch_redirect_response=False)
+        # The 200 removed lines cost a DELETE per 100 plus one for their search
+        # documents; one bulk UPDATE and one INSERT for the others, plus the
+        # invoice, search index and VAT summary bookkeeping
+        self.assertLessEqual(len(queries), 26)
+
+        saved = Invoice.objects.get(pk=invoice.pk)
+        expected = (saved.subtotal, saved.vat_amount, saved.total)
+        saved.calculate_totals()
+        self.assertEqual(expected, (saved.subtotal, saved.vat_amount, saved.total))
+        self.assertEqual(saved.subtotal, Decimal('100.00') * 300 + Decimal('150.00') + Decimal('20.00'))
+        self.assertEqual(saved.items.count(), 301)
+        self.assertEqual(search.matching_ids('invoice', 'extra'), [invoice.pk])
+        self.assertEqual(SearchDocument.objects.filter(kind='item', invoice_id=invoice.pk).count(), 301)
+
+
+class CalculatorTests(TestCase):
+
+    def test_rounding_follows_zatca_rules(self):
+        # 3 x 0.35 = 1.05 net; VAT 0.1575 -> 0.16
+        self.assertEqual(calculator.line_amounts(Decimal('3'), Decimal('0.35'), Decimal('0'), Decimal('15')), (105, 16))
+        # VAT 0.125 -> 0.13 (half up), where banker's rounding would give 0.12
+        self.assertEqual(calculator.line_amounts(Decimal('1'), Decimal('0.25'), Decimal('0'), Decimal('50')), (25, 13))
+        self.assertEqual(calculator.round_div(-125, 10), -13)
+
+        # Three lines of 0.10 at 15%: 0.02 VAT each, but 0.05 for the category
+        nets, vats, totals = calculator.calculate(
+            [InvoiceItem(quantity=Decimal('1'), unit_price=Decimal('0.10'), discount=Decimal('0'), vat_rate=Decimal('15'))] * 3)
+        self.assertEqual((vats, totals.subtotal, totals.vat, totals.total), ([2, 2, 2], 30, 5, 35))
+
+    def test_batch_matches_per_line(self):
+        count = calculator.NUMPY_MIN_LINES + 1
+        quantities = [(index % 97) * 25 + 1 for index in range(count)]
+        prices = [(index * 7919) % 100000 for index in range(count)]
+        discounts = [index % 3 for index in range(count)]
+        rates = [1500 if index % 4 else 500 for index in range(count)]
+        nets, vats = calculator.calculate_lines(quantities, prices, discounts, rates)
+        expected = [
+            calculator.line_amounts(*(calculator.to_decimal(value) for value in line))
+            for line in zip(quantities, prices, discounts, rates)
+        ]
+        self.assertEqual(list(zip(nets, vats)), expected)
+
+    def test_recalculate_command_fixes_stored_amounts(self):
+        invoice = make_invoice(make_company(), make_customer(), lines=3)
+        InvoiceItem.objects.filter(invoice=invoice).update(vat_amount=Decimal('14.99'))
+        Invoice.objects.filter(pk=invoice.pk).update(vat_amount=Decimal('44.97'), total=Decimal('344.97'))
+
+        out = StringIO()
+        call_command('recalculate_invoices', stdout=out)
+        self.assertIn('1 invoices and 3 lines updated', out.getvalue())
+        invoice.refresh_from_db()
+        self.assertEqual((invoice.vat_amount, invoice.total), (Decimal('45.00'), Decimal('345.00')))
+        self.assertEqual(VATSummary.objects.get().vat_amount, Decimal('45.00'))
+
+
+class PayloadSerializationTests(TestCase):
+
+    def test_logged_request_is_the_body_sent(self):
+        invoice = make_invoice(make_company(name='شركة البائع'), make_customer(), lines=3)
+        with self.assertNumQueries(2):
+            payload = serializers.serialize_invoice(serializers.payload_queryset().get(pk=invoice.pk))
+        self.assertEqual(payload.size, len(payload.body))
+        self.assertEqual(json.loads(payload.body), ZATCAService().prepare_invoice_data(invoice))
+
+        with MockZATCAServer() as server:
+            success, message, data = ZATCAService(api_url=server.url).submit_invoice(
+                serializers.payload_queryset().get(pk=invoice.pk))
+        self.assertTrue(success, message)
+
+        log = ZATCALog.objects.get()
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT request_data FROM invoices_zatcalog WHERE id = %s', [log.pk])
+            stored = cursor.fetchone()[0]
+        self.assertEqual(stored.encode('utf-8'), payload.body)
+        self.assertEqual(log.request_sha256, payload.sha256)
+        self.assertEqual(log.timings['req'], payload.size)
+        self.assertEqual(log.request_data['seller']['name'], 'شركة البائع')
+        self.assertEqual(Invoice.objects.get(pk=invoice.pk).zatca_response['uuid'], data['uuid'])
+
+
+class LargeInvoiceTests(TestCase):
+
+    @override_settings(INVOICE_STREAM_CHUNK_SIZE=7, INVOICE_LINES_PER_PAGE=10)
+    def test_print_export_and_detail_cover_every_line(self):
+        invoice = make_invoice(make_company(), make_customer(), lines=25)
+
+        response = self.client.get(reverse('invoice_print', args=[invoice.pk]))
+        self.assertTrue(response.streaming)
+        page = response.getvalue().decode()
+        self.assertEqual(page.count('<td>Item '), 25)
+        self.assertIn('<td>25</td>', page)
+        self.assertIn('SAR 2875.00', page)
+
+        response = self.client.get(reverse('invoice_export', args=[invoice.pk]))
+        rows = list(csv.reader(StringIO(response.getvalue().decode())))
+        self.assertEqual(rows[1][0], 'line')
+        self.assertEqual([row[0] for row in rows[2:27]], [str(number) for number in range(1, 26)])
+        self.assertEqual(rows[-1], ['total', '2875.00'])
+
+        response = self.client.get(reverse('invoice_detail', args=[invoice.pk]), {'page': 3})
+        self.assertContains(response, 'Item 21')
+        self.assertNotContains(response, 'Item 20<')
+        self.assertContains(response, '21-25 of 25')
+
+
+class BatchJobTests(TestCase):
+
+    def setUp(self):
+        self.company, self.customer = make_company(), make_customer()
+        self.invoices = [make_invoice(self.company, self.customer, number=f'INV-{n}') for n in range(3)]
+        self.client.force_login(User.objects.create(username='admin', is_staff=True, is_superuser=True))
+
+    def queue_admin_retry(self, jobs):
+        return self.client.post(reverse('admin:invoices_batchjob_changelist'), {
+            'action': 'retry_failed', '_selected_action': [job.pk for job in jobs],
+        })
+
+    def queue(self, action, invoices):
+        return self.client.post(reverse('admin:invoices_invoice_changelist'), {
+            'action': action, '_selected_action': [invoice.pk for invoice in invoices],
+        })
+
+    def test_admin_actions_queue_and_worker_runs_them(self):
+        self.queue('queue_submit', self.invoices[:2])
+        self.queue('queue_submit', self.invoices)
+        # Nothing is sent from the request; the second action only adds the third invoice
+        self.assertEqual(Invoice.objects.filter(status='draft').count(), 3)
+        self.assertEqual(BatchJob.objects.filter(status='pending').count(), 3)
+
+        with MockZATCAServer() as server:
+            service = ZATCAService(api_url=server.url)
+            self.assertEqual(batch.run_pending(limit=10, service=service), {'done': 3, 'failed': 0})
+            self.assertEqual(batch.claim(10), [])
+
+            self.queue('queue_refresh_status', self.invoices)
+            self.queue('queue_recalculate', self.invoices)
+            self.assertEqual(list(BatchJob.objects.filter(status='pending').values_list('action', flat=True)),
+                             ['refresh_status'] * 3)
+            self.assertEqual(batch.run_pending(limit=10, service=service), {'done': 3, 'failed': 0})
+        self.assertEqual(Invoice.objects.filter(status='approved').count(), 3)
+
+    def test_invalid_drafts_are_not_queued(self):
+        Invoice.objects.filter(pk=self.invoices[1].pk).update(total=Decimal('1.00'))
+        response = self.client.post(reverse('admin:invoices_invoice_changelist'), {
+            'action': 'queue_submit', '_selected_action': [invoice.pk for invoice in self.invoices],
+        }, follow=True)
+        self.assertEqual(list(BatchJob.objects.values_list('invoice__invoice_number', flat=True)), ['INV-0', 'INV-2'])
+        self.assertContains(response, 'INV-1 was not queued: TOTALS totals.total: stored total 1.00 differs')
+
+    @override_settings(ZATCA_MAX_RETRIES=0)
+    def test_failed_jobs_are_kept_and_can_be_retried(self):
+        batch.enqueue('submit', Invoice.objects.all())
+        self.assertEqual(batch.run_pending(service=ZATCAService(api_url='http://127.0.0.1:9')), {'done': 0, 'failed': 1})
+        job = BatchJob.objects.first()
+        self.assertEqual((job.attempts, job.message[:14], job.retryable), (1, 'Network error:', True))
+        # The company's later jobs wait for the failed one
+        self.assertEqual(list(BatchJob.objects.values_list('status', 'attempts')),
+                         [('failed', 1), ('pending', 0), ('pending', 0)])
+        self.assertEqual(batch.claim(10), [])
+        BatchJob.objects.filter(pk=job.pk + 1).update(status='running', lease_expires_at=timezone.now())
+
+        self.queue_admin_retry(BatchJob.objects.all())
+        self.assertEqual(BatchJob.objects.filter(status='pending').count(), 3)
+        self.assertEqual(len(batch.claim(2, worker='w1')) + len(batch.claim(2, worker='w2')), 3)
+
+    def test_invalid_invoice_does_not_hold_its_company(self):
+        invalid = make_invoice(self.company, self.customer, number='INV-A')
+        batch.enqueue('submit', Invoice.objects.filter(pk=invalid.pk))
+        batch.enqueue('submit', Invoice.objects.all())
+        # Edited after it was queued
+        Invoice.objects.filter(pk=invalid.pk).update(total=Decimal('1.00'))
+        with MockZATCAServer() as server:
+            service = ZATCAService(api_url=server.url)
+            self.assertEqual(batch.run_pending(limit=10, service=service), {'done': 3, 'failed': 1})
+        job = BatchJob.objects.first()
+        self.assertEqual((job.status, job.retryable, job.message[:17]), ('failed', False, 'Validation failed'))
+        self.assertEqual(Invoice.objects.filter(status='submitted').count(), 3)
+
+    def test_orphaned_jobs_are_claimed_again_after_their_lease(self):
+        batch.enqueue('recalculate', Invoice.objects.all())
+        orphaned = batch.claim(2, worker='host:1')
+        self.assertEqual(batch.claim(10, worker='host:2'), [BatchJob.objects.last()])
+        BatchJob.objects.filter(worker='host:1').update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+
+        [job] = batch.claim(1, worker='host:3')
+        self.assertEqual((job.pk, job.attempts), (orphaned[0].pk, 2))
+        # The first worker no longer holds its jobs
+        self.assertIsNone(batch.run_job(orphaned[0]))
+        self.assertEqual(batch.run_pending(worker='host:3'), {'done': 1, 'failed': 0})
+        self.assertEqual(BatchJob.objects.filter(status='running').count(), 2)
+
+    def test_hash_ring_moves_only_the_leaving_workers_companies(self):
+        ring = workers.HashRing(['worker-0', 'worker-1', 'worker-2', 'worker-3'])
+        before = {company_id: ring.node_for(company_id) for company_id in range(2000)}
+        self.assertTrue(all(300 < list(before.values()).count(node) < 700 for node in ring.nodes))
+
+        ring.remove('worker-2')
+        after = {company_id: ring.node_for(company_id) for company_id in range(2000)}
+        moved = [company_id for company_id in before if before[company_id] != after[company_id]]
+        self.assertEqual(moved, [company_id for company_id in before if before[company_id] == 'worker-2'])
+
+    def test_shard_depths_and_requeue(self):
+        make_invoice(make_company(vat_number='300000000000013'), self.customer, number='INV-X')
+        batch.enqueue('submit', Invoice.objects.all())
+        ring = workers.HashRing(['worker-0', 'worker-1'])
+        depths = workers.shard_depths(ring)
+        self.assertEqual(list(depths), ['worker-0', 'worker-1'])
+        self.assertEqual(sum(depths.values()), 4)
+        self.assertGreaterEqual(depths[ring.node_for(self.company.pk)], 3)
+
+        claimed = batch.claim(10, worker='host:123', company_ids=[self.company.pk])
+        self.assertEqual([job.invoice_id for job in claimed], [invoice.pk for invoice in self.invoices])
+        self.assertEqual(sum(workers.shard_depths(ring).values()), 1)
+        self.assertEqual(batch.requeue(BatchJob.objects.filter(worker='host:123')), 3)
+        self.assertEqual(sum(workers.shard_depths(ring).values()), 4)
+
+    def test_log_changelist_does_not_load_payloads(self):
+        with MockZATCAServer() as server:
+            ZATCAService(api_url=server.url).submit_invoice(self.invoices[0])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('admin:invoices_zatcalog_changelist'))
+        self.assertContains(response, 'INV-0')
+        listing = [query['sql'] for query in queries if query['sql'].startswith('SELECT "invoices_zatcalog"."id"')]
+        self.assertEqual(len(listing), 1)
+        self.assertNotIn('request_data', listing[0])
+        self.assertNotIn('zatca_response', listing[0])
+
+
+class ValidationTests(TestCase):
+
+    def codes(self, invoice):
+        return [issue.code for issue in validation.validate(invoice)]
+
+    def test_rules_by_invoice_type(self):
+        company = make_company()
+        customer = make_customer(vat_number='123', street_name='', building_number='', postal_code='')
+        invoice = make_invoice(company, customer)
+        self.assertEqual(self.codes(invoice), ['BR-KSA-44', 'BR-KSA-63', 'BR-KSA-63', 'BR-KSA-63'])
+
+        invoice.invoice_type = 'simplified'
+        self.assertEqual(self.codes(invoice), ['BR-KSA-44'])
+        self.assertIs(validation.ruleset('simplified'), validation.ruleset('simplified'))
+
+        customer.vat_number = None
+        customer.save()
+        invoice = Invoice.objects.get(pk=invoice.pk)
+        invoice.invoice_type = 'simplified'
+        self.assertEqual(self.codes(invoice), [])
+
+    def test_issue_date_is_a_saudi_date(self):
+        invoice = make_invoice(make_company(), make_customer())
+        invoice.issue_date = date(2026, 3, 2)
+        # Still 1 March in UTC
+        now = datetime(2026, 3, 2, 1, 30, tzinfo=validation.SAUDI_TIME)
+        with mock.patch('django.utils.timezone.now', return_value=now):
+            self.assertNotIn('BR-KSA-04', self.codes(invoice))
+            invoice.issue_date = date(2026, 3, 3)
+            self.assertIn('BR-KSA-04', self.codes(invoice))
+
+    def test_stale_totals_and_schema(self):
+        invoice = make_invoice(make_company(), make_customer(), lines=2)
+        Invoice.objects.filter(pk=invoice.pk).update(total=Decimal('1.00'))
+        valid, invalid = validation.validate_many(serializers.payload_queryset())
+        self.assertEqual(valid, [])
+        self.assertEqual([str(issue) for issue in invalid[0][1]], [
+            'TOTALS totals.total: stored total 1.00 differs from the lines; recalculate the invoice'])
+
+        document = serializers.invoice_payload(invoice)
+        document['invoiceLines'][0]['quantity'] = '2'
+        del document['totals']
+        self.assertEqual(validation.validate(invoice, document), [
+            validation.Issue('SCHEMA', 'invoiceLines[0].quantity', 'must be a number'),
+            validation.Issue('SCHEMA', 'totals', 'is missing'),
+        ])
+
+    def test_invalid_invoice_is_not_sent(self):
+        invoice = make_invoice(make_company(vat_number='123456789012345'), make_customer())
+        with MockZATCAServer() as server:
+            success, message, data = ZATCAService(api_url=server.url).submit_invoice(invoice)
+            stats = server.stats()
+        self.assertFalse(success)
+        self.assertIn('BR-KSA-39 seller.vatNumber', message)
+        self.assertEqual(data['errors'][0]['code'], 'BR-KSA-39')
+        self.assertEqual(stats['requests'], 0)
+        self.assertFalse(ZATCALog.objects.exists())
+        self.assertEqual(Invoice.objects.get(pk=invoice.pk).status, 'draft')
+
+
+class ChangeFeedTests(TestCase):
+
+    def setUp(self):
+        self.company, self.customer = make_company(), make_customer()
+        self.invoice = make_invoice(self.company, self.customer)
+
+    def feed(self, company=None, **params):
+        return self.client.get(reverse('change_feed'), {'company': (company or self.company).pk, **params}).json()
+
+    def test_status_changes_and_zatca_calls_are_recorded_in_order(self):
+        with MockZATCAServer() as server:
+            ZATCAService(api_url=server.url).submit_invoice(self.invoice)
+        self.invoice.notes = 'edited'
+        self.invoice.save(update_fields=['notes'])
+        self.assertEqual(
+            list(ChangeEvent.objects.values_list('kind', 'previous_status', 'status')),
+            [('status', '', 'draft'), ('status', 'draft', 'submitted'), ('zatca', '', 'submitted')])
+        self.assertEqual(ChangeEvent.objects.last().data['status_code'], 200)
+
+        invoice_id = self.invoice.pk
+        self.invoice.delete()
+        self.assertEqual(ChangeEvent.objects.last().kind, 'deleted')
+        self.assertEqual(ChangeEvent.objects.last().invoice_id, invoice_id)
+
+    def test_feed_pages_by_cursor(self):
+        make_invoice(self.company, self.customer, number='INV-0002')
+        make_invoice(self.company, self.customer, number='INV-0003')
+        first = self.feed(limit=2)
+        self.assertEqual([event['invoice_number'] for event in first['events']], ['INV-0001', 'INV-0002'])
+        self.assertTrue(first['more'])
+        rest = self.feed(after=first['cursor'], limit=2)
+        self.assertEqual([event['invoice_number'] for event in rest['events']], ['INV-0003'])
+        self.assertFalse(rest['more'])
+        self.assertEqual(self.feed(after=rest['cursor'], wait=0), {'events': [], 'cursor': rest['cursor'], 'more': False})
+
+    def test_feed_is_followed_per_company(self):
+        other = make_company(vat_number='300000000000013')
+        make_invoice(other, self.customer, number='B-0001')
+        make_invoice(self.company, self.customer, number='INV-0002')
+        make_invoice(other, self.customer, number='B-0002')
+        self.assertEqual(self.client.get(reverse('change_feed')).status_code, 400)
+
+        mine = self.feed()
+        self.assertEqual([event['invoice_number'] for event in mine['events']], ['INV-0001', 'INV-0002'])
+        theirs = self.feed(company=other, limit=1)
+        self.assertEqual([event['invoice_number'] for event in theirs['events']], ['B-0001'])
+        make_invoice(self.company, self.customer, number='INV-0003')
+        # Each cursor moves on its own company's events only
+        self.assertEqual([event['invoice_number'] for event in self.feed(company=other, after=theirs['cursor'])['events']],
+                         ['B-0002'])
+        self.assertEqual([event['invoice_number'] for event in self.feed(after=mine['cursor'])['events']], ['INV-0003'])
+
+    @override_settings(CHANGE_FEED_STREAM_SECONDS=0)
+    def test_event_stream_resumes_from_last_event_id(self):
+        make_invoice(self.company, self.customer, number='INV-0002')
+        first = ChangeEvent.objects.first().pk
+        response = self.client.get(reverse('change_feed'), {'company': self.company.pk},
+                                   HTTP_ACCEPT='text/event-stream', HTTP_LAST_EVENT_ID=str(first))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = b''.join(response.streaming_content).decode()
+        self.assertNotIn(f'id: {first}\n', body)
+        self.assertIn(f'id: {first + 1}\nevent: status\n', body)
+        self.assertIn('"invoice_number":"INV-0002"', body)
+
+
+class ProductionStaticFilesTests(TestCase):
+
+    def test_collected_assets_are_hashed_compressed_and_served_immutable(self):
+        with tempfile.TemporaryDirectory() as root, override_settings(STATIC_ROOT=root, STORAGES={
+            **settings.STORAGES,
+            'staticfiles': {'BACKEND': 'invoices.staticfiles.CompressedManifestStaticFilesStorage'},
+        }):
+            call_command('collectstatic', interactive=False, verbosity=0)
+            hashed = staticfiles_storage.stored_name('css/style.css')
+            self.assertRegex(hashed, r'^css/style\.[0-9a-f]{12}\.css$')
+
+            middleware = StaticFilesMiddleware(lambda request: HttpResponse('app'))
+            factory = RequestFactory()
+            response = middleware(factory.get(f'/static/{hashed}', HTTP_ACCEPT_ENCODING='gzip, deflate'))
+            body = b''.join(response.streaming_content)
+            self.assertEqual((response['Content-Encoding'], response['Vary']), ('gzip', 'Accept-Encoding'))
+            self.assertIn('immutable', response['Cache-Control'])
+            with open(os.path.join(root, 'css', 'style.css'), 'rb') as f:
+                self.assertEqual(gzip.decompress(body), f.read())
+
+            response = middleware(factory.get('/static/css/style.css'))
+            self.assertFalse(response.has_header('Content-Encoding'))
+            self.assertEqual(response['Cache-Control'], 'public, max-age=60')
+            self.assertEqual(middleware(factory.get('/invoices/')).content, b'app')
+
+    def test_event_streams_are_not_gzipped(self):
+        middleware = CompressionMiddleware(lambda request: StreamingHttpResponse(
+            iter(['data: x\n\n'] * 100), content_type='text/event-stream'))
+        response = middleware(RequestFactory().get('/changes/', HTTP_ACCEPT_ENCODING='gzip'))
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+
+class ImportProfileTests(TestCase):
+
+    def test_worker_boot_leaves_the_http_client_unloaded(self):
+        timings, elapsed, loaded = importtime.profile('wsgi')
+        self.assertEqual(loaded, [])
+        modules = {timing.module for timing in timings}
+        self.assertIn('invoices.views', modules)
+        self.assertNotIn('requests', modules)
+
+    def test_parse_reads_importtime_lines(self):
+        stderr = (
+            'import time: self [us] | cumulative | imported package\n'
+            'import time:       120 |        120 |   urllib3.util\n'
+            'import time:       500 |        620 | urllib3\n'
+        )
+        self.assertEqual(importtime.parse(stderr), [
+            importtime.ImportTiming('urllib3.util', 120, 120, 1),
+            importtime.ImportTiming('urllib3', 500, 620, 0),
+        ])
+        self.assertEqual(importtime.by_package(importtime.parse(stderr)), [('urllib3', 620)])
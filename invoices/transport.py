@@ -0,0 +1,90 @@
+"""
+Instrumented HTTP transport for the ZATCA client.
+
+TimedHTTPAdapter installs urllib3 connection pools whose new connections
+record DNS, TCP connect and TLS handshake time on the current
+telemetry.ApiCall. Kept apart from invoices.telemetry because importing
+requests and urllib3 is a large share of process start-up; only
+invoices.zatca_service loads this module.
+"""
+import socket
+import time
+
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import NewConnectionError
+
+from .telemetry import current_call
+
+
+class TimedConnectionMixin:
+    """Measure name resolution and TCP connect for new pooled connections"""
+
+    def _new_conn(self):
+        call = current_call()
+        if call is None:
+            return super()._new_conn()
+
+        host = self._dns_host
+        start = time.perf_counter()
+        try:
+            addresses = socket.getaddrinfo(host, self.port, 0, socket.SOCK_STREAM)
+        except socket.gaierror:
+            # Let urllib3 raise its own NameResolutionError
+            return super()._new_conn()
+        resolved = time.perf_counter()
+        call.dns += resolved - start
+
+        error = None
+        try:
+            for *_, sockaddr in addresses:
+                # _dns_host is only used for the socket connect; SNI and the
+                # Host header keep using the original name once restored.
+                self._dns_host = sockaddr[0]
+                try:
+                    sock = super()._new_conn()
+                    break
+                except NewConnectionError as exc:
+                    error = exc
+            else:
+                raise error
+        finally:
+            self._dns_host = host
+            self._connect_seconds = time.perf_counter() - start
+            call.connect += time.perf_counter() - resolved
+        return sock
+
+
+class TimedHTTPConnection(TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class TimedHTTPSConnection(TimedConnectionMixin, HTTPSConnection):
+
+    def connect(self):
+        call = current_call()
+        self._connect_seconds = 0.0
+        start = time.perf_counter()
+        super().connect()
+        if call is not None:
+            call.tls += max(time.perf_counter() - start - self._connect_seconds, 0.0)
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """requests adapter whose pooled connections report their setup phases"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': TimedHTTPConnectionPool,
+            'https': TimedHTTPSConnectionPool,
+        }
@@ -10,12 +10,14 @@ urlpatterns = [
     path('companies/create/', views.company_create, name='company_create'),
     path('companies/<int:pk>/edit/', views.company_edit, name='company_edit'),
     path('companies/<int:pk>/delete/', views.company_delete, name='company_delete'),
+    path('companies/autocomplete/', views.company_autocomplete, name='company_autocomplete'),
     
     # Customer URLs
     path('customers/', views.customer_list, name='customer_list'),
     path('customers/create/', views.customer_create, name='customer_create'),
     path('customers/<int:pk>/edit/', views.customer_edit, name='customer_edit'),
     path('customers/<int:pk>/delete/', views.customer_delete, name='customer_delete'),
+    path('customers/autocomplete/', views.customer_autocomplete, name='customer_autocomplete'),
     
     # Invoice URLs
     path('invoices/', views.invoice_list, name='invoice_list'),
@@ -24,9 +26,22 @@ urlpatterns = [
     path('invoices/<int:pk>/edit/', views.invoice_edit, name='invoice_edit'),
     path('invoices/<int:pk>/delete/', views.invoice_delete, name='invoice_delete'),
     path('invoices/<int:pk>/print/', views.invoice_print, name='invoice_print'),
+    path('invoices/<int:pk>/export/', views.invoice_export, name='invoice_export'),
     
     # ZATCA Actions
     path('invoices/<int:pk>/submit/', views.invoice_submit_zatca, name='invoice_submit_zatca'),
     path('invoices/<int:pk>/status/', views.invoice_check_status, name='invoice_check_status'),
     path('invoices/<int:pk>/cancel/', views.invoice_cancel, name='invoice_cancel'),
+
+    # Reports
+    path('reports/vat/', views.vat_report, name='vat_report'),
+
+    # Search
+    path('search/', views.search_view, name='search'),
+
+    # Downstream sync
+    path('changes/', views.change_feed, name='change_feed'),
+
+    # Monitoring
+    path('metrics', views.metrics, name='metrics'),
 ]
@@ -0,0 +1,263 @@
+"""
+Local pre-submission validation.
+
+validate() checks the document generated for an invoice (see
+invoices.serializers) against a structural schema and the business rules for
+the invoice's type before anything is sent, so an invalid invoice is turned
+away in microseconds instead of after an API round trip. The schema and the
+rule set for each invoice type are compiled once per process into flat
+tuples of checks; validate_many() runs them over a whole batch.
+
+Only rules that can be decided from the data held here are implemented. Rule
+codes follow the ZATCA (BR-KSA-*) and EN 16931 (BR-*) identifiers where one
+applies; checks without one use a descriptive code.
+"""
+import re
+from collections import namedtuple
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+
+from django.utils import timezone
+
+from . import calculator, serializers
+from .metrics import REGISTRY
+
+
+ISSUES = REGISTRY.counter('zatca_validation_issues_total', 'Local pre-submission validation issues by rule code')
+
+
+class Issue(namedtuple('Issue', ['code', 'path', 'message'])):
+    __slots__ = ()
+
+    def __str__(self):
+        return f"{self.code} {self.path}: {self.message}"
+
+
+NUMBER = (int, float)
+
+ADDRESS = {
+    'street': str, 'buildingNumber': str, 'district': str, 'city': str, 'postalCode': str, 'country': str,
+}
+
+# Shape of the generated document; a dict is an object, [spec] a list of spec
+SCHEMA = {
+    'invoiceNumber': str,
+    'invoiceType': str,
+    'issueDate': str,
+    'issueTime': str,
+    'seller': {'name': str, 'vatNumber': str, 'crNumber': str, 'address': ADDRESS},
+    'buyer': {'name': str, 'vatNumber': str, 'address': ADDRESS},
+    'invoiceLines': [{
+        'description': str, 'quantity': NUMBER, 'unitPrice': NUMBER, 'vatRate': NUMBER,
+        'vatAmount': NUMBER, 'discount': NUMBER, 'lineTotal': NUMBER,
+    }],
+    'totals': {'subtotal': NUMBER, 'vatAmount': NUMBER, 'discount': NUMBER, 'total': NUMBER},
+}
+
+# Issue dates are Saudi calendar dates, whatever TIME_ZONE the server runs in
+SAUDI_TIME = ZoneInfo('Asia/Riyadh')
+
+VAT_NUMBER = re.compile(r'3\d{13}3')
+BUILDING_NUMBER = re.compile(r'\d{4}')
+POSTAL_CODE = re.compile(r'\d{5}')
+
+# Standard rate and zero-rated/exempt supplies
+VAT_RATES = (0, 1500)
+
+ALL_TYPES = ('standard', 'simplified', 'debit', 'credit')
+
+
+def _compile_schema(spec):
+    """Turn a SCHEMA node into a check(value, path, issues) function"""
+    if isinstance(spec, dict):
+        children = [(key, _compile_schema(child)) for key, child in spec.items()]
+
+        def check_object(value, path, issues):
+            if not isinstance(value, dict):
+                issues.append(Issue('SCHEMA', path, 'must be an object'))
+                return
+            for key, check in children:
+                child_path = f'{path}.{key}' if path else key
+                if key not in value:
+                    issues.append(Issue('SCHEMA', child_path, 'is missing'))
+                else:
+                    check(value[key], child_path, issues)
+        return check_object
+
+    if isinstance(spec, list):
+        check_item = _compile_schema(spec[0])
+
+        def check_list(value, path, issues):
+            if not isinstance(value, list):
+                issues.append(Issue('SCHEMA', path, 'must be a list'))
+                return
+            for index, item in enumerate(value):
+                check_item(item, f'{path}[{index}]', issues)
+        return check_list
+
+    name = 'a number' if spec is NUMBER else 'a string'
+
+    def check_value(value, path, issues):
+        if not isinstance(value, spec) or isinstance(value, bool):
+            issues.append(Issue('SCHEMA', path, f'must be {name}'))
+    return check_value
+
+
+def _units(value):
+    # Document amounts have at most two decimals, so scaling the float and
+    # rounding recovers the exact number of hundredths
+    return round(value * 100)
+
+
+def _invoice_number(document, invoice):
+    if not document['invoiceNumber'].strip():
+        yield Issue('BR-02', 'invoiceNumber', 'Invoice number is required')
+
+
+def _issue_date(document, invoice):
+    # ISO dates compare correctly as strings
+    if document['issueDate'] > timezone.localdate(timezone=SAUDI_TIME).isoformat():
+        yield Issue('BR-KSA-04', 'issueDate', 'Issue date must not be in the future')
+
+
+def _seller(document, invoice):
+    seller = document['seller']
+    if not VAT_NUMBER.fullmatch(seller['vatNumber']):
+        yield Issue('BR-KSA-39', 'seller.vatNumber', 'Seller VAT number must be 15 digits starting and ending with 3')
+    if not seller['name'].strip():
+        yield Issue('BR-06', 'seller.name', 'Seller name is required')
+    yield from _address(seller['address'], 'seller.address', 'BR-KSA-09', 'BR-KSA-37', 'BR-KSA-66')
+
+
+def _buyer_vat_number(document, invoice):
+    vat_number = document['buyer']['vatNumber']
+    if vat_number and not VAT_NUMBER.fullmatch(vat_number):
+        yield Issue('BR-KSA-44', 'buyer.vatNumber', 'Buyer VAT number must be 15 digits starting and ending with 3')
+
+
+def _buyer(document, invoice):
+    buyer = document['buyer']
+    if not buyer['name'].strip():
+        yield Issue('BR-KSA-42', 'buyer.name', 'Buyer name is required on standard invoices')
+    yield from _address(buyer['address'], 'buyer.address', 'BR-KSA-63', 'BR-KSA-63', 'BR-KSA-67')
+
+
+def _address(address, path, required_code, building_code, postal_code):
+    for key in ('street', 'buildingNumber', 'district', 'city', 'postalCode', 'country'):
+        if not address[key].strip():
+            yield Issue(required_code, f'{path}.{key}', 'is required')
+    # Saudi national address formats
+    if address['country'] == 'SA':
+        if address['buildingNumber'] and not BUILDING_NUMBER.fullmatch(address['buildingNumber']):
+            yield Issue(building_code, f'{path}.buildingNumber', 'must be 4 digits')
+        if address['postalCode'] and not POSTAL_CODE.fullmatch(address['postalCode']):
+            yield Issue(postal_code, f'{path}.postalCode', 'must be 5 digits')
+
+
+def _lines(document, invoice):
+    lines = document['invoiceLines']
+    if not lines:
+        yield Issue('BR-16', 'invoiceLines', 'An invoice must have at least one line')
+    for index, line in enumerate(lines):
+        path = f'invoiceLines[{index}]'
+        quantity, price, discount, rate = (
+            _units(line['quantity']), _units(line['unitPrice']), _units(line['discount']), _units(line['vatRate']))
+        if not line['description'].strip():
+            yield Issue('BR-25', f'{path}.description', 'Item name is required')
+        if quantity <= 0:
+            yield Issue('LINE-QUANTITY', f'{path}.quantity', 'must be positive')
+        if price < 0:
+            yield Issue('BR-27', f'{path}.unitPrice', 'must not be negative')
+        if rate not in VAT_RATES:
+            yield Issue('VAT-RATE', f'{path}.vatRate', f"{line['vatRate']}% is not a Saudi VAT rate")
+        net = calculator.round_div(quantity * price, 100) - discount
+        if _units(line['lineTotal']) != net:
+            yield Issue('LINE-NET', f'{path}.lineTotal', 'does not equal quantity x price - discount')
+        elif _units(line['vatAmount']) != calculator.round_div(net * rate, 10000):
+            yield Issue('LINE-VAT', f'{path}.vatAmount', 'does not equal line total x VAT rate')
+
+
+def _totals(document, invoice):
+    totals = document['totals']
+    lines = document['invoiceLines']
+    expected = calculator.invoice_totals(
+        [_units(line['lineTotal']) for line in lines], [_units(line['vatRate']) for line in lines],
+        _units(totals['discount']))
+    checks = [
+        ('BR-CO-10', 'subtotal', expected.subtotal),
+        ('BR-CO-14', 'vatAmount', expected.vat),
+        ('BR-CO-15', 'total', expected.total),
+    ]
+    for code, key, value in checks:
+        if _units(totals[key]) != value:
+            yield Issue(code, f'totals.{key}', 'does not match the invoice lines')
+
+
+def _stored_totals(document, invoice):
+    # The document is priced from the lines; stale stored totals mean the
+    # invoice shown and printed differs from what would be reported
+    totals = document['totals']
+    for key, field in (('subtotal', 'subtotal'), ('vatAmount', 'vat_amount'), ('total', 'total')):
+        if _units(totals[key]) != calculator.to_units(getattr(invoice, field)):
+            yield Issue('TOTALS', f'totals.{key}',
+                        f"stored {field} {getattr(invoice, field)} differs from the lines; recalculate the invoice")
+
+
+# (invoice types, rule); rules run in this order
+RULES = [
+    (ALL_TYPES, _invoice_number),
+    (ALL_TYPES, _issue_date),
+    (ALL_TYPES, _seller),
+    (ALL_TYPES, _buyer_vat_number),
+    (('standard',), _buyer),
+    (ALL_TYPES, _lines),
+    (ALL_TYPES, _totals),
+    (ALL_TYPES, _stored_totals),
+]
+
+
+@lru_cache(maxsize=None)
+def schema():
+    """The compiled document schema check"""
+    return _compile_schema(SCHEMA)
+
+
+@lru_cache(maxsize=None)
+def ruleset(invoice_type):
+    """The compiled rules for one invoice type"""
+    return tuple(rule for types, rule in RULES if invoice_type in types)
+
+
+def validate(invoice, document=None):
+    """
+    Return the list of Issues found in the invoice's document (built with
+    serializers.invoice_payload() unless given); empty when it can be sent.
+    Business rules are skipped when the document fails the schema check.
+    """
+    if document is None:
+        document = serializers.invoice_payload(invoice)
+    issues = []
+    schema()(document, '', issues)
+    if not issues:
+        for rule in ruleset(invoice.invoice_type):
+            issues.extend(rule(document, invoice))
+    for issue in issues:
+        ISSUES.inc(code=issue.code)
+    return issues
+
+
+def validate_many(invoices):
+    """
+    Validate a batch (ideally from serializers.payload_queryset()). Returns
+    (valid, invalid): a list of (invoice, document) pairs ready to encode and
+    a list of (invoice, issues) pairs.
+    """
+    valid, invalid = [], []
+    for invoice in invoices:
+        document = serializers.invoice_payload(invoice)
+        issues = validate(invoice, document)
+        if issues:
+            invalid.append((invoice, issues))
+        else:
+            valid.append((invoice, document))
+    return valid, invalid
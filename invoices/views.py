@@ -1,25 +1,44 @@
+from django.conf import settings
 from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse
+from django.db import transaction
+from django.db.models import Count, Q
+from django.core.paginator import Paginator
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from datetime import datetime
-from .models import Company, Customer, Invoice, InvoiceItem, ZATCALog
-from .forms import CompanyForm, CustomerForm, InvoiceForm, InvoiceItemFormSet
-from .zatca_service import ZATCAService
+from .models import Company, Customer, Invoice, InvoiceItem, SearchDocument, ZATCALog
+from .forms import CompanyForm, CustomerForm, InvoiceForm, InvoiceItemFormSet, VATReportForm
+from .metrics import REGISTRY
+from . import changes, refcache, reporting, search, sequences, serializers, streaming, workers
 
 
 def home(view):
     """Home page with dashboard"""
+    counts = Invoice.objects.aggregate(
+        total=Count('pk'),
+        draft=Count('pk', filter=Q(status='draft')),
+        submitted=Count('pk', filter=Q(status='submitted')),
+        approved=Count('pk', filter=Q(status='approved')),
+    )
     context = {
-        'total_invoices': Invoice.objects.count(),
-        'draft_invoices': Invoice.objects.filter(status='draft').count(),
-        'submitted_invoices': Invoice.objects.filter(status='submitted').count(),
-        'approved_invoices': Invoice.objects.filter(status='approved').count(),
-        'recent_invoices': Invoice.objects.all()[:5],
+        'total_invoices': counts['total'],
+        'draft_invoices': counts['draft'],
+        'submitted_invoices': counts['submitted'],
+        'approved_invoices': counts['approved'],
+        'recent_invoices': Invoice.objects.select_related('customer')[:5],
     }
     return render(view, 'invoices/home.html', context)
 
 
+def _zatca_service():
+    # Imported on first use: the HTTP client stack is a large part of worker
+    # start-up and most requests never talk to ZATCA
+    from .zatca_service import ZATCAService
+    return ZATCAService()
+
+
 # Company Views
 def company_list(request):
     """List all companies"""
@@ -64,6 +83,25 @@ def company_delete(request, pk):
     return render(request, 'invoices/company_confirm_delete.html', {'company': company})
 
 
+def _autocomplete(request, cache):
+    """JSON options for an AutocompleteSelect, found through the search index and resolved through the cache"""
+    query = request.GET.get('q', '').strip()
+    if query:
+        ids = search.matching_ids(cache.label, query, limit=20)
+        found = cache.get_many(ids)
+        objects = [found[pk] for pk in ids if pk in found]
+    else:
+        objects = list(cache.model.objects.order_by('name')[:20])
+        cache.prime(objects)
+    return JsonResponse({'results': [
+        {'id': obj.pk, 'text': str(obj), 'vat_number': obj.vat_number or ''} for obj in objects
+    ]})
+
+
+def company_autocomplete(request):
+    return _autocomplete(request, refcache.companies)
+
+
 # Customer Views
 def customer_list(request):
     """List all customers"""
@@ -108,10 +146,14 @@ def customer_delete(request, pk):
     return render(request, 'invoices/customer_confirm_delete.html', {'customer': customer})
 
 
+def customer_autocomplete(request):
+    return _autocomplete(request, refcache.customers)
+
+
 # Invoice Views
 def invoice_list(request):
     """List all invoices"""
-    invoices = Invoice.objects.all()
+    invoices = Invoice.objects.select_related('customer')
     status_filter = request.GET.get('status')
     if status_filter:
         invoices = invoices.filter(status=status_filter)
@@ -119,10 +161,12 @@ def invoice_list(request):
 
 
 def invoice_detail(request, pk):
-    """View invoice details"""
+    """View invoice details, one page of lines at a time; the totals are the stored ones"""
     invoice = get_object_or_404(Invoice, pk=pk)
-    logs = invoice.zatca_logs.all()
-    return render(request, 'invoices/invoice_detail.html', {'invoice': invoice, 'logs': logs})
+    logs = invoice.zatca_logs.defer('request_data', 'response_data')
+    lines = invoice.items.order_by('pk').values(*streaming.LINE_FIELDS)
+    page_obj = Paginator(lines, settings.INVOICE_LINES_PER_PAGE).get_page(request.GET.get('page'))
+    return render(request, 'invoices/invoice_detail.html', {'invoice': invoice, 'logs': logs, 'page_obj': page_obj})
 
 
 def invoice_create(request):
@@ -135,13 +179,16 @@ def invoice_create(request):
             invoice = form.save(commit=False)
             if request.user.is_authenticated:
                 invoice.created_by = request.user
-            invoice.save()
-            
-            formset.instance = invoice
-            formset.save()
-            
-            # Calculate totals
-            invoice.calculate_totals()
+            with transaction.atomic():
+                # Allocated in the same transaction, so a failed save leaves no gap
+                if not invoice.invoice_number:
+                    invoice.invoice_number = sequences.next_number(invoice.company, year=invoice.issue_date.year)
+                invoice.save()
+
+                # Lines are bulk-inserted and the totals computed from them
+                formset.instance = invoice
+                formset.save_diff()
+                invoice.save(update_fields=['subtotal', 'vat_amount', 'total', 'updated_at'])
             
             messages.success(request, 'Invoice created successfully!')
             return redirect('invoice_detail', pk=invoice.pk)
@@ -173,9 +220,11 @@ def invoice_edit(request, pk):
         formset = InvoiceItemFormSet(request.POST, instance=invoice)
         
         if form.is_valid() and formset.is_valid():
-            form.save()
-            formset.save()
-            invoice.calculate_totals()
+            with transaction.atomic():
+                # Only added, changed and removed lines are written; totals move by the difference
+                invoice = form.save(commit=False)
+                formset.save_diff()
+                invoice.save()
             
             messages.success(request, 'Invoice updated successfully!')
             return redirect('invoice_detail', pk=invoice.pk)
@@ -210,14 +259,14 @@ def invoice_delete(request, pk):
 
 def invoice_submit_zatca(request, pk):
     """Submit invoice to ZATCA"""
-    invoice = get_object_or_404(Invoice, pk=pk)
+    invoice = get_object_or_404(serializers.payload_queryset(), pk=pk)
     
     if invoice.status != 'draft':
         messages.error(request, 'Invoice already submitted or not in draft status!')
         return redirect('invoice_detail', pk=pk)
     
     if request.method == 'POST':
-        zatca_service = ZATCAService()
+        zatca_service = _zatca_service()
         success, message, data = zatca_service.submit_invoice(invoice)
         
         if success:
@@ -234,7 +283,7 @@ def invoice_check_status(request, pk):
     """Check invoice status from ZATCA"""
     invoice = get_object_or_404(Invoice, pk=pk)
     
-    zatca_service = ZATCAService()
+    zatca_service = _zatca_service()
     success, message, data = zatca_service.check_invoice_status(invoice)
     
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
@@ -262,7 +311,7 @@ def invoice_cancel(request, pk):
     
     if request.method == 'POST':
         reason = request.POST.get('reason', 'Cancelled by user')
-        zatca_service = ZATCAService()
+        zatca_service = _zatca_service()
         success, message, data = zatca_service.cancel_invoice(invoice, reason)
         
         if success:
@@ -276,6 +325,110 @@ def invoice_cancel(request, pk):
 
 
 def invoice_print(request, pk):
-    """Print invoice"""
+    """Print invoice, streamed so that memory stays flat however many lines it has"""
+    invoice = get_object_or_404(Invoice, pk=pk)
+    return StreamingHttpResponse(streaming.stream_print(invoice, request), content_type='text/html; charset=utf-8')
+
+
+def invoice_export(request, pk):
+    """Invoice lines and totals as a streamed CSV download"""
     invoice = get_object_or_404(Invoice, pk=pk)
-    return render(request, 'invoices/invoice_print.html', {'invoice': invoice})
+    response = StreamingHttpResponse(streaming.stream_csv(invoice), content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="invoice-{invoice.invoice_number}.csv"'
+    return response
+
+
+# Reports
+def vat_report(request):
+    """VAT return for a company and period, from the precomputed VAT summaries"""
+    start, end = reporting.current_quarter()
+    initial = {'company': Company.objects.order_by('pk').first(), 'start': start, 'end': end}
+    form = VATReportForm(request.GET or None, initial=initial)
+    context = {'form': form}
+    if form.is_valid():
+        company, start, end = form.cleaned_data['company'], form.cleaned_data['start'], form.cleaned_data['end']
+        if request.GET.get('format') == 'csv':
+            response = HttpResponse(content_type='text/csv')
+            response['Content-Disposition'] = (
+                f'attachment; filename="vat-return-{company.vat_number}-{start}-{end}.csv"')
+            reporting.write_csv(response, company, start, end)
+            return response
+        rows = reporting.vat_return(company, start, end)
+        context.update({
+            'company': company,
+            'start': start,
+            'end': end,
+            'rows': rows,
+            'totals': {column: sum(row[column] for row in rows) for column in reporting.RETURN_COLUMNS},
+            'breakdown': reporting.breakdown(company, start, end),
+        })
+    return render(request, 'invoices/vat_report.html', context)
+
+
+def _int_param(request, name, default, low, high):
+    try:
+        value = int(request.GET.get(name, default))
+    except ValueError:
+        value = default
+    return min(max(value, low), high)
+
+
+def change_feed(request):
+    """
+    Changes to one company's invoices (?company=<id>, required) after
+    ?after=<cursor> as JSON; ?wait=<seconds> long-polls until there is
+    something. Asking for text/event-stream (or ?stream=1) streams the feed as
+    server-sent events instead, resuming from Last-Event-ID.
+    """
+    company_id = request.GET.get('company', '')
+    if not company_id.isdigit():
+        # Only within a company do events become visible in cursor order
+        return JsonResponse({'error': "The 'company' parameter is required"}, status=400)
+    company_id = int(company_id)
+    page_size = settings.CHANGE_FEED_PAGE_SIZE
+    cursor = _int_param(request, 'after', 0, 0, 2 ** 63 - 1)
+    limit = _int_param(request, 'limit', page_size, 1, page_size)
+    wait = _int_param(request, 'wait', 0, 0, settings.CHANGE_FEED_MAX_WAIT)
+
+    if request.GET.get('stream') or 'text/event-stream' in request.headers.get('Accept', ''):
+        last_event_id = request.headers.get('Last-Event-ID', '')
+        if last_event_id.isdigit():
+            cursor = int(last_event_id)
+        response = StreamingHttpResponse(changes.stream(company_id, cursor), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    events, more = changes.wait_for(company_id, cursor, limit, timeout=wait)
+    return JsonResponse({
+        'events': [changes.as_dict(event) for event in events],
+        'cursor': events[-1].pk if events else cursor,
+        'more': more,
+    })
+
+
+def metrics(request):
+    """Prometheus-style metrics for this process, plus the batch queue depth per worker shard"""
+    workers.publish_depths(workers.configured_ring())
+    return HttpResponse(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def search_view(request):
+    """JSON search over invoices, customers, companies and invoice lines"""
+    query = request.GET.get('q', '')
+    kinds = [kind for kind in request.GET.getlist('kind') if kind in dict(SearchDocument.KINDS)]
+    try:
+        limit = min(max(int(request.GET.get('limit', 20)), 1), 100)
+    except ValueError:
+        limit = 20
+
+    results = []
+    for hit in search.search(query, kinds=kinds or None, limit=limit):
+        if hit.kind == 'customer':
+            url = reverse('customer_edit', args=[hit.object_id])
+        elif hit.kind == 'company':
+            url = reverse('company_edit', args=[hit.object_id])
+        else:
+            url = reverse('invoice_detail', args=[hit.invoice_id])
+        results.append({'kind': hit.kind, 'id': hit.object_id, 'label': hit.label, 'url': url})
+    return JsonResponse({'query': query, 'results': results})
@@ -0,0 +1,275 @@
+"""
+Company-sharded worker pool for batch jobs.
+
+Jobs for one company have to run in order (numbering and the invoice chain),
+but companies are independent. The Supervisor forks worker processes and
+assigns each company to one of them with a consistent-hash ring, so sellers
+run in parallel across cores while each seller's jobs run one after another,
+oldest first, in a single process.
+
+A company is handed to at most one worker at a time: the supervisor only
+dispatches it again once the worker reports back, so order is kept when the
+ring changes. When workers join or leave (scale()), only the companies that
+hash to the changed worker move; a removed worker is watched until it has
+drained and exited. A worker that dies is restarted under the same name (or,
+if it was draining, just reaped) after the jobs it had claimed are put back
+in the queue. Jobs
+orphaned by a supervisor that was killed or restarted are put back once
+their lease has expired (see invoices.batch), at start-up and on every
+check. SIGTERM lets a worker finish the job in hand and put the rest of its
+claim back before it exits.
+
+Workers are forked, so this needs a POSIX platform.
+"""
+import bisect
+import hashlib
+import multiprocessing
+import queue
+import signal
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Count, Min
+
+from . import batch
+from .metrics import REGISTRY
+from .models import BatchJob
+
+
+QUEUE_DEPTH = REGISTRY.gauge('zatca_batch_queue_depth', 'Pending batch jobs by worker shard')
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.md5(str(key).encode('utf-8')).digest()[:8], 'big')
+
+
+class HashRing:
+    """Consistent-hash ring mapping keys to nodes, with `replicas` virtual points per node"""
+
+    def __init__(self, nodes=(), replicas=100):
+        self.replicas = replicas
+        self._points = []
+        self._nodes = {}
+        for node in nodes:
+            self.add(node)
+
+    @property
+    def nodes(self):
+        return set(self._nodes.values())
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def add(self, node):
+        for replica in range(self.replicas):
+            point = _hash(f'{node}#{replica}')
+            self._nodes[point] = node
+            bisect.insort(self._points, point)
+
+    def remove(self, node):
+        self._points = [point for point in self._points if self._nodes[point] != node]
+        self._nodes = {point: self._nodes[point] for point in self._points}
+
+    def node_for(self, key):
+        if not self._points:
+            raise LookupError("HashRing has no nodes")
+        index = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._nodes[self._points[index]]
+
+
+def _worker_index(name):
+    return int(name.rsplit('-', 1)[1])
+
+
+def shard_depths(ring):
+    """Pending jobs per ring node, from one GROUP BY over the pending jobs"""
+    depths = {node: 0 for node in sorted(ring.nodes, key=_worker_index)}
+    pending = BatchJob.objects.filter(status='pending').values('company_id').annotate(count=Count('pk'))
+    for row in pending:
+        depths[ring.node_for(row['company_id'])] += row['count']
+    return depths
+
+
+@lru_cache(maxsize=None)
+def configured_ring(count=None):
+    """The ring of a pool started with `count` (default BATCH_WORKERS) workers"""
+    return HashRing(f'worker-{index}' for index in range(count or settings.BATCH_WORKERS))
+
+
+def publish_depths(ring):
+    """Set the queue depth gauge for every shard and return the depths"""
+    depths = shard_depths(ring)
+    for node, depth in depths.items():
+        QUEUE_DEPTH.set(depth, shard=node)
+    return depths
+
+
+def _worker_main(name, tasks, results, limit, api_url):
+    """Worker process: run the jobs of each company it is handed, then report back"""
+    state = {'busy': False, 'stopping': False}
+
+    def terminate(signum, frame):
+        # Between companies there is nothing to save; during one, stop after the current job
+        state['stopping'] = True
+        if not state['busy']:
+            raise SystemExit(0)
+
+    # Shutdown is driven by the supervisor, which lets each worker finish its company;
+    # a SIGTERM sent to the whole process group stops the worker at the next job
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, terminate)
+    from .zatca_service import ZATCAService  # already loaded by the supervisor before forking
+    service = ZATCAService(api_url=api_url)
+    worker = batch.worker_name()
+    try:
+        while not state['stopping']:
+            company_id = tasks.get()
+            if company_id is None:
+                return
+            state['busy'] = True
+            try:
+                counts = batch.run_pending(limit, worker, [company_id], service, lambda: state['stopping'])
+            except Exception as e:
+                counts = {'done': 0, 'failed': 0, 'error': str(e)}
+            results.put((name, company_id, counts))
+            state['busy'] = False
+    finally:
+        connections.close_all()
+
+
+class Supervisor:
+    """
+    Fork `processes` workers and feed them companies with pending jobs. Call
+    run() to loop, or dispatch()/collect()/check_workers() from your own loop.
+    """
+
+    def __init__(self, processes, limit=None, api_url=None, poll_interval=1.0):
+        self.limit = limit or settings.BATCH_CLAIM_SIZE
+        self.api_url = api_url
+        self.poll_interval = poll_interval
+        self.context = multiprocessing.get_context('fork')
+        self.results = self.context.Queue()
+        self.ring = HashRing()
+        self.workers = {}
+        # Removed workers still finishing the companies they were sent
+        self.draining = {}
+        self.in_flight = {}
+        self.totals = {'done': 0, 'failed': 0}
+        # Set from signal handlers; applied by run() between ticks
+        self.target = processes
+        self.stopping = False
+        batch.requeue_expired()
+        self.scale(processes)
+
+    def _start(self, name):
+        # Import the HTTP client once here rather than in every forked worker
+        from . import zatca_service  # noqa: F401
+        tasks = self.context.Queue()
+        # Children must not share the parent's database connections
+        connections.close_all()
+        process = self.context.Process(
+            target=_worker_main, args=(name, tasks, self.results, self.limit, self.api_url), name=name, daemon=True)
+        process.start()
+        self.workers[name] = (process, tasks)
+
+    def add_worker(self):
+        """Start a worker under the lowest free name and give it its share of the ring"""
+        index = 0
+        while f'worker-{index}' in self.workers or f'worker-{index}' in self.draining:
+            index += 1
+        name = f'worker-{index}'
+        self._start(name)
+        self.ring.add(name)
+        return name
+
+    def remove_worker(self):
+        """Stop the highest-numbered worker once it has finished the companies already sent to it"""
+        name = max(self.workers, key=_worker_index)
+        process, tasks = self.workers.pop(name)
+        self.draining[name] = process
+        self.ring.remove(name)
+        tasks.put(None)
+        return name
+
+    def scale(self, processes):
+        processes = max(processes, 1)
+        while len(self.workers) < processes:
+            self.add_worker()
+        while len(self.workers) > processes:
+            self.remove_worker()
+
+    def check_workers(self):
+        """
+        Restart workers that died under the same name, so the ring does not
+        change, and forget draining workers that have exited; the jobs they
+        had claimed go back in the queue first. Jobs left running by an
+        earlier supervisor go back once their lease expires.
+        """
+        batch.requeue_expired()
+        for name, (process, tasks) in list(self.workers.items()):
+            if not process.is_alive():
+                self._reap(name, process)
+                self._start(name)
+        for name, process in list(self.draining.items()):
+            if not process.is_alive():
+                self._reap(name, process)
+                del self.draining[name]
+
+    def _reap(self, name, process):
+        process.join()
+        batch.requeue(BatchJob.objects.filter(worker=batch.worker_name(process.pid)))
+        for company_id, owner in list(self.in_flight.items()):
+            if owner == name:
+                del self.in_flight[company_id]
+
+    def dispatch(self):
+        """Hand every company with runnable jobs, and not already being worked on, to its shard"""
+        companies = (batch.runnable().exclude(company_id__in=list(self.in_flight))
+                     .values('company_id').annotate(oldest=Min('pk')).order_by('oldest')
+                     .values_list('company_id', flat=True))
+        dispatched = 0
+        for company_id in companies:
+            owner = self.ring.node_for(company_id)
+            self.workers[owner][1].put(company_id)
+            self.in_flight[company_id] = owner
+            dispatched += 1
+        return dispatched
+
+    def collect(self, timeout=None):
+        """Record finished companies; returns how many reported back"""
+        collected = 0
+        try:
+            # Wait for the first result, then take whatever else has arrived
+            name, company_id, counts = self.results.get(timeout=timeout)
+            while True:
+                collected += 1
+                # Unless the worker was reaped and the company handed on meanwhile
+                if self.in_flight.get(company_id) == name:
+                    del self.in_flight[company_id]
+                for key in ('done', 'failed'):
+                    self.totals[key] += counts[key]
+                name, company_id, counts = self.results.get_nowait()
+        except queue.Empty:
+            return collected
+
+    def run(self, until_empty=False, on_tick=None):
+        """Dispatch and collect until `stopping` is set (or, with until_empty, until no work is left)"""
+        while not self.stopping:
+            self.scale(self.target)
+            self.check_workers()
+            self.dispatch()
+            if on_tick is not None:
+                on_tick(self)
+            if until_empty and not self.in_flight:
+                break
+            self.collect(timeout=self.poll_interval)
+        return self.totals
+
+    def stop(self):
+        """Stop all workers, waiting for each to finish what it was sent"""
+        while self.workers:
+            self.remove_worker()
+        for process in self.draining.values():
+            process.join()
+        self.draining.clear()
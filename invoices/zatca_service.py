@@ -1,108 +1,129 @@
 import requests
 import json
 import base64
+import threading
 from datetime import datetime
 from django.conf import settings
+from urllib3.util.retry import Retry
+from . import serializers, validation
 from .models import ZATCALog
+from .telemetry import ApiCall
+from .transport import TimedHTTPAdapter
+
+
+_local = threading.local()
+
+# Validation issues spelled out in the message returned by submit_invoice
+MAX_REPORTED_ISSUES = 5
+
+
+class CappedRetry(Retry):
+    """Retry that never waits longer than backoff_max, whatever Retry-After asks for"""
+
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        return None if retry_after is None else min(retry_after, self.backoff_max)
+
+
+def get_session():
+    """
+    Return this thread's pooled HTTP session.
+    Connections are kept alive between calls. Connection failures are retried
+    for every request, since nothing reached ZATCA; read errors, 429 and 503
+    only for GET, so a submission or cancellation is never sent twice. Each
+    wait is capped at ZATCA_RETRY_MAX_WAIT seconds.
+    """
+    config = (settings.ZATCA_MAX_RETRIES, settings.ZATCA_RETRY_BACKOFF, settings.ZATCA_RETRY_MAX_WAIT,
+              settings.ZATCA_POOL_MAXSIZE)
+    session = getattr(_local, 'session', None)
+    if session is None or _local.config != config:
+        retry = CappedRetry(
+            total=settings.ZATCA_MAX_RETRIES,
+            backoff_factor=settings.ZATCA_RETRY_BACKOFF,
+            backoff_max=settings.ZATCA_RETRY_MAX_WAIT,
+            status_forcelist=(429, 503),
+            allowed_methods=frozenset({'GET'}),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = TimedHTTPAdapter(pool_maxsize=settings.ZATCA_POOL_MAXSIZE, max_retries=retry)
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        _local.session = session
+        _local.config = config
+    return session
 
 
 class ZATCAService:
     """Service class to handle ZATCA API integration"""
     
-    def __init__(self):
-        self.api_url = settings.ZATCA_API_URL
+    def __init__(self, api_url=None):
+        self.api_url = api_url or settings.ZATCA_API_URL
         self.api_key = settings.ZATCA_API_KEY
+        self.timeout = settings.ZATCA_TIMEOUT
         self.headers = {
             'Authorization': f'Bearer {self.api_key}',
             'Content-Type': 'application/json',
             'Accept': 'application/json'
         }
+
+    def _send(self, call, method, path, **kwargs):
+        """Send one API request through the pooled session, recording its timings on call"""
+        return call.run(
+            get_session().request,
+            method,
+            f"{self.api_url}{path}",
+            headers=self.headers,
+            timeout=self.timeout,
+            **kwargs
+        )
     
     def prepare_invoice_data(self, invoice):
         """
-        Prepare invoice data in ZATCA format
-        This is a sample structure - adjust based on actual ZATCA API requirements
+        Prepare invoice data in ZATCA format (see serializers.invoice_payload)
         """
-        invoice_data = {
-            "invoiceNumber": invoice.invoice_number,
-            "invoiceType": invoice.invoice_type,
-            "issueDate": invoice.issue_date.isoformat(),
-            "issueTime": invoice.issue_time.isoformat(),
-            "seller": {
-                "name": invoice.company.name,
-                "vatNumber": invoice.company.vat_number,
-                "crNumber": invoice.company.cr_number,
-                "address": {
-                    "street": invoice.company.street_name,
-                    "buildingNumber": invoice.company.building_number,
-                    "district": invoice.company.district,
-                    "city": invoice.company.city,
-                    "postalCode": invoice.company.postal_code,
-                    "country": invoice.company.country
-                }
-            },
-            "buyer": {
-                "name": invoice.customer.name,
-                "vatNumber": invoice.customer.vat_number or "",
-                "address": {
-                    "street": invoice.customer.street_name or "",
-                    "buildingNumber": invoice.customer.building_number or "",
-                    "district": invoice.customer.district or "",
-                    "city": invoice.customer.city,
-                    "postalCode": invoice.customer.postal_code or "",
-                    "country": invoice.customer.country
-                }
-            },
-            "invoiceLines": [
-                {
-                    "description": item.description,
-                    "quantity": float(item.quantity),
-                    "unitPrice": float(item.unit_price),
-                    "vatRate": float(item.vat_rate),
-                    "vatAmount": float(item.vat_amount),
-                    "discount": float(item.discount),
-                    "lineTotal": float(item.total)
-                }
-                for item in invoice.items.all()
-            ],
-            "totals": {
-                "subtotal": float(invoice.subtotal),
-                "vatAmount": float(invoice.vat_amount),
-                "discount": float(invoice.discount),
-                "total": float(invoice.total)
-            }
-        }
-        return invoice_data
+        return serializers.invoice_payload(invoice)
     
     def submit_invoice(self, invoice):
         """
         Submit invoice to ZATCA for approval
         """
+        call = ApiCall('submit_invoice')
         try:
-            invoice_data = self.prepare_invoice_data(invoice)
+            # Checked locally first, so an invalid invoice costs no API call
+            document = serializers.invoice_payload(invoice)
+            issues = validation.validate(invoice, document)
+            if issues:
+                error_msg = "Validation failed: " + '; '.join(str(issue) for issue in issues[:MAX_REPORTED_ISSUES])
+                if len(issues) > MAX_REPORTED_ISSUES:
+                    error_msg += f" (and {len(issues) - MAX_REPORTED_ISSUES} more)"
+                return False, error_msg, {'errors': [issue._asdict() for issue in issues]}
+            if invoice.status == 'draft':
+                # Issue with the details as they are now; saved with the new status
+                invoice.freeze_parties()
+            # Encoded once: the logged request is byte for byte the body sent
+            payload = serializers.encode(document)
             
             # Log the request
             log = ZATCALog.objects.create(
                 invoice=invoice,
                 action='submit_invoice',
-                request_data=invoice_data
+                request_data=payload.data,
+                request_sha256=payload.sha256
             )
             
             # Make API call
-            response = requests.post(
-                f"{self.api_url}/invoices",
-                headers=self.headers,
-                json=invoice_data,
-                timeout=30
-            )
+            response = self._send(call, 'POST', '/invoices', data=payload.body)
             
             # Update log with response
-            log.response_data = response.json() if response.content else {}
+            response_data = serializers.decode(response.content)
+            log.response_data = response_data
             log.status_code = response.status_code
             log.success = response.status_code == 200
+            log.timings = call.as_dict()
             
             if response.status_code == 200:
-                response_data = response.json()
                 # Update invoice with ZATCA response
                 invoice.uuid = response_data.get('uuid')
                 invoice.qr_code = response_data.get('qrCode')
@@ -115,18 +136,20 @@ class ZATCAService:
                 error_msg = f"ZATCA API Error: {response.status_code}"
                 log.error_message = error_msg
                 log.save()
-                return False, error_msg, response.json() if response.content else {}
+                return False, error_msg, response_data
                 
         except requests.exceptions.RequestException as e:
             error_msg = f"Network error: {str(e)}"
             if 'log' in locals():
                 log.error_message = error_msg
+                log.timings = call.as_dict()
                 log.save()
             return False, error_msg, {}
         except Exception as e:
             error_msg = f"Error: {str(e)}"
             if 'log' in locals():
                 log.error_message = error_msg
+                log.timings = call.as_dict()
                 log.save()
             return False, error_msg, {}
     
@@ -138,11 +161,7 @@ class ZATCAService:
             return False, "Invoice not yet submitted to ZATCA", {}
         
         try:
-            response = requests.get(
-                f"{self.api_url}/invoices/{invoice.uuid}",
-                headers=self.headers,
-                timeout=30
-            )
+            response = self._send(ApiCall('check_status'), 'GET', f"/invoices/{invoice.uuid}")
             
             if response.status_code == 200:
                 data = response.json()
@@ -160,34 +179,33 @@ class ZATCAService:
         if not invoice.uuid:
             return False, "Invoice not yet submitted to ZATCA", {}
         
+        call = ApiCall('cancel_invoice')
         try:
-            cancel_data = {
+            payload = serializers.encode({
                 "uuid": invoice.uuid,
                 "reason": reason
-            }
+            })
             
             log = ZATCALog.objects.create(
                 invoice=invoice,
                 action='cancel_invoice',
-                request_data=cancel_data
+                request_data=payload.data,
+                request_sha256=payload.sha256
             )
             
-            response = requests.post(
-                f"{self.api_url}/invoices/{invoice.uuid}/cancel",
-                headers=self.headers,
-                json=cancel_data,
-                timeout=30
-            )
+            response = self._send(call, 'POST', f"/invoices/{invoice.uuid}/cancel", data=payload.body)
             
-            log.response_data = response.json() if response.content else {}
+            response_data = serializers.decode(response.content)
+            log.response_data = response_data
             log.status_code = response.status_code
             log.success = response.status_code == 200
+            log.timings = call.as_dict()
             
             if response.status_code == 200:
                 invoice.status = 'cancelled'
                 invoice.save()
                 log.save()
-                return True, "Invoice cancelled successfully", response.json()
+                return True, "Invoice cancelled successfully", response_data
             else:
                 error_msg = f"Error: {response.status_code}"
                 log.error_message = error_msg
@@ -198,6 +216,7 @@ class ZATCAService:
             error_msg = f"Error: {str(e)}"
             if 'log' in locals():
                 log.error_message = error_msg
+                log.timings = call.as_dict()
                 log.save()
             return False, error_msg, {}
     
@@ -221,8 +240,9 @@ class ZATCAService:
             timestamp = f"{invoice.issue_date}T{invoice.issue_time}"
             
             tlv_data = b''
-            tlv_data += encode_tlv(1, invoice.company.name)
-            tlv_data += encode_tlv(2, invoice.company.vat_number)
+            seller = invoice.seller
+            tlv_data += encode_tlv(1, seller['name'])
+            tlv_data += encode_tlv(2, seller['vat_number'])
             tlv_data += encode_tlv(3, timestamp)
             tlv_data += encode_tlv(4, str(invoice.total))
             tlv_data += encode_tlv(5, str(invoice.vat_amount))
@@ -27,6 +27,9 @@ document.addEventListener('DOMContentLoaded', function() {
         setupInvoiceCalculations();
     }
 
+    // Server-side autocomplete for large selects (company, customer)
+    document.querySelectorAll('select[data-autocomplete-url]').forEach(setupAutocomplete);
+
     // Table row highlight
     const tableRows = document.querySelectorAll('table tbody tr');
     tableRows.forEach(row => {
@@ -81,6 +84,66 @@ function calculateRowTotal(row) {
     });
 }
 
+// Autocomplete: a search box above the select; matching options are fetched as the user types
+function setupAutocomplete(select) {
+    const input = document.createElement('input');
+    input.type = 'search';
+    input.className = 'form-control mb-1';
+    input.placeholder = 'Type to search by name or VAT number...';
+    input.autocomplete = 'off';
+
+    const results = document.createElement('div');
+    results.className = 'list-group position-absolute w-100 shadow-sm';
+    results.style.zIndex = 1000;
+
+    const wrapper = document.createElement('div');
+    wrapper.className = 'position-relative';
+    select.parentNode.insertBefore(wrapper, select);
+    wrapper.append(input, results, select);
+
+    let timer = null;
+    let controller = null;
+
+    const choose = (item) => {
+        select.replaceChildren(new Option('---------', ''), new Option(item.text, item.id, true, true));
+        select.dispatchEvent(new Event('change', { bubbles: true }));
+        input.value = '';
+        results.replaceChildren();
+    };
+
+    const search = () => {
+        if (controller) controller.abort();
+        controller = new AbortController();
+        fetch(`${select.dataset.autocompleteUrl}?q=${encodeURIComponent(input.value)}`, { signal: controller.signal })
+            .then(response => response.json())
+            .then(data => {
+                results.replaceChildren(...data.results.map(item => {
+                    const button = document.createElement('button');
+                    button.type = 'button';
+                    button.className = 'list-group-item list-group-item-action';
+                    button.textContent = item.vat_number ? `${item.text} (${item.vat_number})` : item.text;
+                    button.addEventListener('click', () => choose(item));
+                    return button;
+                }));
+            })
+            .catch(error => {
+                if (error.name !== 'AbortError') console.error('Autocomplete error:', error);
+            });
+    };
+
+    input.addEventListener('input', () => {
+        clearTimeout(timer);
+        timer = setTimeout(search, 200);
+    });
+    input.addEventListener('focus', search);
+    input.addEventListener('keydown', (e) => {
+        if (e.key === 'Escape') results.replaceChildren();
+    });
+    document.addEventListener('click', (e) => {
+        if (!wrapper.contains(e.target)) results.replaceChildren();
+    });
+}
+
 // AJAX status check
 function checkInvoiceStatus(invoiceId) {
     fetch(`/invoices/${invoiceId}/status/`, {
@@ -0,0 +1,84 @@
+"""
+Database configuration built from environment variables.
+
+ZATCA_DB_ENGINE selects the backend:
+
+  sqlite (default)  Single-node deployments. BEGIN IMMEDIATE transactions and a
+                    20 s busy timeout; with ZATCA_SQLITE_PROFILE=tuned (default)
+                    the PRAGMAs in SQLITE_PRAGMAS are applied to every new
+                    connection by invoices.signals.configure_sqlite.
+  postgresql        ZATCA_DB_NAME, ZATCA_DB_USER, ZATCA_DB_PASSWORD, ZATCA_DB_HOST
+                    and ZATCA_DB_PORT. With ZATCA_DB_POOL=1 (default) connections
+                    come from a psycopg_pool pool (ZATCA_DB_POOL_MIN_SIZE,
+                    ZATCA_DB_POOL_MAX_SIZE, ZATCA_DB_POOL_TIMEOUT); with
+                    ZATCA_DB_POOL=0 they are persistent per worker
+                    (ZATCA_DB_CONN_MAX_AGE seconds) and health-checked before reuse.
+"""
+import os
+
+
+SQLITE_TUNED_PRAGMAS = {
+    'journal_mode': 'WAL',        # readers no longer block the writer
+    'synchronous': 'NORMAL',      # fsync at checkpoints only; safe with WAL
+    'busy_timeout': 20000,        # ms to wait for the write lock before "database is locked"
+    'mmap_size': 268435456,       # 256 MiB of the file memory-mapped for reads
+    'temp_store': 'MEMORY',
+    'cache_size': -20000,         # ~20 MiB page cache per connection
+}
+
+
+def _env_bool(name, default):
+    return os.environ.get(name, '1' if default else '0').lower() in ('1', 'true', 'yes', 'on')
+
+
+def database_settings(base_dir):
+    """Return (DATABASES, SQLITE_PRAGMAS) for the configured engine"""
+    engine = os.environ.get('ZATCA_DB_ENGINE', 'sqlite')
+
+    if engine == 'postgresql':
+        default = {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('ZATCA_DB_NAME', 'zatca'),
+            'USER': os.environ.get('ZATCA_DB_USER', 'zatca'),
+            'PASSWORD': os.environ.get('ZATCA_DB_PASSWORD', ''),
+            'HOST': os.environ.get('ZATCA_DB_HOST', 'localhost'),
+            'PORT': os.environ.get('ZATCA_DB_PORT', '5432'),
+            'OPTIONS': {},
+        }
+        if _env_bool('ZATCA_DB_POOL', True):
+            # Pooled connections are checked out per request; Django requires
+            # CONN_MAX_AGE = 0 when pooling.
+            default['CONN_MAX_AGE'] = 0
+            default['OPTIONS']['pool'] = {
+                'min_size': int(os.environ.get('ZATCA_DB_POOL_MIN_SIZE', 2)),
+                'max_size': int(os.environ.get('ZATCA_DB_POOL_MAX_SIZE', 10)),
+                'timeout': float(os.environ.get('ZATCA_DB_POOL_TIMEOUT', 10)),
+                'max_idle': 300,
+                'max_lifetime': 3600,
+            }
+            try:
+                from psycopg_pool import ConnectionPool
+                default['OPTIONS']['pool']['check'] = ConnectionPool.check_connection
+            except (ImportError, AttributeError):
+                pass
+        else:
+            default['CONN_MAX_AGE'] = int(os.environ.get('ZATCA_DB_CONN_MAX_AGE', 600))
+            default['CONN_HEALTH_CHECKS'] = True
+        return {'default': default}, {}
+
+    if engine != 'sqlite':
+        raise ValueError(f"Unsupported ZATCA_DB_ENGINE '{engine}' (expected sqlite or postgresql)")
+
+    default = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ.get('ZATCA_DB_NAME', base_dir / 'db.sqlite3'),
+        'OPTIONS': {
+            # Take the write lock at BEGIN so concurrent writers wait on the
+            # busy timeout instead of failing when upgrading a read lock.
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+    }
+    profile = os.environ.get('ZATCA_SQLITE_PROFILE', 'tuned')
+    pragmas = SQLITE_TUNED_PRAGMAS if profile == 'tuned' else {}
+    return {'default': default}, pragmas
@@ -10,8 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+from .database import database_settings
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -41,6 +44,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'invoices.middleware.QueryMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -73,12 +77,8 @@ WSGI_APPLICATION = 'zatca_project.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/6.0/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
-}
+# Selected with ZATCA_DB_ENGINE (sqlite or postgresql); see zatca_project/database.py
+DATABASES, SQLITE_PRAGMAS = database_settings(BASE_DIR)
 
 
 # Password validation
@@ -127,3 +127,50 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 ZATCA_API_URL = 'https://api.zatca.gov.sa/e-invoicing'  # Update with actual endpoint
 ZATCA_API_KEY = ''  # Add your ZATCA API key
 ZATCA_CERTIFICATE_PATH = BASE_DIR / 'certificates'
+ZATCA_TIMEOUT = 30  # seconds, per attempt
+ZATCA_MAX_RETRIES = 3  # retries on connection errors; on read errors, 429 and 503 for GET only
+ZATCA_RETRY_BACKOFF = 0.5  # seconds, doubled after each retry
+ZATCA_RETRY_MAX_WAIT = 5  # seconds, longest wait before a retry, Retry-After included
+ZATCA_POOL_MAXSIZE = 10  # keep-alive connections per host per thread
+ZATCA_ERROR_BUDGET = 0.01  # tolerated failed-call ratio per action, used by zatca_latency_report
+
+# Invoice numbering (see invoices.sequences); the format also takes {company} and {year}
+INVOICE_NUMBER_SERIES = 'INV'
+INVOICE_NUMBER_FORMAT = '{series}-{company}-{year}-{number:06d}'
+
+# Each invoice line posts 7 form fields; Django's default of 1000 rejects drafts over ~140 lines
+DATA_UPLOAD_MAX_NUMBER_FIELDS = 20000
+
+# Large invoices (see invoices.streaming)
+INVOICE_LINES_PER_PAGE = 100  # lines per page on the invoice detail view
+INVOICE_STREAM_CHUNK_SIZE = 2000  # lines fetched and rendered at a time by print and CSV export
+
+# Batch jobs (see invoices.batch)
+BATCH_CLAIM_SIZE = 100  # jobs a process_batch_jobs worker claims at a time
+BATCH_LEASE_SECONDS = 300  # how long a job may run before another worker may claim it again
+BATCH_WORKERS = os.cpu_count() or 1  # shards assumed by process_batch_jobs --status and /metrics
+
+# Change feed (see invoices.changes)
+CHANGE_FEED_PAGE_SIZE = 500  # most events per response; ?limit= may ask for fewer
+CHANGE_FEED_MAX_WAIT = 30  # seconds a long-poll request (?wait=) may hold a worker
+CHANGE_FEED_STREAM_SECONDS = 30  # lifetime of a server-sent events response before the client reconnects
+CHANGE_FEED_POLL_INTERVAL = 1.0  # seconds between checks for new events while waiting
+CHANGE_FEED_IDLE_POLL_INTERVAL = 8.0  # longest interval an idle feed backs off to; its DB connection is closed before these
+CHANGE_FEED_HEARTBEAT = 15  # seconds of silence before an event stream sends a keepalive comment
+
+# Admin changelists on PostgreSQL use the planner's row estimate instead of
+# COUNT(*) for unfiltered tables with at least this many rows
+ADMIN_ESTIMATED_COUNT_MIN = 100000
+
+# Per-process Company/Customer cache (see invoices.refcache)
+REFCACHE_MAXSIZE = 10000  # entries per model; each row takes a pk and a VAT number entry
+REFCACHE_TTL = 300  # seconds; bounds staleness in processes that did not see the change
+
+# Search
+SEARCH_ADMIN_LIMIT = 1000  # most index hits an admin changelist search returns
+
+# Request instrumentation (invoices.middleware.QueryMetricsMiddleware)
+QUERY_METRICS_ENABLED = True
+QUERY_METRICS_DUPLICATE_THRESHOLD = 5  # same SQL this many times in one request is flagged as N+1
+QUERY_METRICS_ASSERT = False  # raise QueryBudgetExceeded instead of only recording (for tests)
+QUERY_METRICS_MAX_QUERIES = None
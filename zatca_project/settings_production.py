@@ -0,0 +1,59 @@
+"""
+Production settings: DEBUG off, cached templates, persistent database
+connections, compressed responses and fingerprinted, pre-compressed static
+files served with immutable cache headers.
+
+Select with DJANGO_SETTINGS_MODULE=zatca_project.settings_production and run
+`python manage.py collectstatic --noinput` on every deploy. ZATCA_SECRET_KEY
+is required; ZATCA_ALLOWED_HOSTS is a comma-separated host list.
+"""
+import os
+
+from django.core.exceptions import ImproperlyConfigured
+
+from .settings import *  # noqa: F401,F403
+from .settings import BASE_DIR, DATABASES, MIDDLEWARE, TEMPLATES
+
+DEBUG = False
+
+SECRET_KEY = os.environ.get('ZATCA_SECRET_KEY')
+if not SECRET_KEY:
+    raise ImproperlyConfigured("Set ZATCA_SECRET_KEY for the production settings")
+
+ALLOWED_HOSTS = [host.strip() for host in os.environ.get('ZATCA_ALLOWED_HOSTS', 'localhost,127.0.0.1').split(',') if host.strip()]
+
+# Cookies only travel over HTTPS unless ZATCA_HTTPS=0 (e.g. a local load test)
+SESSION_COOKIE_SECURE = CSRF_COOKIE_SECURE = os.environ.get('ZATCA_HTTPS', '1') != '0'
+
+# Templates are compiled once per process; nothing watches them for changes
+TEMPLATES = [{
+    **TEMPLATES[0],
+    'APP_DIRS': False,
+    'OPTIONS': {
+        **TEMPLATES[0]['OPTIONS'],
+        'loaders': [('django.template.loaders.cached.Loader', [
+            'django.template.loaders.filesystem.Loader',
+            'django.template.loaders.app_directories.Loader',
+        ])],
+    },
+}]
+
+# Keep connections open between requests (SQLite and unpooled PostgreSQL);
+# a pooled PostgreSQL configuration keeps CONN_MAX_AGE = 0 as Django requires
+DATABASES['default'].setdefault('CONN_MAX_AGE', int(os.environ.get('ZATCA_DB_CONN_MAX_AGE', 600)))
+DATABASES['default'].setdefault('CONN_HEALTH_CHECKS', True)
+
+# Compression goes before anything that reads or writes the response body;
+# static files are answered right after it, before sessions and auth run
+MIDDLEWARE = [
+    *MIDDLEWARE[:2],
+    'invoices.middleware.CompressionMiddleware',
+    'invoices.staticfiles.StaticFilesMiddleware',
+    *MIDDLEWARE[2:],
+]
+
+STATIC_ROOT = os.environ.get('ZATCA_STATIC_ROOT', BASE_DIR / 'staticfiles')
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'invoices.staticfiles.CompressedManifestStaticFilesStorage'},
+}